@@ -283,6 +283,7 @@ def pasteAsTemplate(self: Cmdr, event: LeoKeyEvent = None) -> None:
         v.b = b
 
         # and finally insert it at the given index
+        c.frame.tree.generation += 1
         vpar.children.insert(index, v)
         v.parents.append(vpar)
 
@@ -1484,6 +1485,7 @@ def demote(self: Cmdr, event: LeoKeyEvent = None) -> None:
     n = p.childIndex()
     followingSibs = parent_v.children[n + 1 :]
     # Remove the moved nodes from the parent's children.
+    c.frame.tree.generation += 1
     parent_v.children = parent_v.children[: n + 1]
     # Add the moved nodes to p's children
     p.v.children.extend(followingSibs)
@@ -1825,6 +1827,7 @@ def sortSiblings(
     c.setChanged()
     bunch = u.beforeSort(p, undoType, oldChildren, newChildren, sortChildren)
     # A copy, so its not the undo bead's oldChildren. Fixes #3205
+    c.frame.tree.generation += 1
     parent_v.children = newChildren[:]
     u.afterSort(p, bunch)
     # Sorting destroys position p, and possibly the root position.
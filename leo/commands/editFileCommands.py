@@ -227,12 +227,8 @@ class EditFileCommandsClass(BaseEditCommandsClass):
     #@+node:ekr.20170806094319.10: *4* efc.cleanAtCleanTree
     @cmd('clean-at-clean-tree')
     def cleanAtCleanTree(self, event: LeoKeyEvent) -> None:
-        """
-        Clean whitespace in the nearest @clean tree.
-
-        This command is not undoable.
-        """
-        c = self.c
+        """Clean whitespace in the nearest @clean tree."""
+        c, u = self.c, self.c.undoer
         # Look for an @clean node.
         for p in c.p.self_and_parents(copy=False):
             if p.isAtCleanNode():
@@ -240,13 +236,14 @@ class EditFileCommandsClass(BaseEditCommandsClass):
         else:
             g.es_print('no @clean node found', p.h, color='blue')
             return
+        bunch = u.beforeChangeTree(p)
         n = 0
         for p2 in p.subtree():
             if self.cleanAtCleanNode(p2):
                 n += 1
         if n > 0:
             c.setChanged()
-            c.undoer.clearAndWarn('clean-at-clean-tree')
+            u.afterChangeTree(p, 'clean-at-clean-tree', bunch)
         g.es_print(f"{n} node{g.plural(n)} cleaned")
     #@+node:ekr.20170806094317.6: *3* efc.compareAnyTwoFiles & helpers
     @cmd('file-compare-two-leo-files')
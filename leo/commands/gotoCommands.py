@@ -333,17 +333,9 @@ class GoToCommands:
         if c.p.gnx == gnx:
             return c.p.copy()
 
-        # Search the entire outline.
-        positions: list[Position]
+        # Find the last (or first) position in outline order.
         backwards = c.config.getBool('search-links-backwards', default=True)
-        if backwards:
-            positions = list(reversed(list(c.all_positions())))
-        else:
-            positions = list(c.all_positions())
-        for p in positions:
-            if p.v.fileIndex == gnx:
-                return p.copy()
-        return None
+        return c.positionForGnx(gnx, last=backwards)
     #@+node:ekr.20100216141722.5627: *4* goto.find_root
     def find_root(self, p: Position) -> tuple[Position, str]:
         """
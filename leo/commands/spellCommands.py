@@ -5,7 +5,9 @@
 #@+node:ekr.20150514050530.1: ** << spellCommands imports & annotations >>
 from __future__ import annotations
 from collections.abc import Callable
+import hashlib
 import re
+import time
 from typing import Any, Optional, TYPE_CHECKING
 # Third-party annotations
 try:
@@ -101,12 +103,30 @@ class BaseSpellWrapper:
     #@-others
 #@+node:ekr.20180207075606.1: ** class DefaultDict
 class DefaultDict:
-    """A class with the same interface as the enchant dict class."""
+    """
+    A class with the same interface as the enchant dict class.
+
+    suggest uses a symmetric-delete index (as in SymSpell) that maps
+    strings made by deleting characters from the first prefix_length
+    characters of each word to the words themselves. g.app.db caches the
+    index of the main dictionary.
+    """
+
+    cache_key = 'spell-delete-index'
+    cache_version = 1
+    max_distance = 2
+    prefix_length = 7
 
     def __init__(self, words: list[str] = None) -> None:
         self.added_words: set[str] = set()
         self.ignored_words: set[str] = set()
         self.words: set[str] = set() if words is None else set(words)
+        # The words from the main dictionary.
+        self.main_words: set[str] = set()
+        # Delete indices: keys are deletes, values are sequences of words.
+        # suggest creates both indices when first needed.
+        self.main_index: dict[str, tuple[str, ...]] = None  # For self.main_words. Immutable.
+        self.extra_index: dict[str, list[str]] = None  # For all other words.
 
     #@+others
     #@+node:ekr.20180207075740.1: *3* DefaultDict.add
@@ -114,12 +134,21 @@ class DefaultDict:
         """Add a word to the dictionary."""
         self.words.add(word)
         self.added_words.add(word)
+        if self.extra_index is not None and word not in self.main_words:
+            self.index_word(word, self.extra_index)
     #@+node:ekr.20180207101513.1: *3* DefaultDict.add_words_from_dict
     def add_words_from_dict(self, kind: str, fn: str, words: list[str]) -> None:
         """For use by DefaultWrapper."""
-        for word in words or []:
-            self.words.add(word)
-            self.words.add(word.lower())
+        new_words = set(words or [])
+        new_words |= {z.lower() for z in new_words}
+        if kind == 'main':
+            if not new_words <= self.main_words:
+                self.main_words |= new_words
+                self.main_index = self.extra_index = None
+        elif self.extra_index is not None:
+            for word in new_words - self.words - self.main_words:
+                self.index_word(word, self.extra_index)
+        self.words |= new_words
     #@+node:ekr.20180207075751.1: *3* DefaultDict.add_to_session
     def add_to_session(self, word: str) -> None:
 
@@ -133,18 +162,96 @@ class DefaultDict:
         return False
     #@+node:ekr.20180207081634.1: *3* DefaultDict.suggest & helpers
     def suggest(self, word: str) -> list[str]:
+        """
+        Return the sorted list of the dictionary words closest to word,
+        at most self.max_distance edits away.
+        """
+        assert word not in self.words, repr(word)
+        self.init_indices()
+        limit = self.max_distance
+        distances: dict[str, int] = {}
+        for delete in self.deletes(word[: self.prefix_length]):
+            for index in (self.main_index, self.extra_index):
+                for word2 in index.get(delete, ()):
+                    if word2 not in distances:
+                        distances[word2] = self.distance(word, word2, limit)
+        best = min([z for z in distances.values() if z <= limit], default=None)
+        if best is None:
+            return []
+        return sorted(z for z, n in distances.items() if n == best)
+    #@+node:ekr.20240424080925.1: *4* dict.deletes & index_word
+    def deletes(self, s: str) -> set[str]:
+        """Return s and all strings made by deleting up to max_distance characters from s."""
+        result, edge = {s}, {s}
+        for _i in range(self.max_distance):
+            edge = {z[:i] + z[i + 1 :] for z in edge for i in range(len(z))}
+            result |= edge
+        return result
+
+    def index_word(self, word: str, index: dict[str, list[str]]) -> None:
+        """Add word to the given delete index."""
+        for delete in self.deletes(word[: self.prefix_length]):
+            aList = index.get(delete)
+            if aList is None:
+                index[delete] = [word]
+            else:
+                aList.append(word)
+    #@+node:ekr.20240424081242.1: *4* dict.distance
+    def distance(self, s1: str, s2: str, limit: int) -> int:
+        """
+        Return the optimal string alignment distance between s1 and s2:
+        the number of insertions, deletions, replacements and transpositions
+        of adjacent characters that change s1 to s2.
 
-        def known(words: list[str]) -> list[str]:
-            """Return the words that are in the dictionary."""
-            return [z for z in list(set(words)) if z in self.words]
+        Return limit + 1 if the distance exceeds limit.
+        """
+        n1, n2 = len(s1), len(s2)
+        if abs(n1 - n2) > limit:
+            return limit + 1
+        prev2: list[int] = []
+        prev = list(range(n2 + 1))
+        for i in range(1, n1 + 1):
+            ch1 = s1[i - 1]
+            row = [i] + [0] * n2
+            for j in range(1, n2 + 1):
+                ch2 = s2[j - 1]
+                n = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (ch1 != ch2))
+                if i > 1 and j > 1 and ch1 == s2[j - 2] and s1[i - 2] == ch2:
+                    n = min(n, prev2[j - 2] + 1)
+                row[j] = n
+            if min(row) > limit:
+                return limit + 1
+            prev2, prev = prev, row
+        return min(prev[n2], limit + 1)
+    #@+node:ekr.20240424081559.1: *4* dict.init_indices
+    def init_indices(self) -> None:
+        """
+        Create the delete indices if they don't exist.
 
-        assert not known([word]), repr(word)
-        suggestions = (
-            known(self.edits1(word)) or
-            known(self.edits2(word))
-            # [word] # Fall back to the unknown word itself.
-        )
-        return suggestions
+        Use the cached index of the main dictionary if it is still valid.
+        """
+        if self.main_index is None:
+            main_words = sorted(self.main_words)
+            digest = hashlib.md5('\n'.join(main_words).encode('utf-8', 'surrogatepass')).hexdigest()
+            key = (self.cache_version, self.max_distance, self.prefix_length, digest)
+            d = g.app.db.get(self.cache_key) if g.app.db else None
+            if isinstance(d, dict) and d.get('key') == key:
+                self.main_index = d['index']
+            else:
+                t1 = time.process_time()
+                index: dict[str, list[str]] = {}
+                for word in main_words:
+                    self.index_word(word, index)
+                # Tuples pickle and unpickle much faster than lists.
+                self.main_index = {delete: tuple(aList) for delete, aList in index.items()}
+                if g.app.db:
+                    g.app.db[self.cache_key] = {'key': key, 'index': self.main_index}
+                if 'speed' in g.app.debug:
+                    g.trace(f"{len(main_words)} words in {time.process_time() - t1:4.2f} sec.")
+        if self.extra_index is None:
+            self.extra_index = {}
+            for word in self.words - self.main_words:
+                self.index_word(word, self.extra_index)
     #@+node:ekr.20180207085717.1: *4* dict.edits1 & edits2
     #@@nobeautify
 
@@ -182,8 +289,8 @@ class DefaultWrapper(BaseSpellWrapper):
         # pylint: disable=super-init-not-called
         self.c = c
         if not g.app.spellDict:
-            g.app.spellDict = DefaultDict().d  # 2024/04/09: bug fix.
-        self.d: dict = g.app.spellDict
+            g.app.spellDict = DefaultDict()
+        self.d: DefaultDict = g.app.spellDict
         self.user_fn = self.find_user_dict()
         if not g.os_path_exists(self.user_fn):
             self.create(self.user_fn)
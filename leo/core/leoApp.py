@@ -176,7 +176,7 @@ class LeoApp:
         self.leoID: str = None  # The id part of gnx's.
         self.lossage: list[LossageData] = []  # List of last 100 keystrokes.
         self.paste_c: Cmdr = None  # The commander that pasted the last outline.
-        self.spellDict: Optional[dict] = None  # 2024/04/09: A plain dict.
+        self.spellDict: Any = None  # A DefaultDict or an enchant dict.
         self.numberOfUntitledWindows = 0  # Number of opened untitled windows.
         self.windowList: list[LeoFrame] = []  # Global list of all frames.
         self.realMenuNameDict: dict[str, str] = {}  # Translations of menu names.
@@ -1297,6 +1297,10 @@ class LeoApp:
             g.app.externalFilesController.destroy_frame(frame)
         if frame in g.app.windowList:
             g.app.forgetOpenFile(frame.c.fileName())
+        if frame.c and frame.c.fileCommands:
+            frame.c.fileCommands.closeDbBodyConnection()
+        if frame.c and frame.c.searchIndex:
+            frame.c.searchIndex.save()
         # force the window to go away now.
         # Important: this also destroys all the objects of the commander.
         frame.destroySelf()
@@ -5,6 +5,8 @@
 #@+node:ekr.20041005105605.2: ** << leoAtFile imports & annotations >>
 from __future__ import annotations
 from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
 import io
 import os
 import re
@@ -63,14 +65,23 @@ class AtFile:
         self.section_delim2 = '>>'
         # **Only** at.writeAll manages these flags.
         self.unchangedFiles = 0
+        self.pendingWrites: dict[str, tuple] = {}  # Keys are real paths.
+        self.writeExecutor: Optional[ThreadPoolExecutor] = None
+        # Keys are real paths. Values are (md5 digest, st_mtime_ns, st_size).
+        self.fileHashes: dict[str, tuple[str, int, int]] = {}
+        # **Only** at.readFilesAtPositions manages these ivars.
+        self.prefetchedFiles: dict[str, Future] = {}  # Keys are normalized paths.
+        self.readTimings: list[tuple[float, str]] = []  # (seconds, headline) for each file read.
         # promptForDangerousWrite sets cancelFlag and yesToAll only if canCancelFlag is True.
         self.canCancelFlag = False
         self.cancelFlag = False
         self.yesToAll = False
         # User options: set in reloadSettings.
         self.checkPythonCodeOnWrite = False
+        self.readFilesInParallel = True
         self.runFlake8OnWrite = False
         self.runPyFlakesOnWrite = False
+        self.writeFilesInParallel = True
         self.reloadSettings()
     #@+node:ekr.20171113152939.1: *5* at.reloadSettings
     def reloadSettings(self) -> None:
@@ -78,6 +89,10 @@ class AtFile:
         c = self.c
         self.checkPythonCodeOnWrite = c.config.getBool(
             'check-python-code-on-write', default=True)
+        self.readFilesInParallel = c.config.getBool(
+            'read-external-files-in-parallel', default=True)
+        self.writeFilesInParallel = c.config.getBool(
+            'write-external-files-in-parallel', default=True)
         self.runFlake8OnWrite = c.config.getBool(
             'run-flake8-on-write', default=False)
         self.runPyFlakesOnWrite = c.config.getBool(
@@ -342,8 +357,7 @@ class AtFile:
         t1 = time.time()
         c.init_error_dialogs()
         files = at.findFilesToRead(root, all=True)
-        for p in files:
-            at.readFileAtPosition(p)
+        at.readFilesAtPositions(files)
         for p in files:
             p.v.clearDirty()
         if not g.unitTesting and files:  # pragma: no cover
@@ -389,6 +403,51 @@ class AtFile:
             else:
                 p.moveToThreadNext()
         return files
+    #@+node:ekr.20240424060122.1: *6* at.readFilesAtPositions & helper
+    def readFilesAtPositions(self, files: list[Position]) -> None:
+        """
+        Read the @<file> nodes in files, setting at.readTimings.
+
+        Unless @bool read-external-files-in-parallel is False, a thread pool
+        first reads the contents of all @file, @thin and @clean files.
+        Decoding and updating the outline remain on the main thread: they
+        hold the GIL and must change vnodes in order.
+        """
+        at = self
+        timings: list[tuple[float, str]] = []
+        executor = None
+        if at.readFilesInParallel and len(files) > 1:
+            executor = ThreadPoolExecutor(thread_name_prefix='leo-read')
+            at.prefetchFiles(executor, files)
+        try:
+            for p in files:
+                t1 = time.perf_counter()
+                at.readFileAtPosition(p)
+                timings.append((time.perf_counter() - t1, p.h))
+        finally:
+            at.prefetchedFiles = {}
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+        at.readTimings = timings
+        if 'speed' in g.app.debug:  # pragma: no cover
+            total = sum(z[0] for z in timings)
+            g.trace(f"{len(timings)} files in {total:4.2f} sec. Slowest files...")
+            for t, h in sorted(timings, reverse=True)[:20]:
+                print(f"{t:6.3f} sec. {h}")
+    #@+node:ekr.20240424060439.1: *7* at.prefetchFiles
+    def prefetchFiles(self, executor: ThreadPoolExecutor, files: list[Position]) -> None:
+        """
+        Start reading the external files of all @file, @thin and @clean nodes in files.
+
+        at.openFileHelper uses the results instead of reading the files again.
+        """
+        at, c = self, self.c
+        for p in files:
+            if p.isAtThinFileNode() or p.isAtFileNode() or p.isAtCleanNode():
+                fileName = c.fullPath(p)
+                if fileName:
+                    key = os.path.normcase(os.path.normpath(fileName))
+                    at.prefetchedFiles[key] = executor.submit(at.readFileBytes, fileName)
     #@+node:ekr.20190108054803.1: *6* at.readFileAtPosition
     def readFileAtPosition(self, p: Position) -> None:  # pragma: no cover
         """Read the @<file> node at p."""
@@ -413,8 +472,7 @@ class AtFile:
         t1 = time.time()
         c.init_error_dialogs()
         files = at.findFilesToRead(root, all=False)
-        for p in files:
-            at.readFileAtPosition(p)
+        at.readFilesAtPositions(files)
         for p in files:
             p.v.clearDirty()
         if not g.unitTesting:  # pragma: no cover
@@ -757,11 +815,23 @@ class AtFile:
     def openFileHelper(self, fileName: str) -> bytes:  # *not* str!
         """Open a file, reporting all exceptions."""
         at = self
+        # Use the contents read by at.prefetchFiles, if possible.
+        if at.prefetchedFiles:
+            future = at.prefetchedFiles.pop(os.path.normcase(os.path.normpath(fileName)), None)
+            if future:
+                data = future.result()
+                if data is not None:
+                    stat, s_bytes = data
+                    at.rememberFileHash(fileName, s_bytes, stat)
+                    return s_bytes
         # #1798: return None as a flag on any error.
         s = None
         try:
+            # Get the stat *before* reading: see at.hasSameHash.
+            stat = os.stat(fileName)
             with open(fileName, 'rb') as f:
                 s = f.read()
+            at.rememberFileHash(fileName, s, stat)
         except IOError:  # pragma: no cover
             if not g.unitTesting:
                 at.error(f"can not open {fileName}")
@@ -994,11 +1064,20 @@ class AtFile:
         at.cancelFlag = False
         at.yesToAll = False
         files, root = at.findFilesToWrite(all)
-        for p in files:
-            try:
-                at.writeAllHelper(p, root)
-            except Exception:  # pragma: no cover
-                at.internalWriteError(p)
+        # at.replaceFile writes changed files in a thread pool.
+        if at.writeFilesInParallel and len(files) > 1:
+            at.writeExecutor = ThreadPoolExecutor(thread_name_prefix='leo-write')
+        try:
+            for p in files:
+                try:
+                    at.writeAllHelper(p, root)
+                except Exception:  # pragma: no cover
+                    at.internalWriteError(p)
+        finally:
+            at.finishPendingWrites()
+            if at.writeExecutor:
+                at.writeExecutor.shutdown(wait=True)
+                at.writeExecutor = None
         # Make *sure* these flags are cleared for other commands.
         at.canCancelFlag = False
         at.cancelFlag = False
@@ -2585,30 +2664,26 @@ class AtFile:
         # If file does not exist, create it from the contents.
         fileName = g.os_path_realpath(fileName)
         sfn = g.shortFileName(fileName)
+        if fileName in at.pendingWrites:  # pragma: no cover
+            at.finishPendingWrite(fileName)
+        s_bytes = g.toEncodedString(contents, encoding=encoding)
         if not g.os_path_exists(fileName):
-            ok = g.writeFile(contents, encoding, fileName)
-            if ok:
-                c.setFileTimeStamp(fileName)
-                if not g.unitTesting:
-                    g.es(f"{timestamp}created: {fileName}")  # pragma: no cover
-                if root:
-                    # Fix bug 889175: Remember the full fileName.
-                    at.rememberReadPath(fileName, root)
-                    at.checkPythonCode(contents, fileName, root)
-            else:
-                at.addToOrphanList(root)  # pragma: no cover
+            at.writeFileHelper(s_bytes, contents, fileName, root, timestamp, created=True)
             # No original file to change. Return value tested by a unit test.
             return False  # No change to original file.
         #
         # Compare the old and new contents.
-        old_contents = g.readFileIntoUnicodeString(fileName,
-            encoding=at.encoding, silent=True)
-        if not old_contents:
-            old_contents = ''
-        unchanged = (
-            contents == old_contents
-            or (not at.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents))
-            or ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
+        # Don't read the file if its contents are known to be unchanged.
+        unchanged = at.hasSameHash(fileName, s_bytes)
+        if not unchanged:
+            data = at.readFileBytes(fileName)
+            if data:
+                at.rememberFileHash(fileName, data[1], data[0])
+            old_contents = g.toUnicode(data[1], encoding=at.encoding) if data else ''
+            unchanged = (
+                contents == old_contents
+                or (not at.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents))
+                or ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
         if unchanged:
             at.unchangedFiles += 1
             if not g.unitTesting and c.config.getBool(
@@ -2628,9 +2703,54 @@ class AtFile:
                 g.warning("correcting line endings in:", fileName)
         #
         # Write a changed file.
-        ok = g.writeFile(contents, encoding, fileName)
+        return at.writeFileHelper(s_bytes, contents, fileName, root, timestamp, created=False)
+    #@+node:ekr.20240424061113.1: *6* at.finishPendingWrite(s)
+    def finishPendingWrite(self, fileName: str) -> None:
+        """Wait for the pending write of fileName, then call at.finishWrite."""
+        at = self
+        future, s_bytes, contents, root, timestamp, created = at.pendingWrites.pop(fileName)
+        at.finishWrite(future.result(), s_bytes, contents, fileName, root, timestamp, created)
+
+    def finishPendingWrites(self) -> None:
+        """Finish all pending writes, in the order in which they started."""
+        at = self
+        for fileName in list(at.pendingWrites):
+            try:
+                at.finishPendingWrite(fileName)
+            except Exception:  # pragma: no cover
+                g.es_exception()
+    #@+node:ekr.20240424061430.1: *6* at.finishWrite
+    def finishWrite(self,
+        ok: bool,
+        s_bytes: bytes,
+        contents: str,
+        fileName: str,
+        root: Position,
+        timestamp: str,
+        created: bool,
+    ) -> None:
+        """
+        Finish writing fileName, on the main thread.
+
+        created: True if the file did not exist before the write.
+        """
+        at, c = self, self.c
+        sfn = g.shortFileName(fileName)
         if ok:
             c.setFileTimeStamp(fileName)
+            at.rememberFileHash(fileName, s_bytes)
+        if created:
+            if ok:
+                if not g.unitTesting:
+                    g.es(f"{timestamp}created: {fileName}")  # pragma: no cover
+                if root:
+                    # Fix bug 889175: Remember the full fileName.
+                    at.rememberReadPath(fileName, root)
+                    at.checkPythonCode(contents, fileName, root)
+            else:
+                at.addToOrphanList(root)  # pragma: no cover
+            return
+        if ok:
             if not g.unitTesting:
                 g.es(f"{timestamp}wrote: {sfn}")  # pragma: no cover
         else:  # pragma: no cover
@@ -2639,6 +2759,79 @@ class AtFile:
             at.addToOrphanList(root)
         # Check *after* writing the file.
         at.checkPythonCode(contents, fileName, root)
+    #@+node:ekr.20240424061747.1: *6* at.hasSameHash & rememberFileHash
+    def hasSameHash(self, fileName: str, s_bytes: bytes) -> bool:
+        """
+        Return True if the file is known to contain s_bytes, without reading the file.
+
+        at.fileHashes contains the hash of each file as last read or written,
+        along with the file's modification time and size at that time.
+        """
+        data = self.fileHashes.get(g.os_path_realpath(fileName))
+        if not data:
+            return False
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            return False
+        digest, mtime, size = data
+        return (
+            stat.st_size == size
+            and stat.st_mtime_ns == mtime
+            and hashlib.md5(s_bytes).hexdigest() == digest
+        )
+
+    def rememberFileHash(self, fileName: str, s_bytes: bytes, stat: Any = None) -> None:
+        """
+        Remember that s_bytes are the contents of the file.
+
+        stat: the file's stat, taken *before* reading the file.
+              A file that changes after the stat will never match.
+        """
+        try:
+            if stat is None:
+                stat = os.stat(fileName)
+        except OSError:
+            return
+        self.fileHashes[g.os_path_realpath(fileName)] = (
+            hashlib.md5(s_bytes).hexdigest(), stat.st_mtime_ns, stat.st_size)
+    #@+node:ekr.20240424062104.1: *6* at.readFileBytes
+    def readFileBytes(self, fileName: str) -> Optional[tuple[Any, bytes]]:
+        """
+        Return (stat, contents) for the given file, or None on any error.
+
+        This method does not report errors, so it is safe to call from any thread.
+        """
+        try:
+            stat = os.stat(fileName)
+            with open(fileName, 'rb') as f:
+                return stat, f.read()
+        except Exception:
+            return None
+    #@+node:ekr.20240424062421.1: *6* at.writeFileHelper
+    def writeFileHelper(self,
+        s_bytes: bytes,
+        contents: str,
+        fileName: str,
+        root: Position,
+        timestamp: str,
+        created: bool,
+    ) -> bool:
+        """
+        Write s_bytes, the encoded contents, to fileName.
+
+        Within at.writeAll, write the file in at.writeExecutor's thread pool.
+        at.finishPendingWrites will call at.finishWrite on the main thread.
+
+        Return True if the write succeeded or is pending.
+        """
+        at = self
+        if at.writeExecutor:
+            future = at.writeExecutor.submit(g.writeFile, s_bytes, at.encoding, fileName)
+            at.pendingWrites[fileName] = (future, s_bytes, contents, root, timestamp, created)
+            return True
+        ok = g.writeFile(s_bytes, at.encoding, fileName)
+        at.finishWrite(ok, s_bytes, contents, fileName, root, timestamp, created)
         return ok
     #@+node:ekr.20190114061452.27: *6* at.compareIgnoringBlankLines
     def compareIgnoringBlankLines(self, s1: str, s2: str) -> bool:  # pragma: no cover
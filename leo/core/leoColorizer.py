@@ -27,10 +27,10 @@ from leo.core.leoColor import leo_color_database
 #
 # Qt imports. May fail from the bridge.
 try:  # #1973
-    from leo.core.leoQt import Qsci, QtGui, QtWidgets
+    from leo.core.leoQt import Qsci, QtCore, QtGui, QtWidgets
     from leo.core.leoQt import UnderlineStyle, Weight  # #2330
 except Exception:
-    Qsci = QtGui = QtWidgets = None
+    Qsci = QtCore = QtGui = QtWidgets = None
     UnderlineStyle = Weight = None
 #@-<< leoColorizer imports >>
 #@+<< leoColorizer annotations >>
@@ -69,11 +69,14 @@ class BaseColorizer:
         # Configuration dicts...
         self.configDict: dict[str, Any] = {}  # Keys are tags, values are colors (names or values).
         self.configUnderlineDict: dict[str, bool] = {}  # Keys are tags, values are bools.
+        self.formatsDict: dict[str, tuple] = {}  # Keys are full tags, values are (format, colorName, font).
+        self.settings_generation = 0  # Incremented whenever the fonts or colors change.
         # Common state ivars...
         self.enabled = False  # Per-node enable/disable flag set by updateSyntaxColorer.
         self.highlighter: Any = g.NullObject()  # May be overridden in subclass...
         self.language = 'python'  # set by scanLanguageDirectives.
         self.prev: tuple[int, int, str] = None  # Used by setTag.
+        self.color_cache_formats: list[tuple] = None  # Set by the JEditColorizer while recording colors.
         self.showInvisibles = False
         # Statistics....
         self.count = 0
@@ -90,9 +93,15 @@ class BaseColorizer:
     #@+node:ekr.20110605121601.18578: *4* BaseColorizer.configureTags & helpers
     def configureTags(self) -> None:
         """Configure all tags."""
+        self.clear_formats()
         self.configure_fonts()
         self.configure_colors()
         self.configure_variable_tags()
+    #@+node:ekr.20240424113615.1: *5* BaseColorizer.clear_formats
+    def clear_formats(self) -> None:
+        """Clear all formats cached by setTag and invalidate all cached colors."""
+        self.formatsDict = {}
+        self.settings_generation += 1
     #@+node:ekr.20190324172632.1: *5* BaseColorizer.configure_colors & helper
     def configure_colors(self) -> None:
         """Configure all colors in the default colors dict."""
@@ -149,6 +158,7 @@ class BaseColorizer:
         - All fonts mentioned in any @font setting.
         """
         c = self.c
+        self.clear_formats()  # The zoom commands call this method directly.
         self.font_selectors = ('family', 'size', 'slant', 'weight')
         # Keys are font names. Values are Dicts[selector, value]
         self.new_fonts: dict[str, dict] = {}
@@ -580,7 +590,10 @@ class BaseColorizer:
         c, getBool = self.c, self.c.config.getBool
         #
         # Init all settings ivars.
+        self.color_cache_lines   = c.config.getInt("colorizer-cache-lines") or 0
         self.color_tags_list: list[str] = []
+        self.color_time_slice    = c.config.getInt("colorizer-time-slice") or 50
+        self.progressive_lines   = c.config.getInt("colorizer-progressive-lines") or 0
         self.showInvisibles      = getBool("show-invisibles-by-default")
         self.underline_undefined = getBool("underline-undefined-section-names")
         self.use_hyperlinks      = getBool("use-hyperlinks")
@@ -745,59 +758,67 @@ class BaseColorizer:
             return
         if not tag.strip():
             return
-        tag = tag.lower().strip()
-        # A hack to allow continuation dots on any tag.
-        dots = tag.startswith('dots')
-        if dots:
-            tag = tag[len('dots') :]
-        # This color name should already be valid.
-        d = self.configDict
-        colorName = d.get(f"{self.language}.{tag}") or d.get(tag)
-        if not colorName:
-            return
-        # New in Leo 5.8.1: allow symbolic color names here.
-        #                   (All keys in leo_color_database are normalized.)
-        colorName = self.normalize(colorName)
-        colorName = leo_color_database.get(colorName, colorName)
-        # Get the actual color.
-        color = self.actualColorDict.get(colorName)
-        if not color:
-            color = QtGui.QColor(colorName)
-            if color.isValid():
-                self.actualColorDict[colorName] = color
-            else:
-                # Leo 6.7.2: This should never happen: configure_colors does a pre-check.
-                report(extra='*** unknown color name')
-                g.trace(full_tag, d.get(full_tag))
-                g.trace(tag, d.get(tag))
+        # Reuse the format if possible. full_tag determines the format completely.
+        data = self.formatsDict.get(full_tag)
+        if data:
+            format, colorName, font = data
+        else:
+            tag = tag.lower().strip()
+            # A hack to allow continuation dots on any tag.
+            dots = tag.startswith('dots')
+            if dots:
+                tag = tag[len('dots') :]
+            # This color name should already be valid.
+            d = self.configDict
+            colorName = d.get(f"{self.language}.{tag}") or d.get(tag)
+            if not colorName:
                 return
-        underline = self.configUnderlineDict.get(tag)
-        format = QtGui.QTextCharFormat()
-        for font_name in (full_tag, tag, default_tag):
-            font = self.fonts.get(font_name)
-            if font:
-                format.setFont(font)
-                self.configure_hard_tab_width(font)  # #1919.
-                break
-        if tag in ('blank', 'tab'):
-            if tag == 'tab' or colorName == 'black':
+            # New in Leo 5.8.1: allow symbolic color names here.
+            #                   (All keys in leo_color_database are normalized.)
+            colorName = self.normalize(colorName)
+            colorName = leo_color_database.get(colorName, colorName)
+            # Get the actual color.
+            color = self.actualColorDict.get(colorName)
+            if not color:
+                color = QtGui.QColor(colorName)
+                if color.isValid():
+                    self.actualColorDict[colorName] = color
+                else:
+                    # Leo 6.7.2: This should never happen: configure_colors does a pre-check.
+                    report(extra='*** unknown color name')
+                    g.trace(full_tag, d.get(full_tag))
+                    g.trace(tag, d.get(tag))
+                    return
+            underline = self.configUnderlineDict.get(tag)
+            format = QtGui.QTextCharFormat()
+            for font_name in (full_tag, tag, default_tag):
+                font = self.fonts.get(font_name)
+                if font:
+                    format.setFont(font)
+                    self.configure_hard_tab_width(font)  # #1919.
+                    break
+            if tag in ('blank', 'tab'):
+                if tag == 'tab' or colorName == 'black':
+                    format.setFontUnderline(True)
+                if colorName != 'black':
+                    format.setBackground(color)
+            elif underline:
+                format.setForeground(color)
+                format.setUnderlineStyle(UnderlineStyle.SingleUnderline)
                 format.setFontUnderline(True)
-            if colorName != 'black':
-                format.setBackground(color)
-        elif underline:
-            format.setForeground(color)
-            format.setUnderlineStyle(UnderlineStyle.SingleUnderline)
-            format.setFontUnderline(True)
-        elif dots or tag == 'trailing_whitespace':
-            format.setForeground(color)
-            format.setUnderlineStyle(UnderlineStyle.DotLine)
-        else:
-            format.setForeground(color)
-            format.setUnderlineStyle(UnderlineStyle.NoUnderline)
+            elif dots or tag == 'trailing_whitespace':
+                format.setForeground(color)
+                format.setUnderlineStyle(UnderlineStyle.DotLine)
+            else:
+                format.setForeground(color)
+                format.setUnderlineStyle(UnderlineStyle.NoUnderline)
+            self.formatsDict[full_tag] = (format, colorName, font)
         self.tagCount += 1
         if trace:
             report()  # A superb trace.
         self.highlighter.setFormat(i, j - i, format)
+        if self.color_cache_formats is not None:
+            self.color_cache_formats.append((i, j - i, format))
     #@+node:ekr.20170127142001.1: *3* BaseColorizer.updateSyntaxColorer & helpers
     # Note: these are used by unit tests.
 
@@ -883,16 +904,25 @@ class JEditColorizer(BaseColorizer):
         #
         # State data used only by this class...
         self.after_doc_language: str = None
+        self.color_cache: dict[tuple, g.Bunch] = {}  # Values are cache entries, least recently used first.
+        self.color_cache_entry: g.Bunch = None  # The entry being recorded or replayed.
         self.initialStateNumber = -1
+        self.leadinsDict: dict[int, tuple] = {}  # Keys are id(rulesDict). See get_leadins.
         self.old_v: VNode = None
         self.nested = False  # True: allow nested comments, etc.
         self.nested_level = 0  # Nesting level if self.nested is True.
         self.nextState = 1  # Don't use 0.
         self.n2languageDict: dict[int, str] = {-1: c.target_language}
         self.prev: tuple[int, int, str] = None
+        self.progressive_deadline = 0.0  # The end of the first time slice.
+        self.progressive_limit: int = None  # Defer coloring all lines >= this line number.
+        self.progressive_provisional = False  # True: color deferred lines provisionally.
+        self.progressive_timer: Any = None
+        self.progressive_v: VNode = None  # The node being colored progressively.
+        self.progressive_visible: tuple[int, int] = None  # The provisionally colored lines.
         self.restartDict: dict[int, Callable] = {}  # Keys are state numbers, values are restart functions.
-        self.stateDict: dict[int, str] = {}  # Keys are state numbers, values state names.
-        self.stateNameDict: dict[str, int] = {}  # Keys are state names, values are state numbers.
+        self.stateDict: dict[int, tuple] = {}  # Keys are state numbers, values are state keys.
+        self.stateKeyDict: dict[tuple, int] = {}  # Keys are state keys, values are state numbers.
         # #2276: Set by init_section_delims.
         self.section_delim1 = '<<'
         self.section_delim2 = '>>'
@@ -909,10 +939,14 @@ class JEditColorizer(BaseColorizer):
         # Fix #389. Do *not* change these.
             # self.nextState = 1 # Don't use 0.
             # self.stateDict = {}
-            # self.stateNameDict = {}
+            # self.stateKeyDict = {}
             # self.restartDict = {}
         self.init_mode(self.language)
         self.clearState()
+        # Recompute leadin patterns: plugins may have patched the rulesDicts.
+        self.leadinsDict = {}
+        # Recompute formats, so setTag sets the hard tab width for this node.
+        self.formatsDict = {}
         # Used by matchers.
         self.prev = None
         # Must be done to support per-language @font/@color settings.
@@ -926,7 +960,7 @@ class JEditColorizer(BaseColorizer):
         self.nextState = 1  # Don't use 0.
         self.restartDict = {}
         self.stateDict = {}
-        self.stateNameDict = {}
+        self.stateKeyDict = {}
     #@+node:ekr.20211029073553.1: *5* jedit.init_section_delims
     def init_section_delims(self) -> None:
 
@@ -1013,6 +1047,10 @@ class JEditColorizer(BaseColorizer):
                     theList.append(rule)
                 theDict[ch] = theList
     #@+node:ekr.20110605121601.18581: *4* jedit.init_mode & helpers
+    # Completed modes, shared by all commanders.
+    # Keys are (rulesetName, color-trailing-whitespace); values are mode bunches.
+    shared_modes: dict[tuple[str, bool], g.Bunch] = {}
+
     def init_mode(self, name: str) -> bool:
         """Name may be a language name or a delegate name."""
         if not name:
@@ -1021,6 +1059,12 @@ class JEditColorizer(BaseColorizer):
             name = 'tex'  # #1088: use tex mode for both tex and latex.
         language, rulesetName = self.nameToRulesetName(name)
         bunch = self.modes.get(rulesetName)
+        key = (rulesetName, self.c.config.getBool("color-trailing-whitespace"))
+        if not bunch:
+            # Another commander may have completed the mode.
+            bunch = self.shared_modes.get(key)
+            if bunch:
+                self.modes[rulesetName] = bunch
         if bunch:
             if bunch.language == 'unknown-language':
                 return False
@@ -1034,7 +1078,11 @@ class JEditColorizer(BaseColorizer):
             mode = g.import_module(name=f"leo.modes.{language}")
         else:
             mode = None
-        return self.init_mode_from_module(name, mode)
+        ok = self.init_mode_from_module(name, mode)
+        # forth.pre_init_mode makes the mode depend on c.
+        if ok and not hasattr(mode, 'pre_init_mode'):
+            self.shared_modes[key] = self.modes[rulesetName]
+        return ok
     #@+node:btheado.20131124162237.16303: *5* jedit.init_mode_from_module
     def init_mode_from_module(self, name: str, mode: Mode) -> bool:
         """
@@ -1069,14 +1117,17 @@ class JEditColorizer(BaseColorizer):
         #
         # #1334: Careful: getattr(mode, ivar, {}) might be None!
         #
+        # Copy the mode's tables: setKeywords, addLeoRules and addImportedRules change them.
         d: dict[Any, Any] = getattr(mode, 'keywordsDictDict', {}) or {}
-        self.keywordsDict = d.get(rulesetName, {})
+        self.keywordsDict = dict(d.get(rulesetName, {}))
         self.setKeywords()
         d = getattr(mode, 'attributesDictDict', {}) or {}
         self.attributesDict: dict[str, Any] = d.get(rulesetName, {})
         self.setModeAttributes()
         d = getattr(mode, 'rulesDictDict', {}) or {}
         self.rulesDict: dict[str, Any] = d.get(rulesetName, {})
+        if isinstance(self.rulesDict, dict):
+            self.rulesDict = {ch: list(rules) for ch, rules in self.rulesDict.items()}
         self.addLeoRules(self.rulesDict)
         self.defaultColor = 'null'
         self.mode = mode
@@ -1106,6 +1157,8 @@ class JEditColorizer(BaseColorizer):
         # Complete the late replacements.
         self.modeBunch.language = self.language
         self.modes[rulesetName] = self.modeBunch
+        # addLeoRules and addImportedRules have changed the rulesDicts.
+        self.leadinsDict = {}
         return True
     #@+node:ekr.20110605121601.18582: *5* jedit.nameToRulesetName
     def nameToRulesetName(self, name: str) -> tuple[str, str]:
@@ -1237,6 +1290,231 @@ class JEditColorizer(BaseColorizer):
                     aList.insert(0, wiki_rule)
                     d[ch] = aList
         self.rulesDict = d
+        self.leadinsDict = {}
+        self.settings_generation += 1
+    #@+node:ekr.20240424113826.1: *3* jedit: color cache
+    # The color cache holds the end state and the format ranges of every line
+    # of recently colored bodies. Revisiting a body replays the formats
+    # instead of calling the matchers again.
+    #@+node:ekr.20240424113826.2: *4* jedit.begin_color_cache
+    def begin_color_cache(self, p: Position) -> None:
+        """
+        Prepare to replay or record the colors of all lines of the body.
+        recolor calls this method whenever QSyntaxHighlighter colors line 0.
+
+        The cache key contains everything that affects the colors except the
+        outline: section references disable caching. The key contains the
+        hash of the document, not p.b: p.b may not yet contain the user's
+        latest changes.
+        """
+        self.end_color_cache()
+        if not self.color_cache_lines or isinstance(self.highlighter, g.NullObject):
+            return
+        document = self.highlighter.document()
+        n_lines = document.blockCount()
+        if n_lines > self.color_cache_lines:
+            return
+        s = document.toPlainText()
+        key = (
+            p.gnx, len(s), hash(s), self.language, self.settings_generation,
+            self.enabled, self.section_delim1, self.section_delim2,
+        )
+        entry = self.color_cache.pop(key, None)
+        if entry:
+            # Make entry the most recently used entry.
+            self.color_cache[key] = entry
+            entry.block_n = 0
+            entry.replay = True
+            # The cached states are indices into the cached state dicts.
+            self.n2languageDict = dict(entry.n2languageDict)
+            self.nextState = entry.nextState
+            self.restartDict = dict(entry.restartDict)
+            self.stateDict = dict(entry.stateDict)
+            self.stateKeyDict = dict(entry.stateKeyDict)
+            # Replaying calls no matchers, so set the hard tab width here.
+            for state, formats in entry.lines:
+                if formats:
+                    self.configure_hard_tab_width(formats[0][2].font())
+                    break
+        else:
+            entry = g.Bunch(key=key, lines=[], n_lines=n_lines, replay=False)
+            self.color_cache_formats = []
+        entry.revision = document.revision()
+        self.color_cache_entry = entry
+    #@+node:ekr.20240424113826.3: *4* jedit.end_color_cache
+    def end_color_cache(self) -> None:
+        """Stop replaying or recording colors."""
+        self.color_cache_entry = None
+        self.color_cache_formats = None
+    #@+node:ekr.20240424113826.4: *4* jedit.record_color_cache
+    def record_color_cache(self, p: Position, block_n: int) -> None:
+        """
+        Record the end state and the format ranges of line block_n.
+        Add the entry to the cache after recording the last line.
+        """
+        entry = self.color_cache_entry
+        if (
+            p.gnx != entry.key[0]
+            or block_n != len(entry.lines)
+            or self.highlighter.document().revision() != entry.revision
+        ):
+            self.end_color_cache()  # QSyntaxHighlighter is not coloring the entire document.
+            return
+        entry.lines.append((self.currentState(), tuple(self.color_cache_formats)))
+        self.color_cache_formats = []
+        if len(entry.lines) < entry.n_lines:
+            return
+        self.end_color_cache()
+        entry.n2languageDict = dict(self.n2languageDict)
+        entry.nextState = self.nextState
+        entry.restartDict = dict(self.restartDict)
+        entry.stateDict = dict(self.stateDict)
+        entry.stateKeyDict = dict(self.stateKeyDict)
+        # Add the entry, then remove least recently used entries.
+        d = self.color_cache
+        d[entry.key] = entry
+        n_lines = sum(z.n_lines for z in d.values())
+        while n_lines > self.color_cache_lines:
+            key = next(iter(d))
+            n_lines -= d.pop(key).n_lines
+    #@+node:ekr.20240424113826.5: *4* jedit.replay_color_cache
+    def replay_color_cache(self, p: Position, block_n: int) -> bool:
+        """
+        Replay the end state and the format ranges of line block_n.
+        Return False, ending the replay, if the cached entry does not apply.
+        """
+        entry = self.color_cache_entry
+        if (
+            p.gnx != entry.key[0]
+            or block_n != entry.block_n
+            or self.highlighter.document().revision() != entry.revision
+            or block_n > 0 and self.prevState() != entry.lines[block_n - 1][0]
+        ):
+            self.end_color_cache()
+            return False
+        state, formats = entry.lines[block_n]
+        self.setState(state)
+        for i, n, format in formats:
+            self.highlighter.setFormat(i, n, format)
+        entry.block_n += 1
+        if entry.block_n == entry.n_lines:
+            self.end_color_cache()
+        return True
+    #@+node:ekr.20240424115212.1: *3* jedit: progressive coloring
+    # QSyntaxHighlighter colors all lines of a new document at once. For large
+    # bodies, recolor colors lines only until the first time slice ends. An
+    # idle-time handler colors the deferred lines in order, one time slice at
+    # a time, so the state of each line remains correct. The handler colors
+    # visible deferred lines provisionally before continuing in order.
+    #@+node:ekr.20240424115212.2: *4* jedit.begin_progressive_coloring
+    def begin_progressive_coloring(self, p: Position) -> None:
+        """
+        Start coloring p.b progressively if it contains many lines.
+        recolor calls this method whenever QSyntaxHighlighter colors line 0.
+        """
+        if p.v == self.progressive_v and self.progressive_limit is not None:
+            return  # Continue coloring in idle time.
+        self.end_progressive_coloring()
+        if not self.progressive_lines or isinstance(self.highlighter, g.NullObject):
+            return
+        entry = self.color_cache_entry
+        if entry and entry.replay:
+            return  # Replaying the color cache is fast.
+        if self.highlighter.document().blockCount() <= self.progressive_lines:
+            return
+        timer = g.IdleTime(self.on_progressive_idle, delay=0, tag='progressive-coloring')
+        if not timer:
+            return  # No gui: color all lines now.
+        self.progressive_deadline = time.perf_counter() + self.color_time_slice / 1000.0
+        self.progressive_timer = timer
+        self.progressive_v = p.v
+        timer.start()
+    #@+node:ekr.20240424115212.3: *4* jedit.color_deferred_line
+    def color_deferred_line(self, s: str) -> None:
+        """
+        Handle a line that recolor will color later.
+
+        Leave the state of the line unchanged so that QSyntaxHighlighter does
+        not color the following lines. Color visible lines provisionally,
+        starting in the initial state. Otherwise, keep the line's present
+        formats.
+        """
+        state = self.currentState()
+        if self.progressive_provisional:
+            formats, self.color_cache_formats = self.color_cache_formats, None  # Don't cache these colors.
+            if s:
+                self.mainLoop(self.setState(self.initialStateNumber), s)
+            self.setState(state)
+            if self.color_cache_entry:
+                self.color_cache_formats = formats
+            return
+        highlighter = self.highlighter
+        for r in highlighter.currentBlock().layout().formats():
+            highlighter.setFormat(r.start, r.length, r.format)
+    #@+node:ekr.20240424115212.4: *4* jedit.defer_coloring
+    def defer_coloring(self, p: Position, block_n: int) -> bool:
+        """Return True if recolor should defer coloring line block_n."""
+        if p.v != self.progressive_v:
+            return False
+        if self.progressive_limit is None:
+            if time.perf_counter() < self.progressive_deadline:
+                return False
+            self.progressive_limit = block_n  # The first time slice has ended.
+        return block_n >= self.progressive_limit
+    #@+node:ekr.20240424115212.5: *4* jedit.end_progressive_coloring
+    def end_progressive_coloring(self) -> None:
+        """Stop coloring progressively."""
+        if self.progressive_timer:
+            self.progressive_timer.stop()
+        self.progressive_limit = self.progressive_timer = None
+        self.progressive_v = self.progressive_visible = None
+    #@+node:ekr.20240424115212.6: *4* jedit.on_progressive_idle
+    def on_progressive_idle(self, timer: Any) -> None:
+        """The idle-time handler for progressive coloring."""
+        if not self.progressive_step():
+            self.end_progressive_coloring()
+    #@+node:ekr.20240424115212.7: *4* jedit.progressive_step
+    def progressive_step(self) -> bool:
+        """
+        Color deferred lines for one time slice.
+        Return True if deferred lines remain.
+        """
+        if self.c.p.v != self.progressive_v or self.progressive_limit is None:
+            # The user has selected another node,
+            # or the first time slice colored all lines.
+            return False
+        highlighter = self.highlighter
+        document = highlighter.document()
+        t_end = time.perf_counter() + self.color_time_slice / 1000.0
+        # Provisionally color visible deferred lines.
+        first, last = self.visible_lines()
+        first = max(first, self.progressive_limit)
+        if first <= last and (first, last) != self.progressive_visible:
+            self.progressive_visible = (first, last)
+            self.progressive_provisional = True
+            try:
+                for block_n in range(first, last + 1):
+                    highlighter.rehighlightBlock(document.findBlockByNumber(block_n))
+            finally:
+                self.progressive_provisional = False
+        # Color deferred lines in order. Color at least one line.
+        n_lines = document.blockCount()
+        while self.progressive_limit < n_lines:
+            block = document.findBlockByNumber(self.progressive_limit)
+            self.progressive_limit += 1
+            highlighter.rehighlightBlock(block)
+            if time.perf_counter() >= t_end:
+                break
+        return self.progressive_limit < n_lines
+    #@+node:ekr.20240424115212.8: *4* jedit.visible_lines
+    def visible_lines(self) -> tuple[int, int]:
+        """Return the numbers of the first and last visible lines of the body."""
+        w = self.widget
+        if not isinstance(w, QtWidgets.QTextEdit):
+            return 0, -1
+        first = w.cursorForPosition(QtCore.QPoint(0, 0)).blockNumber()
+        last = w.cursorForPosition(QtCore.QPoint(0, w.viewport().height() - 1)).blockNumber()
+        return first, last
     #@+node:ekr.20240423042341.1: *3* jedit.colorize
     def colorize(self, p: Position) -> None:
         """jedit.Colorize: fully recolor p.b."""
@@ -1262,9 +1540,22 @@ class JEditColorizer(BaseColorizer):
                 g.trace(f"NEW NODE: {p.h}\n")
         t1 = time.process_time()
         i = f(s) if f else 0
+        rulesDict = self.rulesDict
+        leadins_d, leadins_pattern = self.get_leadins()
         while i < len(s):
             progress = i
-            functions = self.rulesDict.get(s[i], [])
+            if self.rulesDict is not rulesDict:
+                # A rule has switched modes.
+                rulesDict = self.rulesDict
+                leadins_d, leadins_pattern = self.get_leadins()
+            functions = leadins_d.get(s[i])
+            if functions is None:
+                # Skip all characters that can not start a match.
+                m = leadins_pattern.search(s, i)
+                if not m:
+                    break
+                i = m.start()
+                functions = rulesDict.get(s[i], [])
             for f in functions:
                 # g.trace(f"n: {n:<2} i: {i:<3} {f.__name__:30} {s.rstrip()}")
                 n = f(self, s, i)
@@ -1284,6 +1575,49 @@ class JEditColorizer(BaseColorizer):
             assert i > progress
         # Don't even *think* about changing state here.
         self.tot_time += time.process_time() - t1
+    #@+node:ekr.20240424112942.1: *4* jedit.get_leadins
+    def get_leadins(self) -> tuple[dict[str, list], re.Pattern]:
+        """
+        Return (leadins_dict, pattern) for self.rulesDict.
+
+        leadins_dict contains the entries of self.rulesDict for characters that
+        can start a match. pattern matches the next such character, so that
+        mainLoop skips runs of other characters with a single regex scan.
+        The rule lists in self.rulesDict remain the dispatch table.
+
+        Leo's blank and tab rules never match, so they are not leadins.
+        The trailing whitespace rule matches only at the end of the line.
+        """
+        d = self.rulesDict
+        data = self.leadinsDict.get(id(d))
+        if data and data[0] is d:
+            return data[1], data[2]
+        leadins_d: dict[str, list] = {}
+        if isinstance(d, dict):
+            null_rules = (JEditColorizer.match_blanks, JEditColorizer.match_tabs)
+            trailing_rule = JEditColorizer.match_trailing_ws
+            trailing = []
+            for ch, aList in d.items():
+                rules = [z for z in aList or [] if z not in null_rules]
+                if len(ch) != 1 or not rules:
+                    continue
+                if rules == [trailing_rule]:
+                    trailing.append(ch)
+                else:
+                    leadins_d[ch] = aList
+            patterns = []
+            if leadins_d:
+                patterns.append('[' + ''.join(re.escape(z) for z in sorted(leadins_d)) + ']')
+            if trailing:
+                patterns.append(
+                    '[' + ''.join(re.escape(z) for z in sorted(trailing)) + r'](?=[ \t]*\Z)')
+            # [^\s\S] never matches.
+            pattern = re.compile('|'.join(patterns) or r'[^\s\S]')
+        else:
+            # A mode-specific class, like plain.RulesDict, that may have a default rule.
+            pattern = re.compile(r'[\s\S]')
+        self.leadinsDict[id(d)] = (d, leadins_d, pattern)
+        return leadins_d, pattern
     #@+node:ekr.20110605121601.18640: *3* jedit.recolor & helpers
     def recolor(self, s: str) -> None:
         """
@@ -1304,12 +1638,23 @@ class JEditColorizer(BaseColorizer):
             assert self.language
             self.init_all_state(p.v)
             self.init()
+        if block_n == 0:
+            self.begin_color_cache(p)
+            self.begin_progressive_coloring(p)
+        entry = self.color_cache_entry
+        if entry and entry.replay and self.replay_color_cache(p, block_n):
+            return
+        if self.defer_coloring(p, block_n):
+            self.color_deferred_line(s)
+            return
         if block_n == 0:
             n = self.initBlock0()
         n = self.setState(n)  # Required.
         # Always color the line, even if colorizing is disabled.
         if s:
             self.mainLoop(n, s)
+        if self.color_cache_entry:
+            self.record_color_cache(p, block_n)
     #@+node:ekr.20170126100139.1: *4* jedit.initBlock0
     def initBlock0(self) -> int:
         """
@@ -1329,10 +1674,9 @@ class JEditColorizer(BaseColorizer):
 
         Called from init() and initBlock0.
         """
-        state = self.languageTag(self.language)
-        n = self.stateNameToStateNumber(None, state)
+        n = self.stateKeyToStateNumber(None, (self.language, '', '', ()))
         self.initialStateNumber = n
-        self.blankStateNumber = self.stateNameToStateNumber(None, state + ';blank')
+        self.blankStateNumber = self.stateKeyToStateNumber(None, (self.language, '', 'blank', ()))
         return n
     #@+node:ekr.20170126103925.1: *4* jedit.languageTag
     def languageTag(self, name: str) -> str:
@@ -1376,6 +1720,9 @@ class JEditColorizer(BaseColorizer):
     # - exclude_match         If True, the actual text that matched will not be colored.
     # - kind                  The color tag to be applied to colored text.
     #@+node:ekr.20110605121601.18637: *4* jedit.colorRangeWithTag
+    # Characters that can start a UNL, URL or GNX.
+    url_leadins_pattern = re.compile(f"[gu{g.url_leadins}GU{g.url_leadins.upper()}]")
+
     def colorRangeWithTag(self,
         s: str, i: int, j: int, tag: str, delegate: str = '', exclude_match: bool = False,
     ) -> None:
@@ -1420,6 +1767,10 @@ class JEditColorizer(BaseColorizer):
             # Allow UNL's, URL's, and GNX's *everywhere*.
             j = min(j, len(s))
             while i < j:
+                m = self.url_leadins_pattern.search(s, i, j)
+                if not m:
+                    break
+                i = m.start()
                 ch = s[i].lower()
                 if ch == 'g':
                     n = self.match_gnx(s, i)
@@ -1719,6 +2070,8 @@ class JEditColorizer(BaseColorizer):
             self.colorRangeWithTag(s, k, j, 'namebrackets')
             return j - i
         # An actual section reference.
+        # The colors depend on p's descendants, so don't cache them.
+        self.end_color_cache()
         self.colorRangeWithTag(s, i, i + n1, 'namebrackets')
         ref = g.findReference(s[i:j], p)
         if ref:
@@ -2132,6 +2485,10 @@ class JEditColorizer(BaseColorizer):
         # This match was causing most of the syntax-color problems.
         return 0  # 2009/6/23
     #@+node:ekr.20110605121601.18619: *4* jedit.match_regexp_helper
+    # Compiled mode regexes, shared by all commanders.
+    # Keys are (pattern, ignore_case); values are compiled regexes.
+    compiled_patterns: dict[tuple[str, bool], re.Pattern] = {}
+
     def match_regexp_helper(self, s: str, i: int, pattern: Any) -> int:
         """
         Return the length of the matching text if
@@ -2139,15 +2496,19 @@ class JEditColorizer(BaseColorizer):
         """
         # Leo 6.7.6: Allow compiled regexes.
         if isinstance(pattern, str):
-            try:
-                flags = re.MULTILINE
-                if self.ignore_case:
-                    flags |= re.IGNORECASE
-                re_obj = re.compile(pattern, flags)
-            except Exception:
-                # Do not call g.es here!
-                g.trace(f"Invalid regular expression: {pattern}")
-                return 0
+            key = (pattern, bool(self.ignore_case))
+            re_obj = self.compiled_patterns.get(key)
+            if re_obj is None:
+                try:
+                    flags = re.MULTILINE
+                    if self.ignore_case:
+                        flags |= re.IGNORECASE
+                    re_obj = re.compile(pattern, flags)
+                except Exception:
+                    # Do not call g.es here!
+                    g.trace(f"Invalid regular expression: {pattern}")
+                    return 0
+                self.compiled_patterns[key] = re_obj
         else:
             re_obj = pattern
         # Match succeeds or fails more quickly than search.
@@ -2684,9 +3045,20 @@ class JEditColorizer(BaseColorizer):
     #@+node:ekr.20110605121601.18631: *4* jedit.computeState
     def computeState(self, f: Any, keys: Any) -> int:
         """
-        Compute the state name associated with f and all the keys.
-        Return a unique int n representing that state.
+        Return a unique int n representing the state associated with f and all the keys.
+
+        The state key is a tuple: (language, rulesetName, f.__name__, keys).
+        Restart functions with the same name and keys behave identically.
+        """
+        key = (self.language, self.rulesetName, f.__name__ if f else '', tuple(keys.items()))
+        return self.stateKeyToStateNumber(f, key)
+    #@+node:ekr.20240424120107.1: *4* jedit.computeStateName
+    def computeStateName(self, key: tuple) -> str:
+        """
+        Return a readable name for the given state key.
+        Only showState calls this method, when debugging.
         """
+        language, rulesetName, f_name, items = key
         # Abbreviate arg names.
         d = {
             'delegate': '=>',
@@ -2698,23 +3070,21 @@ class JEditColorizer(BaseColorizer):
             'no_line_break': '!lbrk',
             'no_word_break': '!wbrk',
         }
-        result = [self.languageTag(self.language)]
-        if not self.rulesetName.endswith('_main'):
-            result.append(self.rulesetName)
-        if f:
-            result.append(f.__name__)
-        for key in sorted(keys):
-            keyVal = keys.get(key)
-            val = d.get(key)
+        result = [self.languageTag(language)]
+        if rulesetName and not rulesetName.endswith('_main'):
+            result.append(rulesetName)
+        if f_name:
+            result.append(f_name)
+        for name, keyVal in sorted(items, key=lambda item: item[0]):
+            val = d.get(name)
             if val is None:
-                val = keys.get(key)
-                result.append(f"{key}={val}")
+                result.append(f"{name}={keyVal}")
             elif keyVal is True:
                 result.append(f"{val}")
             elif keyVal is False:
                 pass
             elif keyVal not in (None, ''):
-                result.append(f"{key}={keyVal}")
+                result.append(f"{name}={keyVal}")
         state = ';'.join(result).lower()
         table = (
             ('kind=', ''),
@@ -2723,8 +3093,7 @@ class JEditColorizer(BaseColorizer):
         )
         for pattern, s in table:
             state = state.replace(pattern, s)
-        n = self.stateNameToStateNumber(f, state)
-        return n
+        return state
     #@+node:ekr.20110605121601.18632: *4* jedit.getters & setters
     def currentBlockNumber(self) -> int:
         block = self.highlighter.currentBlock()
@@ -2741,14 +3110,14 @@ class JEditColorizer(BaseColorizer):
         return n
     #@+node:ekr.20170125141148.1: *4* jedit.inColorState
     def inColorState(self) -> bool:
-        """True if the *current* state is enabled."""
-        n = self.currentState()
-        state = self.stateDict.get(n, 'no-state')
-        enabled = (
-            not state.endswith('@nocolor') and
-            not state.endswith('@nocolor-node') and
-            not state.endswith('@killcolor'))
-        return enabled
+        """
+        True if the *current* state is enabled.
+
+        Always True: the old test compared lowercased state names with
+        '@nocolor', '@nocolor-node' and '@killcolor', so it never failed.
+        The restart functions of those states handle the directives.
+        """
+        return True
     #@+node:ekr.20110605121601.18633: *4* jedit.setRestart
     def setRestart(self, f: Any, **keys: Any) -> int:
         n = self.computeState(f, keys)
@@ -2756,7 +3125,8 @@ class JEditColorizer(BaseColorizer):
         return n
     #@+node:ekr.20110605121601.18635: *4* jedit.show...
     def showState(self, n: int) -> str:
-        state = self.stateDict.get(n, 'no-state')
+        key = self.stateDict.get(n)
+        state = self.computeStateName(key) if key else 'no-state'
         return f"{n:2}:{state}"
 
     def showCurrentState(self) -> str:
@@ -2766,18 +3136,18 @@ class JEditColorizer(BaseColorizer):
     def showPrevState(self) -> str:
         n = self.prevState()
         return self.showState(n)
-    #@+node:ekr.20110605121601.18636: *4* jedit.stateNameToStateNumber
-    def stateNameToStateNumber(self, f: Any, stateName: Any) -> int:
+    #@+node:ekr.20110605121601.18636: *4* jedit.stateKeyToStateNumber
+    def stateKeyToStateNumber(self, f: Any, key: tuple) -> int:
         """
-        stateDict:     Keys are state numbers, values state names.
-        stateNameDict: Keys are state names, values are state numbers.
+        stateDict:     Keys are state numbers, values are state keys.
+        stateKeyDict:  Keys are state keys, values are state numbers.
         restartDict:   Keys are state numbers, values are restart functions
         """
-        n = self.stateNameDict.get(stateName)
+        n = self.stateKeyDict.get(key)
         if n is None:
             n = self.nextState
-            self.stateNameDict[stateName] = n
-            self.stateDict[n] = stateName
+            self.stateKeyDict[key] = n
+            self.stateDict[n] = key
             self.restartDict[n] = f
             self.nextState += 1
             self.n2languageDict[n] = self.language
@@ -27,11 +27,12 @@ if TYPE_CHECKING:  # pragma: no cover
     from leo.core.leoGui import LeoKeyEvent
     from leo.core.leoConfig import LocalConfigManager
     from leo.core.leoNodes import Position, VNode
-    # 11 subcommanders...
+    # 12 subcommanders...
     from leo.core.leoAtFile import AtFile
     from leo.core.leoChapters import ChapterController
     from leo.core.leoFileCommands import FileCommands
     from leo.core.leoFind import LeoFind
+    from leo.core.leoSearchIndex import SearchIndex
     from leo.core.leoImport import LeoImportCommands
     from leo.core.leoIPython import InternalIPKernel
     from leo.core.leoKeys import KeyHandlerClass
@@ -124,6 +125,7 @@ class Commands:
         self.nodeHistory: NodeHistory = None
         self.persistenceController: PersistenceDataController = None
         self.printingController: PrintingController = None
+        self.searchIndex: SearchIndex = None
         self.shadowController: ShadowController = None
         self.undoer: Undoer = None
         self.vimCommands: VimCommands = None
@@ -234,6 +236,19 @@ class Commands:
         self.expansionNode = None  # The last node we expanded or contracted.
         self.nodeConflictList: list[Position] = []  # List of nodes with conflicting read-time data.
         self.nodeConflictFileName: Optional[str] = None  # The fileName for c.nodeConflictList.
+        # Keys are (gnx, last) tuples, values are positions. See c.positionForGnx.
+        self.gnxPositionCache: dict[tuple[str, bool], Position] = {}
+        self.gnxPositionCacheGeneration = -1
+        self.flatOutlineCache: Optional[leoNodes.FlatOutline] = None  # See c.flatOutline.
+        # Keys are vnodes, values are tuples (directives_pat, h, b, d). See g.get_directives_dict.
+        self.directivesCache: dict[VNode, tuple[re.Pattern, str, str, dict[str, str]]] = {}
+        self.directivesChangeCount = 0  # Incremented when any headline or body changes.
+        # Keys are tuples (v, id(list of v's parent) or 0), values are lists of dicts.
+        # See g.get_directives_dict_list.
+        self.directivesListCache: dict[tuple[VNode, int], list[dict[str, str]]] = {}
+        self.directivesListStamp: Optional[tuple[int, int, re.Pattern]] = None
+        # Sets of vnodes whose headline, body or status have changed. See v.recordChange.
+        self.vnodeChangeSets: list[set[VNode]] = []
         self.user_dict: dict[str, Any] = {}  # Non-persistent dictionary for free use by scripts and plugins.
     #@+node:ekr.20120217070122.10467: *5* c.initEventIvars
     def initEventIvars(self) -> None:
@@ -326,10 +341,11 @@ class Commands:
         from leo.core import leoPersistence
         from leo.core import leoPrinting
         from leo.core import leoRst
+        from leo.core import leoSearchIndex
         from leo.core import leoShadow
         from leo.core import leoUndo
         from leo.core import leoVim
-        # Define 11 subcommanders.
+        # Define 12 subcommanders.
         self.keyHandler = self.k    = leoKeys.KeyHandlerClass(c)
         self.chapterController      = leoChapters.ChapterController(c)
         self.shadowController       = leoShadow.ShadowController(c)
@@ -340,6 +356,7 @@ class Commands:
         self.markupCommands         = leoMarkup.MarkupCommands(c)
         self.persistenceController  = leoPersistence.PersistenceDataController(c)
         self.printingController     = leoPrinting.PrintingController(c)
+        self.searchIndex            = leoSearchIndex.SearchIndex(c)
         self.undoer                 = leoUndo.Undoer(c)
         # 15 command handlers...
         self.abbrevCommands     = abbrevCommands.AbbrevCommandsClass(c)
@@ -1666,6 +1683,81 @@ class Commands:
             limitIsVisible = not cc or not p.h.startswith('@chapter')
             return p, limitIsVisible
         return None, None
+    #@+node:ekr.20240424064046.1: *5* c.flatOutline
+    def flatOutline(self) -> leoNodes.FlatOutline:
+        """
+        Return a FlatOutline describing the present structure of the outline.
+
+        The snapshot is cached until the outline's structure changes.
+        """
+        c = self
+        flat = c.flatOutlineCache
+        if not flat or not flat.isValid():
+            flat = c.flatOutlineCache = leoNodes.FlatOutline(c)
+        return flat
+    #@+node:ekr.20240424055131.1: *5* c.positionForGnx
+    def positionForGnx(self, gnx: str, last: bool = False) -> Optional[Position]:
+        """
+        Return a copy of the first (or last) position p in outline order
+        such that p.gnx == gnx. Return None if there is no such position.
+
+        This method uses fc.gnxDict and v.parents instead of scanning the
+        outline. Results are cached until the outline's structure changes.
+        """
+        c = self
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v:
+            return None
+        generation = c.frame.tree.generation
+        if generation != c.gnxPositionCacheGeneration:
+            c.gnxPositionCache = {}
+            c.gnxPositionCacheGeneration = generation
+        key = (gnx, last)
+        p = c.gnxPositionCache.get(key)
+        # Some low-level code changes v.children without changing the generation.
+        if p and p.v is v and c.positionExists(p):
+            return p.copy()
+        p = c._positionForVnode(v, last)
+        if p:
+            c.gnxPositionCache[key] = p.copy()
+        return p
+    #@+node:ekr.20240424055448.1: *6* c._positionForVnode
+    def _positionForVnode(self, v: VNode, last: bool) -> Optional[Position]:
+        """
+        Return the first (or last) position p in outline order such that p.v == v.
+
+        Return None if v is not in the outline.
+        """
+        c = self
+        hidden_root = c.hiddenRootNode
+        stacks_dict: dict[VNode, list[list[tuple[VNode, int]]]] = {}
+
+        def stacks(v: VNode) -> list[list[tuple[VNode, int]]]:
+            """Return all the paths from the hidden root to v."""
+            if v is hidden_root:
+                return [[]]
+            if v in stacks_dict:
+                return stacks_dict[v]
+            stacks_dict[v] = []  # Defend against cycles.
+            result: list[list[tuple[VNode, int]]] = []
+            for parent_v in set(v.parents):
+                parent_stacks = stacks(parent_v)
+                if not parent_stacks:
+                    continue
+                for n, child in enumerate(parent_v.children):
+                    if child is v:
+                        result.extend(stack + [(v, n)] for stack in parent_stacks)
+            stacks_dict[v] = result
+            return result
+
+        aList = stacks(v)
+        if not aList:
+            return None
+        # Outline order is the order of the child indices.
+        chooser = max if last else min
+        stack = chooser(aList, key=lambda stack: [n for v2, n in stack])
+        v, n = stack[-1]
+        return leoNodes.Position(v, n, stack[:-1])
     #@+node:tbrown.20091206142842.10296: *5* c.vnode2allPositions
     def vnode2allPositions(self, v: VNode) -> list[Position]:
         """
@@ -4573,6 +4665,7 @@ class Commands:
 
         links_to_be_cut = sorted(set(map(p2link, aList)), key=lambda x: -x[0])
         undodata = []
+        c.frame.tree.generation += 1
         for i, v in links_to_be_cut:
             ch = v.children.pop(i)
             ch.parents.remove(v)
@@ -606,6 +606,12 @@ class FileCommands:
         self.descendentVnodeUaDictList: list[Any] = []
         self.ratio = 0.5
         self.currentVnode: VNode = None
+        # For .db files...
+        self.db_body_conn: Conn = None  # The open connection used to load lazy bodies.
+        self.db_delta_counts: tuple[int, int] = (0, 0)  # (changed, deleted) rows written by the last delta save.
+        self.db_lazy_bodies: dict[str, str] = {}  # Keys are gnx's, values are bodies loaded by fc.loadLazyBody.
+        self.db_path: str = None  # The normalized path of the .db file described by db_rows.
+        self.db_rows: dict[str, tuple] = {}  # Keys are gnx's, values are the last rows read or written.
         # For writing...
         self.read_only = False
         self.rootPosition: Position = None
@@ -932,8 +938,18 @@ class FileCommands:
         conn = None
         try:
             c.loading = True  # disable c.changed
-            conn = sqlite3.connect(path)
-            v = fc.retrieveVnodesFromDb(conn) or fc.initNewDb(conn, path)
+            lazy = c.config.getBool('sqlite-lazy-bodies', default=False)
+            fc.closeDbBodyConnection()
+            # fc.loadLazyBody may be called from any thread.
+            conn = sqlite3.connect(path, check_same_thread=not lazy)
+            v = fc.retrieveVnodesFromDb(conn, lazy=lazy)
+            if v:
+                fc.setDbSnapshot(path, fc.db_rows)
+                if lazy:
+                    # Keep the connection open for fc.loadLazyBody.
+                    fc.db_body_conn, conn = conn, None
+            else:
+                v = fc.initNewDb(conn, path)
             if not v:
                 return None
 
@@ -1081,31 +1097,45 @@ class FileCommands:
                 n2.setBodyString(b2)
         return root
     #@+node:vitalije.20170630152841.1: *5* fc.retrieveVnodesFromDb & helpers
-    def retrieveVnodesFromDb(self, conn: Conn) -> VNode:
+    def retrieveVnodesFromDb(self, conn: Conn, lazy: bool = False) -> VNode:
         """
         Recreates tree from the data contained in table vnodes.
 
         This method follows behavior of readSaxFile.
+
+        lazy: Read only the bodies that may contain directives.
+              fc.loadLazyBody reads all other bodies when first needed.
         """
         c, fc = self.c, self
-        sql = '''select gnx, head,
-             body,
+        # Directives start with '@' at the start of a line. See g.directives_pat.
+        body = (
+            "case when substr(body, 1, 1) = '@' or instr(body, char(10) || '@') > 0 "
+            "then body else null end"
+            if lazy else 'body'
+        )
+        sql = f'''select gnx, head,
+             {body},
              children,
              parents,
              iconVal,
              statusBits,
              ua from vnodes'''
         vnodes = []
+        rows: dict[str, tuple] = {}
         try:
             for row in conn.execute(sql):
                 (gnx, h, b, children, parents, iconVal, statusBits, ua) = row
+                rows[gnx] = row
                 try:
                     ua = pickle.loads(g.toEncodedString(ua))
                 except ValueError:
                     ua = None
                 v = leoNodes.VNode(context=c, gnx=gnx)
                 v._headString = h
-                v._bodyString = b
+                if b is None:
+                    del v._bodyString  # VNode.__getattr__ calls fc.loadLazyBody.
+                else:
+                    v._bodyString = b
                 v.children = children.split()
                 v.parents = parents.split()
                 v.iconVal = iconVal
@@ -1123,6 +1153,7 @@ class FileCommands:
         if not rootChildren:
             g.trace('there should be at least one top level node!')
             return None
+        rootChildren = fc.sortTopLevelVnodesFromDb(conn, rootChildren)
 
         def findNode(x: VNode) -> VNode:
             return fc.gnxDict.get(x, c.hiddenRootNode)  # type:ignore
@@ -1132,12 +1163,82 @@ class FileCommands:
             v.children = [findNode(x) for x in v.children]
             v.parents = [findNode(x) for x in v.parents]
         c.hiddenRootNode.children = rootChildren
+        # Remember the rows, for fc.exportDeltaToSqlite.
+        fc.db_rows = rows
         (w, h, x, y, r1, r2, encp) = fc.getWindowGeometryFromDb(conn)
         c.frame.setTopGeometry(w, h, x, y)
         c.frame.resizePanesToRatio(r1, r2)
         p = fc.decodePosition(encp)
         c.setCurrentPosition(p)
         return rootChildren[0]
+    #@+node:ekr.20240424055832.1: *6* fc.sortTopLevelVnodesFromDb
+    def sortTopLevelVnodesFromDb(self, conn: Conn, vnodes: list[VNode]) -> list[VNode]:
+        """
+        Return the list of top-level vnodes in outline order.
+
+        Older .db files do not contain the 'top_level_gnxs' entry.
+        Their top-level vnodes appear in table order.
+        """
+        try:
+            row = conn.execute(
+                "select value from extra_infos where name = 'top_level_gnxs'").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if not row or not row[0]:
+            return vnodes
+        order = {gnx: i for i, gnx in enumerate(row[0].split())}
+        n = len(order)
+        return sorted(vnodes, key=lambda v: order.get(v.gnx, n))
+    #@+node:ekr.20240424052832.1: *6* fc.loadLazyBody & helpers
+    def loadLazyBody(self, v: VNode) -> str:
+        """
+        Read v's body from the .db file, set v._bodyString and return the body.
+
+        VNode.__getattr__ calls this method the first time code accesses
+        v._bodyString after fc.retrieveVnodesFromDb(lazy=True).
+        """
+        conn = self.db_body_conn
+        s = ''
+        if conn:
+            try:
+                row = conn.execute('select body from vnodes where gnx = ?', (v.gnx,)).fetchone()
+                if row and row[0] is not None:
+                    s = row[0]
+            except sqlite3.Error as e:
+                g.internalError(e)
+        else:
+            g.internalError(f"no .db connection for lazy body: {v.gnx}")
+        v._bodyString = s
+        self.db_lazy_bodies[v.gnx] = s
+        return s
+    #@+node:ekr.20240424053149.1: *7* fc.evictLazyBodies
+    def evictLazyBodies(self) -> int:
+        """
+        Unload all lazy bodies that have not changed since fc.loadLazyBody read them.
+
+        Return the number of unloaded bodies.
+        """
+        if not self.db_body_conn:
+            return 0
+        d, n = self.gnxDict, 0
+        for gnx, s in list(self.db_lazy_bodies.items()):
+            v = d.get(gnx)
+            if v and v.isBodyLoaded() and v._bodyString is s:
+                del v._bodyString
+                n += 1
+        self.db_lazy_bodies = {}
+        return n
+    #@+node:ekr.20240424053506.1: *7* fc.closeDbBodyConnection
+    def closeDbBodyConnection(self) -> None:
+        """
+        Close the connection used by fc.loadLazyBody.
+
+        The caller must ensure that no lazy bodies remain unloaded.
+        """
+        if self.db_body_conn:
+            self.db_body_conn.close()
+        self.db_body_conn = None
+        self.db_lazy_bodies = {}
     #@+node:vitalije.20170815162307.1: *6* fc.initNewDb
     def initNewDb(self, conn: Conn, path: str = None) -> VNode:
         """ Initializes tables and returns None"""
@@ -1383,9 +1484,95 @@ class FileCommands:
     #@+node:ekr.20210316034237.1: *4* fc: Writing top-level
     #@+node:vitalije.20170630172118.1: *5* fc.exportToSqlite & helpers
     def exportToSqlite(self, fileName: str) -> bool:
-        """Dump all vnodes to sqlite database. Returns True on success."""
+        """
+        Dump all vnodes to sqlite database. Returns True on success.
+
+        When @bool sqlite-delta-save is True (the default) and fileName is the
+        .db file most recently read or written, write only the rows that have
+        changed since then, in a single transaction.
+        """
         c, fc = self.c, self
+        delta = (
+            c.config.getBool('sqlite-delta-save', default=True)
+            and fc.isDbSnapshot(fileName)
+        )
+        rows = fc.getDbRows(delta=delta)
         conn = sqlite3.connect(fileName, isolation_level='DEFERRED')
+        ok = False
+        try:
+            if delta:
+                fc.exportDeltaToSqlite(conn, rows)
+            else:
+                fc.prepareDbTables(conn)
+                fc.exportVnodesToSqlite(conn, rows.values())
+            fc.exportDbVersion(conn)
+            fc.exportGeomToSqlite(conn)
+            fc.exportHashesToSqlite(conn)
+            conn.commit()
+            conn.close()
+            ok = True
+        except sqlite3.Error as e:
+            conn.rollback()
+            g.internalError(e)
+        if ok:
+            fc.setDbSnapshot(fileName, rows)
+            if not delta:
+                # getDbRows has loaded all lazy bodies.
+                fc.closeDbBodyConnection()
+        return ok
+    #@+node:ekr.20240424051524.1: *6* fc.exportDeltaToSqlite
+    def exportDeltaToSqlite(self, conn: Conn, rows: dict[str, tuple]) -> None:
+        """
+        Update the vnodes table using only the rows that differ from fc.db_rows.
+
+        rows is a dict whose keys are gnx's and whose values are rows.
+        """
+        old_rows = self.db_rows
+        changed = [row for gnx, row in rows.items() if old_rows.get(gnx) != row]
+        deleted = [(gnx,) for gnx in old_rows if gnx not in rows]
+        if deleted:
+            conn.executemany('delete from vnodes where gnx = ?', deleted)
+        # Don't overwrite the bodies of unchanged lazy bodies. See fc.getDbRows.
+        unloaded = [row[:2] + row[3:] for row in changed if row[2] is None]
+        changed = [row for row in changed if row[2] is not None]
+        if unloaded:
+            conn.executemany(
+                '''update vnodes set
+                    head=?2, children=?3, parents=?4,
+                    iconVal=?5, statusBits=?6, ua=?7
+                where gnx=?1;''',
+                unloaded,
+            )
+        if changed:
+            # Upsert, so that unchanged rows keep their place in the table.
+            conn.executemany(
+                '''insert into vnodes
+                (gnx, head, body, children, parents,
+                    iconVal, statusBits, ua)
+                values(?,?,?,?,?,?,?,?)
+                on conflict(gnx) do update set
+                    head=excluded.head, body=excluded.body,
+                    children=excluded.children, parents=excluded.parents,
+                    iconVal=excluded.iconVal, statusBits=excluded.statusBits,
+                    ua=excluded.ua;''',
+                changed,
+            )
+        self.db_delta_counts = (len(changed) + len(unloaded), len(deleted))
+    #@+node:ekr.20240424051841.1: *6* fc.getDbRows
+    def getDbRows(self, delta: bool = False) -> dict[str, tuple]:
+        """
+        Return a dict whose keys are gnx's and whose values are rows of the vnodes table.
+
+        delta: The body field is None for lazy bodies that have not changed.
+        """
+        c, lazy_bodies = self.c, self.db_lazy_bodies
+
+        def body(v: VNode) -> Optional[str]:
+            if delta and (
+                not v.isBodyLoaded() or lazy_bodies.get(v.gnx) is v._bodyString
+            ):
+                return None
+            return v.b
 
         def dump_u(v: VNode) -> bytes:
             try:
@@ -1399,7 +1586,7 @@ class FileCommands:
             return (
                 v.gnx,
                 v.h,
-                v.b,
+                body(v),
                 ' '.join(x.gnx for x in v.children),
                 ' '.join(x.gnx for x in v.parents),
                 v.iconVal,
@@ -1408,19 +1595,24 @@ class FileCommands:
                 dump_u(v)
             )
 
-        ok = False
-        try:
-            fc.prepareDbTables(conn)
-            fc.exportDbVersion(conn)
-            fc.exportVnodesToSqlite(conn, (dbrow(v) for v in c.all_unique_nodes()))
-            fc.exportGeomToSqlite(conn)
-            fc.exportHashesToSqlite(conn)
-            conn.commit()
-            conn.close()
-            ok = True
-        except sqlite3.Error as e:
-            g.internalError(e)
-        return ok
+        return {v.gnx: dbrow(v) for v in c.all_unique_nodes()}
+    #@+node:ekr.20240424052158.1: *6* fc.isDbSnapshot & setDbSnapshot
+    def isDbSnapshot(self, fileName: str) -> bool:
+        """
+        Return True if fc.db_rows describes the vnodes table of fileName.
+
+        Only then may fc.exportDeltaToSqlite update the table in place.
+        """
+        return bool(
+            fileName and self.db_path
+            and os.path.normcase(os.path.abspath(fileName)) == self.db_path
+            and os.path.exists(fileName)
+        )
+
+    def setDbSnapshot(self, fileName: str, rows: dict[str, tuple]) -> None:
+        """Remember that rows are the contents of the vnodes table of fileName."""
+        self.db_path = os.path.normcase(os.path.abspath(fileName)) if fileName else None
+        self.db_rows = rows
     #@+node:vitalije.20170705075107.1: *6* fc.decodePosition
     def decodePosition(self, s: str) -> Position:
         """Creates position from its string representation encoded by fc.encodePosition."""
@@ -1471,16 +1663,18 @@ class FileCommands:
     #@+node:vitalije.20170701162052.1: *6* fc.exportGeomToSqlite
     def exportGeomToSqlite(self, conn: Conn) -> None:
         c = self.c
+        # The order of top-level nodes: rows of the vnodes table are unordered.
+        top_level = ' '.join(v.gnx for v in c.hiddenRootNode.children)
         data = zip(
             (
                 'width', 'height', 'left', 'top',
                 'ratio', 'secondary_ratio',
-                'current_position'
+                'current_position', 'top_level_gnxs',
             ),
             c.frame.get_window_info() +
             (
                 c.frame.ratio, c.frame.secondary_ratio,
-                self.encodePosition(c.p)
+                self.encodePosition(c.p), top_level,
             )
         )
         conn.executemany('replace into extra_infos(name, value) values(?, ?)', data)
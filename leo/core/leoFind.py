@@ -145,9 +145,11 @@ class LeoFind:
         self.match_obj: re.Match = None
         self.reverse = False
         self.root: Position = None  # The start of the search, especially for suboutline-only.
+        self.background_search: BackgroundSearch = None  # The running background search, if any.
         #
         # User settings.
         self.minibuffer_mode: bool = None
+        self.search_in_background: bool = None
         self.reload_settings()
     #@+node:ekr.20210110073117.6: *4* find.default_settings
     def default_settings(self) -> Settings:
@@ -197,6 +199,10 @@ class LeoFind:
                 return <appropriate error indication>
         """
         #
+        # A new search cancels any background search.
+        # Don't reset the limiters: the new search may use them.
+        self.cancel_background_search(reset_limiters=False)
+        #
         # Init required defaults.
         self.reverse = False
         #
@@ -222,6 +228,7 @@ class LeoFind:
         c = self.c
         self.minibuffer_mode = c.config.getBool('minibuffer-find-mode', default=False)
         self.reverse_find_defs = c.config.getBool('reverse-find-defs', default=False)
+        self.search_in_background = c.config.getBool('search-in-background', default=True)
 
     reloadSettings = reload_settings  # Necessary alias.
     #@+node:ekr.20210108053422.1: *3* find.batch_change (script helper) & helpers
@@ -1325,6 +1332,12 @@ class LeoFind:
         k.resetLabel()
         k.showStateAndMode()
         c.widgetWantsFocusNow(w)
+        if self.search_in_background:
+            self.start_clone_find_all(settings,
+                flatten=False,
+                on_progress=self.show_background_progress,
+                on_done=self.finish_interactive_clone_find_all)
+            return 0
         count = self.do_clone_find_all(settings)
         if count:
             c.redraw()
@@ -1344,6 +1357,49 @@ class LeoFind:
         if not self.check_args('clone-find-all'):
             return 0
         return self._cf_helper(settings, flatten=False)
+    #@+node:ekr.20240425052552.1: *5* find.start_clone_find_all & helper
+    def start_clone_find_all(self,
+        settings: Settings,
+        flatten: bool,
+        on_progress: Callable = None,
+        on_done: Callable = None,
+        run: bool = True,
+    ) -> Optional[BackgroundSearch]:
+        """
+        Start a clone-find-all or clone-find-all-flattened command that
+        searches the outline at idle time.
+
+        on_progress(search, positions) receives lists of found positions as
+        the search finds them.
+
+        on_done(search) runs after the search creates the organizer node.
+        search.result is the count of found nodes.
+
+        If run is False, the caller must drive the search with search.step().
+
+        Return the BackgroundSearch, or None if the search could not start.
+        """
+        kind = 'clone-find-all-flattened' if flatten else 'clone-find-all'
+        self.init_ivars_from_settings(settings)
+        if not self.check_args(kind):
+            return None
+        if self.pattern_match and not self.compile_pattern():
+            return None
+        p, after = self._cf_range()
+
+        def finish(search: BackgroundSearch) -> None:
+            search.result = self._cf_finish(search.results)
+            if on_done:
+                on_done(search)
+
+        return self.start_background_search(kind,
+            self._cf_matches(p, after, flatten), on_done=finish, on_progress=on_progress, run=run)
+
+    def finish_interactive_clone_find_all(self, search: BackgroundSearch) -> None:  # pragma: no cover (interactive)
+        c = self.c
+        if search.result:
+            c.redraw()
+            c.treeWantsFocus()
     #@+node:ekr.20131117164142.16996: *4* find.clone-find-all-flattened & helper
     @cmd('clone-find-all-flattened')
     @cmd('find-clone-all-flattened')
@@ -1381,6 +1437,12 @@ class LeoFind:
         k.resetLabel()
         k.showStateAndMode()
         c.widgetWantsFocusNow(w)
+        if self.search_in_background:
+            self.start_clone_find_all(settings,
+                flatten=True,
+                on_progress=self.show_background_progress,
+                on_done=self.finish_interactive_clone_find_all)
+            return 0
         count = self.do_clone_find_all_flattened(settings)
         if count:
             c.redraw()
@@ -1507,7 +1569,10 @@ class LeoFind:
         k.clearState()
         k.resetLabel()
         k.showStateAndMode()
-        self.do_find_all(settings)
+        if self.search_in_background:
+            self.start_find_all(settings, on_progress=self.show_background_progress)
+        else:
+            self.do_find_all(settings)
 
     def find_all_escape_handler(self, event: LeoKeyEvent) -> None:  # pragma: no cover (interactive)
         k = self.k
@@ -1560,11 +1625,45 @@ class LeoFind:
         if not self.check_args('find-all'):  # pragma: no cover
             return {}
         result_dict = self._find_all_helper(settings)
-        # Suboutline-only is a one-shot for batch commands.
-        self.ftm.set_radio_button('entire-outline')
-        self.root = None
-        self.node_only = self.suboutline_only = False
+        self.reset_limiters()
         return result_dict
+    #@+node:ekr.20240425051244.1: *5* find.start_find_all
+    def start_find_all(self,
+        settings: Settings,
+        on_progress: Callable = None,
+        on_done: Callable = None,
+        run: bool = True,
+    ) -> Optional[BackgroundSearch]:
+        """
+        Start a find-all command that searches the outline at idle time.
+
+        on_progress(search, matches) receives lists of match dicts as the
+        search finds them. See do_find_all for the format of match dicts.
+
+        on_done(search) runs after the search creates the summary node.
+        search.result is the dict that do_find_all would return.
+
+        If run is False, the caller must drive the search with search.step().
+
+        Return the BackgroundSearch, or None if the search could not start.
+        """
+        self.init_ivars_from_settings(settings)
+        if not self.check_args('find-all'):  # pragma: no cover
+            return None
+        saveData = self.save()
+        vnodes = self._find_all_vnodes()
+        if vnodes is None:
+            self.reset_limiters()
+            return None
+
+        def finish(search: BackgroundSearch) -> None:
+            search.result = self._find_all_finish(search.results, saveData)
+            self.reset_limiters()
+            if on_done:
+                on_done(search)
+
+        return self.start_background_search('find-all',
+            self._find_all_matches(vnodes), on_done=finish, on_progress=on_progress, run=run)
     #@+node:ekr.20160422073500.1: *6* find._find_all_helper & helpers
     def _find_all_helper(self, settings: Settings) -> dict[str, Any]:
         """
@@ -1572,43 +1671,74 @@ class LeoFind:
 
         Return the list of Dicts describing each match.
         """
-        c, u = self.c, self.c.undoer
-        undoType = 'Find All'
         saveData = self.save()
+        vnodes = self._find_all_vnodes()
+        if vnodes is None:
+            return {}
+        matches_dict = [z for z in self._find_all_matches(vnodes) if z]
+        return self._find_all_finish(matches_dict, saveData)
+    #@+node:ekr.20240425051601.1: *7* find._find_all_vnodes
+    def _find_all_vnodes(self) -> Optional[list[VNode]]:
+        """
+        Return the list of vnodes that find-all should search, honoring limiters.
+
+        Return None if the search pattern is invalid.
+        """
+        c = self.c
         if self.pattern_match:
             ok = self.compile_pattern()
             if not ok:
-                return {}
-        # Create a list of vnodes, honoring limiters.
+                return None
         vnodes: list[VNode]
         if self.node_only:
             vnodes = [c.p.v]
         elif self.suboutline_only:
             vnodes = list(set(z.v for z in c.p.self_and_subtree()))
         else:
-            vnodes = list(c.all_unique_nodes())
-        matches_dict: list[dict] = []
-        distinct_body_lines, total_matches, total_nodes = 0, 0, 0
+            vnodes = c.flatOutline().unique_nodes()
+            if not self.pattern_match:
+                # Search only the nodes that might match.
+                candidates = c.searchIndex.find_candidates(
+                    [self.replace_back_slashes(self.find_text)],
+                    head=self.search_headline,
+                    body=self.search_body,
+                    whole_word=self.whole_word,
+                )
+                if candidates is not None:
+                    vnodes = [v for v in vnodes if v in candidates]
+        return vnodes
+    #@+node:ekr.20240425051918.1: *7* find._find_all_matches
+    def _find_all_matches(self, vnodes: list[VNode]) -> Generator[Optional[dict], None, None]:
+        """
+        Search the given vnodes.
+
+        Yield a dict describing the matches in each vnode, or None if the
+        vnode contains no matches.
+        """
         for v in vnodes:
-            body, head = [], []
             # Ignore @nosearch nodes.
             if any(z.startswith('@nosearch') for z in g.splitLines(v.b)):
+                yield None
                 continue
-            if self.search_body:
-                body = self.find_all_matches_in_string(v.b)
-                total_matches += len(body)
-                # Update the distinct line numbers in this body.
-                line_number_set = set()
-                for index in body:
-                    line_number, _unused = self.index_to_line_info(index, v.b)
-                    line_number_set.add(line_number)
-                distinct_body_lines += len(list(line_number_set))
-            if self.search_headline:
-                head = self.find_all_matches_in_string(v.h)
-                total_matches += len(head)
-            if body or head:
-                total_nodes += 1
-                matches_dict.append({'body': body, 'head': head, 'v': v})
+            body = self.find_all_matches_in_string(v.b) if self.search_body else []
+            head = self.find_all_matches_in_string(v.h) if self.search_headline else []
+            yield {'body': body, 'head': head, 'v': v} if body or head else None
+    #@+node:ekr.20240425052235.1: *7* find._find_all_finish
+    def _find_all_finish(self, matches_dict: list[dict], saveData: UndoData) -> dict[str, Any]:
+        """
+        Create the summary node for the given matches.
+
+        Return the dict described in do_find_all.
+        """
+        c, u = self.c, self.c.undoer
+        undoType = 'Find All'
+        distinct_body_lines, total_matches = 0, 0
+        for match in matches_dict:
+            body, v = match['body'], match['v']
+            total_matches += len(body) + len(match['head'])
+            # Count the distinct line numbers in this body.
+            distinct_body_lines += len(set(self.index_to_line_info(z, v.b)[0] for z in body))
+        total_nodes = len(matches_dict)
         if not matches_dict:
             # Not even one match found!
             self.restore(saveData)
@@ -1929,7 +2059,7 @@ class LeoFind:
 
             # Find all unique instances of pattern.
             results_set = set()
-            for v in c.all_unique_nodes():
+            for v in c.flatOutline().unique_nodes():
                 for m in re.finditer(re_pattern, v.b):
                     results_set.add(m.group(0))
             results = list(sorted(results_set))
@@ -2049,6 +2179,48 @@ class LeoFind:
             escape_handler=self.start_search_escape1,  # See start-search
         )
     #@+node:ekr.20210112192427.1: *3* LeoFind.Commands: helpers
+    #@+node:ekr.20240424073952.1: *4* find.background searches
+    def start_background_search(self,
+        kind: str,
+        generator: Generator,
+        on_done: Callable,
+        on_progress: Callable = None,
+        run: bool = True,
+    ) -> BackgroundSearch:
+        """
+        Cancel any running background search, then create a new one.
+
+        Start the new search if run is True.
+        """
+        self.cancel_background_search()
+        search = BackgroundSearch(self.c, kind, generator, on_done=on_done, on_progress=on_progress)
+        self.background_search = search
+        if run:
+            search.start()
+        return search
+
+    def cancel_background_search(self, reset_limiters: bool = True) -> bool:
+        """Cancel the running background search. Return True if there was one."""
+        search = self.background_search
+        self.background_search = None
+        if not search or search.done or search.cancelled:
+            return False
+        search.cancel()
+        if reset_limiters:
+            self.reset_limiters()
+        g.es(f"{search.kind} cancelled")
+        return True
+
+    def show_background_progress(self, search: BackgroundSearch, items: list) -> None:  # pragma: no cover (interactive)
+        """Show the progress of a background search in the status line."""
+        self.c.frame.putStatusLine(
+            f"{search.kind}: {len(search.results)} found for {self.find_text} (Escape cancels)")
+    #@+node:ekr.20240424074309.1: *4* find.reset_limiters
+    def reset_limiters(self) -> None:
+        """Suboutline-only and node-only are one-shots for batch commands."""
+        self.ftm.set_radio_button('entire-outline')
+        self.root = None
+        self.node_only = self.suboutline_only = False
     #@+node:ekr.20210110073117.9: *4* find._cf_helper & helpers
     def _cf_helper(self, settings: Settings, flatten: bool) -> int:  # Caller has  checked the settings.
         """
@@ -2056,41 +2228,66 @@ class LeoFind:
 
         Return the number of found nodes.
         """
-        c, u = self.c, self.c.undoer
         if self.pattern_match:
             ok = self.compile_pattern()
             if not ok:
                 return 0
+        p, after = self._cf_range()
+        clones = [z for z in self._cf_matches(p, after, flatten) if z]
+        return self._cf_finish(clones)
+    #@+node:ekr.20240425052909.1: *5* find._cf_range
+    def _cf_range(self) -> tuple[Position, Optional[Position]]:
+        """Return (p, after), the range of positions that the clone-find commands search."""
+        c = self.c
         if self.suboutline_only:
-            p = c.p
-            after = p.nodeAfterTree()
-        else:
-            p = c.rootPosition()
-            after = None
-        count, found = 0, None
-        clones, skip = [], set()
+            p = c.p.copy()
+            return p, p.nodeAfterTree()
+        return c.rootPosition(), None
+    #@+node:ekr.20240425053226.1: *5* find._cf_matches
+    def _cf_matches(self,
+        p: Position,
+        after: Optional[Position],
+        flatten: bool,
+    ) -> Generator[Optional[Position], None, None]:
+        """
+        Search the positions from p up to (but not including) after.
+
+        Yield a copy of each position to be cloned, or None for each
+        position that does not match.
+        """
+        skip: set[VNode] = set()
         while p and p != after:
             progress = p.copy()
             if g.inAtNosearch(p):
                 p.moveToNodeAfterTree()
+                yield None
             elif p.v in skip:  # pragma: no cover (minor)
                 p.moveToThreadNext()
+                yield None
             elif self._cfa_find_next_match(p):
-                count += 1
+                found = p.copy()
                 if flatten:
                     skip.add(p.v)
-                    clones.append(p.copy())
                     p.moveToThreadNext()
                 else:
-                    if p not in clones:
-                        clones.append(p.copy())
                     # Don't look at the node or it's descendants.
                     for p2 in p.self_and_subtree(copy=False):
                         skip.add(p2.v)
                     p.moveToNodeAfterTree()
+                yield found
             else:
                 p.moveToThreadNext()
+                yield None
             assert p != progress
+    #@+node:ekr.20240425053543.1: *5* find._cf_finish
+    def _cf_finish(self, clones: list[Position]) -> int:
+        """
+        Create the organizer node for the clone-find commands.
+
+        Return the number of found nodes.
+        """
+        c, u = self.c, self.c.undoer
+        count, found = len(clones), None
         if clones:
             undoData = u.beforeInsertNode(c.p)
             found = self._cfa_create_nodes(clones, flattened=False)
@@ -2101,10 +2298,7 @@ class LeoFind:
             # Put the count in found.h.
             found.h = found.h.replace('Found:', f"Found {count}:")
         # Reset data after calculating results.
-        self.ftm.set_radio_button('entire-outline')
-        # suboutline-only is a one-shot for batch commands.
-        self.node_only = self.suboutline_only = False
-        self.root = None
+        self.reset_limiters()
         g.es("found", count, "matches for", self.find_text)
         return count  # Might be useful for the gui update.
     #@+node:ekr.20210110073117.34: *5* find._cfa_create_nodes
@@ -3087,6 +3281,99 @@ class LeoFind:
         if s not in self.findTextList:
             self.findTextList.append(s)
     #@-others
+#@+node:ekr.20240424074626.1: ** class BackgroundSearch
+class BackgroundSearch:
+    """
+    Run a search in short time slices at idle time, so that searching a
+    large outline does not freeze the gui.
+
+    The search generator yields one item per unit of work: a result, or
+    None if the unit of work found nothing. Changing the outline's
+    structure cancels the search, because found positions may no longer
+    be valid.
+    """
+    #@+others
+    #@+node:ekr.20240424074943.1: *3* BackgroundSearch.__init__
+    def __init__(self,
+        c: Cmdr,
+        kind: str,
+        generator: Generator,
+        on_done: Callable,
+        on_progress: Callable = None,
+    ) -> None:
+        self.c = c
+        self.kind = kind  # The name of the command.
+        self.generator = generator
+        self.on_done = on_done  # on_done(search)
+        self.on_progress = on_progress  # on_progress(search, new_results)
+        self.cancelled = False
+        self.done = False
+        self.generation = c.frame.tree.generation
+        self.result: Any = None  # Set by on_done.
+        self.results: list = []  # All results found so far.
+        self.time_slice = c.config.getInt('background-search-time-slice') or 50  # msec.
+        self.timer: Any = None
+    #@+node:ekr.20240424075300.1: *3* BackgroundSearch.cancel & start
+    def cancel(self) -> None:
+        """Stop the search without calling on_done."""
+        self.cancelled = True
+        if self.timer:
+            self.timer.stop()
+        self.generator.close()
+
+    def start(self) -> None:
+        """
+        Run the search at idle time.
+
+        Run the entire search immediately if there is no idle-time timer.
+        leoserver drives its searches with search.step instead.
+        """
+        self.timer = g.IdleTime(self.on_idle, delay=0, tag=self.kind)
+        if self.timer:
+            self.timer.start()
+        else:
+            while self.step():
+                pass
+
+    def on_idle(self, timer: Any) -> None:  # pragma: no cover (gui)
+        if not self.step():
+            timer.stop()
+    #@+node:ekr.20240424075617.1: *3* BackgroundSearch.step
+    def step(self) -> bool:
+        """
+        Run the search for one time slice.
+
+        Return True if the search has more work to do.
+        """
+        if self.cancelled or self.done:
+            return False
+        fc = self.c.findCommands
+        if self.c.frame.tree.generation != self.generation:
+            g.es(f"{self.kind}: the outline changed")
+            if fc.background_search is self:
+                fc.cancel_background_search()
+            else:
+                self.cancel()
+            return False
+        t1 = time.perf_counter()
+        limit = self.time_slice / 1000.0
+        new_results = []
+        for item in self.generator:
+            if item is not None:
+                new_results.append(item)
+            if time.perf_counter() - t1 >= limit:
+                break
+        else:
+            self.done = True
+        self.results.extend(new_results)
+        if new_results and self.on_progress:
+            self.on_progress(self, new_results)
+        if self.done:
+            if fc.background_search is self:
+                fc.background_search = None
+            self.on_done(self)
+        return not self.done
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
@@ -2575,10 +2575,21 @@ def get_directives_dict(p: Position) -> dict[str, str]:
 
     Returns a dict containing the stripped remainder of the line
     following the first occurrence of each recognized directive.
-    """
+
+    c.directivesCache holds the result for each vnode. Entries remain
+    valid until p.h, p.b or g.directives_pat changes.
+    """
+    v = p.v
+    cache = v.context.directivesCache
+    # Lazy bodies of .db files never contain directives. See fc.retrieveVnodesFromDb.
+    body = p.b if v.isBodyLoaded() else ''
+    head = p.h
+    data = cache.get(v)
+    if data and data[0] is g.directives_pat and data[1] is head and data[2] is body:
+        return dict(data[3])
     d = {}
     # The headline has higher precedence because it is more visible.
-    for kind, s in (('head', p.h), ('body', p.b)):
+    for kind, s in (('head', head), ('body', body)):
         anIter = g.directives_pat.finditer(s)
         for m in anIter:
             word = m.group(1).strip()
@@ -2600,19 +2611,38 @@ def get_directives_dict(p: Position) -> dict[str, str]:
             k = g.skip_line(s, j)
             val = s[j:k].strip()
             d[word] = val
-    return d
+    cache[v] = (g.directives_pat, head, body, d)
+    return dict(d)
 #@+node:ekr.20080827175609.1: *3* g.get_directives_dict_list (must be fast)
 def get_directives_dict_list(p: Position) -> list[dict]:
     """Scans p and all its ancestors for directives.
 
     Returns a list of dicts containing pointers to
-    the start of each directive"""
-    result = []
-    p1 = p.copy()
-    for p in p1.self_and_parents(copy=False):
-        # No copy necessary: g.get_directives_dict does not change p.
-        result.append(g.get_directives_dict(p))
-    return result
+    the start of each directive
+
+    c.directivesListCache holds the list for each chain of vnodes. The list
+    for p extends the cached list for p's parent. The cache is cleared when
+    the structure of the outline, any headline or body, or
+    g.directives_pat changes."""
+    c = p.v.context
+    stamp = (c.frame.tree.generation, c.directivesChangeCount, g.directives_pat)
+    if c.directivesListStamp != stamp:
+        c.directivesListStamp = stamp
+        c.directivesListCache = {}
+    cache = c.directivesListCache
+    aList: list[dict] = []
+    positions: list[Position] = []  # Computed only if needed.
+    # From the top-level ancestor down to p.v.
+    for i, v in enumerate([v for v, n in p.stack] + [p.v]):
+        key = (v, id(aList) if i else 0)
+        child_list = cache.get(key)
+        if child_list is None:
+            if not positions:
+                positions = list(p.self_and_parents())[::-1]
+            child_list = cache[key] = [g.get_directives_dict(positions[i])] + aList
+        aList = child_list
+    # Callers may change the dicts.
+    return [dict(d) for d in aList]
 #@+node:ekr.20111010082822.15545: *3* g.getLanguageFromAncestorAtFileNode
 def getLanguageFromAncestorAtFileNode(p: Position) -> Optional[str]:
     """Return the language in effect at node p."""
@@ -6971,14 +7001,13 @@ def findGnx(gnx: str, c: Cmdr) -> Optional[Position]:
             n = int(m.group(2))
         except(TypeError, ValueError):
             pass
-    # Search forwards, setting p2.
-    for p in c.all_unique_positions():
-        if p.gnx == gnx:
-            if n is None:
-                return p
-            p2, offset = c.gotoCommands.find_file_line(-n, p)
-            return p2 or p
-    return None
+    p = c.positionForGnx(gnx)
+    if not p:
+        return None
+    if n is None:
+        return p
+    p2, offset = c.gotoCommands.find_file_line(-n, p)
+    return p2 or p
 #@+node:tbrown.20140311095634.15188: *3* g.findUnl & helpers (legacy unls)
 def findUnl(unlList1: list[str], c: Cmdr) -> Optional[Position]:
     """
@@ -7330,11 +7359,11 @@ def openUrlHelper(event: LeoKeyEvent, url: str = None) -> Optional[str]:
                 if target:
                     if c.p.gnx == target:
                         return target
-                    for p in c.all_unique_positions():
-                        if p.v.gnx == target:
-                            c.selectPosition(p)
-                            c.redraw()
-                            return target
+                    p = c.positionForGnx(target)
+                    if p:
+                        c.selectPosition(p)
+                        c.redraw()
+                        return target
                     return None
                 #@-<< look for gnx >>
     elif not isinstance(url, str):
@@ -2871,6 +2871,8 @@ class KeyHandlerClass:
         if g.app.quitting:
             return
         c.endEditing()
+        # Cancel any background find-all or clone-find-all command.
+        c.findCommands.cancel_background_search()
         # Completely clear the mode.
         if setFocus:
             c.frame.log.deleteTab('Mode')
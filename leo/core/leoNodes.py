@@ -23,6 +23,121 @@ if TYPE_CHECKING:  # pragma: no cover
     from leo.core.leoCommands import Commands as Cmdr
 #@-<< leoNodes imports & annotations >>
 #@+others
+#@+node:ekr.20240424063729.1: ** class FlatOutline
+class FlatOutline:
+    """
+    An immutable snapshot of an outline's structure.
+
+    Entry i describes the i'th position of the outline, in outline order:
+
+    vnodes[i]:       The position's vnode.
+    levels[i]:       The position's level.
+    parents[i]:      The index of the position's parent, or -1 for top-level positions.
+    childIndices[i]: The position's child index.
+    subtreeEnds[i]:  The index of the position's node-after-tree.
+
+    Use c.flatOutline to get a snapshot. Traversals can loop over these tuples
+    without creating or moving positions. Snapshots become invalid when the
+    outline's structure changes, that is, when c.frame.tree.generation changes.
+    """
+
+    __slots__ = [
+        'c', 'childIndices', 'generation', 'levels', 'parents', 'subtreeEnds',
+        'topLevelVnodes', 'vnodes',
+    ]
+
+    #@+others
+    #@+node:ekr.20240424063729.2: *3* flat.__init__
+    def __init__(self, c: Cmdr) -> None:
+        """Create a snapshot of c's outline."""
+        self.c = c
+        self.generation = c.frame.tree.generation
+        self.topLevelVnodes = list(c.hiddenRootNode.children)
+        vnodes: list[VNode] = []
+        levels: list[int] = []
+        parents: list[int] = []
+        childIndices: list[int] = []
+        # Entries are (parent index, level, child index, vnode), in reverse order.
+        todo: list[tuple[int, int, int, VNode]] = [
+            (-1, 0, n, v) for n, v in reversed(list(enumerate(c.hiddenRootNode.children)))
+        ]
+        while todo:
+            parent, level, n, v = todo.pop()
+            i = len(vnodes)
+            vnodes.append(v)
+            levels.append(level)
+            parents.append(parent)
+            childIndices.append(n)
+            children = v.children
+            for n in range(len(children) - 1, -1, -1):
+                todo.append((i, level + 1, n, children[n]))
+        # Each subtree ends where its last descendant's subtree ends.
+        # Descendants follow their ancestors, so visit entries in reverse order.
+        ends = list(range(1, len(vnodes) + 1))
+        for i in range(len(vnodes) - 1, -1, -1):
+            parent = parents[i]
+            if parent > -1 and ends[i] > ends[parent]:
+                ends[parent] = ends[i]
+        self.vnodes: tuple[VNode, ...] = tuple(vnodes)
+        self.levels: tuple[int, ...] = tuple(levels)
+        self.parents: tuple[int, ...] = tuple(parents)
+        self.childIndices: tuple[int, ...] = tuple(childIndices)
+        self.subtreeEnds: tuple[int, ...] = tuple(ends)
+
+    def __len__(self) -> int:
+        return len(self.vnodes)
+
+    def __repr__(self) -> str:
+        return f"<FlatOutline: {len(self.vnodes)} positions, generation {self.generation}>"
+    #@+node:ekr.20240424063729.3: *3* flat.isValid
+    def isValid(self) -> bool:
+        """Return True if the outline's structure has not changed since the snapshot."""
+        c = self.c
+        # Some code, such as the OPML reader, replaces the whole outline
+        # without changing the generation. Checking the top-level vnodes is cheap.
+        return (
+            self.generation == c.frame.tree.generation
+            and self.topLevelVnodes == c.hiddenRootNode.children
+        )
+    #@+node:ekr.20240424063729.4: *3* flat.position & positions
+    def position(self, i: int) -> Position:
+        """Return a new position corresponding to entry i."""
+        childIndices, parents, vnodes = self.childIndices, self.parents, self.vnodes
+        stack = []
+        j = parents[i]
+        while j > -1:
+            stack.append((vnodes[j], childIndices[j]))
+            j = parents[j]
+        stack.reverse()
+        return Position(vnodes[i], childIndices[i], stack)
+
+    def positions(self, predicate: Callable[[VNode], bool] = None, unique: bool = False) -> list[Position]:
+        """
+        Return a list of new positions, in outline order.
+
+        predicate: Include only entries whose vnode satisfies the predicate.
+        unique:    Include only the first position of each vnode, as in c.all_unique_positions.
+        """
+        ends, vnodes = self.subtreeEnds, self.vnodes
+        result: list[Position] = []
+        seen: set[VNode] = set()
+        i, n = 0, len(vnodes)
+        while i < n:
+            v = vnodes[i]
+            if unique:
+                if v in seen:
+                    i = ends[i]
+                    continue
+                seen.add(v)
+            if predicate is None or predicate(v):
+                result.append(self.position(i))
+            i += 1
+        return result
+    #@+node:ekr.20240424063729.5: *3* flat.unique_nodes
+    def unique_nodes(self) -> list[VNode]:
+        """Return a list of all distinct vnodes, in the order of c.all_unique_nodes."""
+        return list(dict.fromkeys(self.vnodes))
+    #@-others
 #@+node:ekr.20031218072017.1991: ** class NodeIndices
 class NodeIndices:
     """A class managing global node indices (gnx's)."""
@@ -1217,6 +1332,7 @@ class Position:
             g.internalError('no parent_v', p)
             return
         if parent_v.children[p._childIndex] == v:
+            v.context.frame.tree.generation += 1
             parent_v.children[p._childIndex] = v2
             v2.parents.append(parent_v)
             # p.v no longer truly exists.
@@ -1674,6 +1790,7 @@ class Position:
         # Add the children to parent_v's children.
         n = p.childIndex() + 1
         z = parent_v.children[:]
+        p.v.context.frame.tree.generation += 1
         parent_v.children = z[:n]
         parent_v.children.extend(children)
         parent_v.children.extend(z[n:])
@@ -2060,6 +2177,19 @@ class VNode:
         #       g.app.nodeIndices.new_vnode_helper(c,gnx,v)
         g.app.nodeIndices.new_vnode_helper(context, gnx, self)
         assert self.fileIndex, g.callers()
+    #@+node:ekr.20240424053823.1: *4* v.__getattr__
+    def __getattr__(self, name: str) -> Any:
+        """
+        Python calls this method only if normal lookup fails.
+
+        v._bodyString is unset only for lazy bodies of .db files.
+        See fc.retrieveVnodesFromDb and fc.loadLazyBody.
+        """
+        if name == '_bodyString':
+            fc = getattr(self.context, 'fileCommands', None)
+            if fc:
+                return fc.loadLazyBody(self)
+        raise AttributeError(name)
     #@+node:ekr.20031218072017.3345: *4* v.__repr__ & v.__str__
     def __repr__(self) -> str:  # pragma: no cover
         return (
@@ -2215,6 +2345,8 @@ class VNode:
         # v = self
         if g.match_word(self._headString, 0, '@ignore'):
             return True
+        if not self.isBodyLoaded():
+            return False  # Lazy bodies never contain directives.
         flag, i = g.is_special(self._bodyString, "@ignore")
         return flag
     #@+node:ekr.20031218072017.3352: *4* v.isAtOthersNode
@@ -2271,6 +2403,18 @@ class VNode:
             # This message should never be printed and we want to avoid crashing here!
             g.internalError(f"body not unicode: {self._bodyString!r}")
             return g.toUnicode(self._bodyString)
+    #@+node:ekr.20240424054140.1: *4* v.isBodyLoaded
+    def isBodyLoaded(self) -> bool:
+        """
+        Return False if v's body is a lazy body that has not yet been read.
+
+        Unlike v.b, this method never reads the body.
+        """
+        try:
+            VNode._bodyString.__get__(self, VNode)  # type:ignore
+            return True
+        except AttributeError:
+            return False
     #@+node:ekr.20031218072017.3360: *4* v.Children
     #@+node:ekr.20031218072017.3362: *5* v.firstChild
     def firstChild(self) -> Optional[VNode]:
@@ -2363,11 +2507,13 @@ class VNode:
         """Clear the vnode dirty bit."""
         v = self
         v.statusBits &= ~v.dirtyBit
+        v.recordChange()
         v.updateIcon()
     #@+node:ekr.20031218072017.3391: *5* v.clearMarked
     def clearMarked(self) -> None:
         v = self
         v.statusBits &= ~v.markedBit
+        v.recordChange()
         v.updateIcon()
     #@+node:ekr.20031218072017.3392: *5* v.clearOrphan
     def clearOrphan(self) -> None:
@@ -2382,14 +2528,17 @@ class VNode:
     def contract(self) -> None:
         """Contract the node."""
         self.statusBits &= ~self.expandedBit
+        self.recordChange()
 
     def expand(self) -> None:
         """Expand the node."""
         self.statusBits |= self.expandedBit
+        self.recordChange()
 
     def initExpandedBit(self) -> None:
         """Init self.statusBits."""
         self.statusBits |= self.expandedBit
+        self.recordChange()
 
     def isExpanded(self) -> bool:
         """Return True if the VNode expansion bit is set."""
@@ -2397,6 +2546,7 @@ class VNode:
     #@+node:ekr.20031218072017.3396: *5* v.initStatus
     def initStatus(self, status: int) -> None:
         self.statusBits = status
+        self.recordChange()
     #@+node:ekr.20080429053831.12: *5* v.setDirty
     def setDirty(self) -> None:
         """
@@ -2407,15 +2557,18 @@ class VNode:
         """
         v = self
         v.statusBits |= v.dirtyBit
+        v.recordChange()
         v.updateIcon()
     #@+node:ekr.20031218072017.3398: *5* v.setMarked & initMarkedBit
     def setMarked(self) -> None:
         v = self
         v.statusBits |= v.markedBit
+        v.recordChange()
         v.updateIcon()
 
     def initMarkedBit(self) -> None:
         self.statusBits |= self.markedBit
+        self.recordChange()
     #@+node:ekr.20031218072017.3399: *5* v.setOrphan
     def setOrphan(self) -> None:
         """Set the vnode's orphan bit."""
@@ -2474,6 +2627,16 @@ class VNode:
     #@+node:ville.20120502221057.7498: *4* v.contentModified
     def contentModified(self) -> None:
         g.contentModifiedSet.add(self)
+    #@+node:ekr.20240424123101.1: *4* v.recordChange
+    def recordChange(self) -> None:
+        """
+        Add v to all sets in c.vnodeChangeSets.
+
+        Setters of v's headline, body and status bits call this method, so
+        observers such as the server's ChangeFeed need not examine all vnodes.
+        """
+        for aSet in self.context.vnodeChangeSets:
+            aSet.add(self)
     #@+node:ekr.20100303074003.5636: *4* v.restoreCursorAndScroll
     # Called only by LeoTree.selectHelper.
 
@@ -2537,6 +2700,9 @@ class VNode:
     def setBodyString(self, s: Any) -> None:
         # pylint: disable=no-else-return
         v = self
+        v.context.directivesCache.pop(v, None)
+        v.context.directivesChangeCount += 1
+        v.recordChange()
         if isinstance(s, str):
             v._bodyString = s
             v.updateIcon()
@@ -2552,6 +2718,9 @@ class VNode:
         # Fix bug: https://bugs.launchpad.net/leo-editor/+bug/1245535
         # API allows headlines to contain newlines.
         v = self
+        v.context.directivesCache.pop(v, None)
+        v.context.directivesChangeCount += 1
+        v.recordChange()
         if isinstance(s, str):
             v._headString = s.replace('\n', '')
             v.updateIcon()
@@ -2653,6 +2822,7 @@ class VNode:
         # the parent links in the descendant tree.
         # This handles clones properly when deleting a tree.
         if not v.parents:
+            v.context.directivesCache.pop(v, None)
             for child in v.children:
                 child._cutParentLinks(parent=v)
     #@+node:ekr.20090804190529.6133: *5* v._cutParentLinks
@@ -2661,6 +2831,7 @@ class VNode:
         v = self
         v.parents.remove(parent)
         if not v.parents:
+            v.context.directivesCache.pop(v, None)
             for child in v.children:
                 child._cutParentLinks(parent=v)
     #@+node:ekr.20180709064515.1: *4* v._deleteAllChildren
@@ -2679,6 +2850,7 @@ class VNode:
                 g.internalError(f"{v} not in parents of {v2}")
                 g.trace('v2.parents:')
                 g.printObj(v2.parents)
+        v.context.frame.tree.generation += 1
         v.children = []
     #@+node:ekr.20031218072017.3425: *4* v._linkAsNthChild
     def _linkAsNthChild(self, parent_v: VNode, n: int) -> None:
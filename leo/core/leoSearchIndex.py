@@ -0,0 +1,336 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20240424064720.1: * @file leoSearchIndex.py
+"""
+Leo's search index: an inverted index of the words in an outline.
+
+Searches use c.searchIndex.find_candidates to find the nodes that might
+match, then run their exact matches on just those nodes.
+"""
+#@+<< leoSearchIndex imports & annotations >>
+#@+node:ekr.20240424065037.1: ** << leoSearchIndex imports & annotations >>
+from __future__ import annotations
+from bisect import bisect_left, insort
+import hashlib
+import re
+import sys
+from typing import Any, Optional, TYPE_CHECKING
+from leo.core import leoGlobals as g
+
+if TYPE_CHECKING:  # pragma: no cover
+    from leo.core.leoCommands import Commands as Cmdr
+    from leo.core.leoNodes import VNode
+#@-<< leoSearchIndex imports & annotations >>
+
+#@+others
+#@+node:ekr.20240424065354.1: ** class SearchIndex
+class SearchIndex:
+    """
+    An inverted index mapping lowercase words to the vnodes containing them.
+
+    The index updates itself lazily. Each query re-indexes only the nodes
+    whose headline or body strings have changed since the previous query.
+    This works even for code that sets v._headString or v._bodyString
+    directly, as FastAtRead does.
+
+    c.db caches the index between sessions.
+    """
+
+    cache_key = 'search-index'
+    cache_version = 1
+    word_pat = re.compile(r'\w+')
+
+    #@+others
+    #@+node:ekr.20240424065711.1: *3* index.__init__
+    def __init__(self, c: Cmdr) -> None:
+        self.c = c
+        # Keys are vnodes. Values are tuples (h, b, headline words, body words).
+        self.entries: dict[VNode, tuple[str, str, frozenset[str], frozenset[str]]] = {}
+        # Keys are words. Values are sets of vnodes.
+        self.head_postings: dict[str, set[VNode]] = {}
+        self.body_postings: dict[str, set[VNode]] = {}
+        # The keys of the postings, organized for partial-word lookups.
+        self.head_table = WordTable()
+        self.body_table = WordTable()
+        # The entries read from c.db. Keys are gnxs.
+        # Values are tuples (headline digest, body digest, headline words, body words).
+        self.cached_entries: Optional[dict[str, tuple[str, str, tuple[str, ...], tuple[str, ...]]]] = None
+        self.changed = False  # True if the index has changed since the last load or save.
+    #@+node:ekr.20240424070028.1: *3* index.find_candidates & helper
+    def find_candidates(self,
+        strings: list[str],
+        *,
+        head: bool = True,
+        body: bool = True,
+        whole_word: bool = False,
+    ) -> Optional[set[VNode]]:
+        """
+        Return the set of vnodes whose headlines (if head is True) or bodies
+        (if body is True) might contain *all* the given strings, ignoring case.
+
+        Return None if the index can not narrow the search.
+        """
+        c = self.c
+        if not c.config.getBool('use-search-index', default=True):
+            return None
+        # A list of tuples (word, left_bound, right_bound).
+        # A bounded word can not extend past that end of the word in the text.
+        requirements: list[tuple[str, bool, bool]] = []
+        for s in strings:
+            s = s.lower()
+            for m in self.word_pat.finditer(s):
+                left = m.start() > 0 or whole_word and g.isWordChar1(s[0])
+                right = m.end() < len(s) or whole_word and g.isWordChar(s[-1])
+                requirements.append((m.group(0), left, right))
+        if not requirements:
+            return None
+        self.sync()
+        result: set[VNode] = set()
+        for flag, postings, table in (
+            (head, self.head_postings, self.head_table),
+            (body, self.body_postings, self.body_table),
+        ):
+            if not flag:
+                continue
+            found: Optional[set[VNode]] = None
+            for word, left, right in requirements:
+                vnodes: set[VNode] = set()
+                for word2 in self.matching_words(word, left, right, postings, table):
+                    vnodes |= postings[word2]
+                found = vnodes if found is None else found & vnodes
+                if not found:
+                    break
+            if found:
+                result |= found
+        return result
+    #@+node:ekr.20240424070345.1: *4* index.matching_words
+    def matching_words(self,
+        word: str,
+        left: bool,
+        right: bool,
+        postings: dict[str, set[VNode]],
+        table: WordTable,
+    ) -> list[str]:
+        """Return the indexed words that can contain the given (bounded) word."""
+        if left and right:
+            return [word] if word in postings else []
+        if left:
+            return table.prefixed(word)
+        if right:
+            return table.suffixed(word)
+        return table.containing(word)
+    #@+node:ekr.20240424070702.1: *3* index.load & save
+    def load(self) -> None:
+        """Read the cached entries from c.db."""
+        c = self.c
+        self.cached_entries = {}
+        if not c.mFileName:
+            return
+        try:
+            d = c.db.get(self.cache_key)
+            if isinstance(d, dict) and d.get('version') == self.cache_version:
+                self.cached_entries = d.get('entries') or {}
+        except Exception:
+            g.es_exception()
+
+    def save(self) -> None:
+        """Write the index to c.db, if it has changed."""
+        c = self.c
+        if not c.mFileName or not self.changed:
+            return
+        digest = self.digest
+        entries = {
+            v.gnx: (digest(h), digest(b), tuple(head_words), tuple(body_words))
+            for v, (h, b, head_words, body_words) in self.entries.items()
+        }
+        c.db[self.cache_key] = {'version': self.cache_version, 'entries': entries}
+        self.changed = False
+    #@+node:ekr.20240424071019.1: *3* index.sync & helpers
+    def sync(self) -> None:
+        """Update the index for all nodes whose headline or body have changed."""
+        c = self.c
+        if self.cached_entries is None:
+            self.load()
+        entries = self.entries
+        vnodes = c.flatOutline().unique_nodes()
+        for v in vnodes:
+            entry = entries.get(v)
+            if entry is None or entry[0] is not v._headString or entry[1] is not v._bodyString:
+                self.update(v)
+        # Now every vnode in the outline has an entry.
+        if len(entries) > len(vnodes):
+            for v in entries.keys() - set(vnodes):
+                self.remove(v)
+    #@+node:ekr.20240424071336.1: *4* index.digest & words
+    def digest(self, s: str) -> str:
+        """Return a digest of s."""
+        return hashlib.md5(s.encode('utf-8', 'surrogatepass')).hexdigest()
+
+    def words(self, s: str) -> frozenset[str]:
+        """Return the set of (interned) lowercase words in s."""
+        return frozenset(map(sys.intern, set(self.word_pat.findall(s.lower()))))
+    #@+node:ekr.20240424071653.1: *4* index.remove & update
+    def remove(self, v: VNode) -> None:
+        """Remove v from the index."""
+        entry = self.entries.pop(v, None)
+        if not entry:
+            return
+        self.changed = True
+        for words, postings, table in (
+            (entry[2], self.head_postings, self.head_table),
+            (entry[3], self.body_postings, self.body_table),
+        ):
+            for word in words:
+                aSet = postings.get(word)
+                if aSet is not None:
+                    aSet.discard(v)
+                    if not aSet:
+                        del postings[word]
+                        table.remove(word)
+
+    def update(self, v: VNode) -> None:
+        """Add or update v's entry in the index."""
+        self.remove(v)
+        h, b = v._headString, v._bodyString
+        cached: Any = self.cached_entries and self.cached_entries.pop(v.gnx, None)
+        if cached and cached[0] == self.digest(h) and cached[1] == self.digest(b):
+            head_words, body_words = frozenset(cached[2]), frozenset(cached[3])
+        else:
+            head_words, body_words = self.words(h), self.words(b)
+            self.changed = True
+        self.entries[v] = (h, b, head_words, body_words)
+        for words, postings, table in (
+            (head_words, self.head_postings, self.head_table),
+            (body_words, self.body_postings, self.body_table),
+        ):
+            for word in words:
+                aSet = postings.get(word)
+                if aSet is None:
+                    postings[word] = {v}
+                    table.add(word)
+                else:
+                    aSet.add(v)
+    #@-others
+#@+node:ekr.20240424122014.1: ** class WordTable
+class WordTable:
+    """
+    A set of words, organized for finding the words that start with, end
+    with, or contain a given string.
+
+    Sorted lists of the words and of the reversed words handle prefixes
+    and suffixes with bisect. A table of trigrams handles substrings.
+    Changes to the sorted lists wait until the next lookup, so building
+    the index never sorts more than once.
+    """
+
+    #@+others
+    #@+node:ekr.20240424122014.2: *3* table.__init__
+    def __init__(self) -> None:
+        self.words: list[str] = []  # Sorted.
+        self.reversed_words: list[str] = []  # Sorted.
+        # Changes not yet applied to the sorted lists.
+        self.added: set[str] = set()
+        self.removed: set[str] = set()
+        # Keys are trigrams, values are the words containing them.
+        # None until the first lookup of a substring.
+        self.trigrams: Optional[dict[str, set[str]]] = None
+    #@+node:ekr.20240424122014.3: *3* table.add & remove
+    def add(self, word: str) -> None:
+        """Add a word that is not in the table."""
+        if word in self.removed:
+            self.removed.discard(word)
+        else:
+            self.added.add(word)
+        if self.trigrams is not None:
+            for trigram in self.trigrams_of(word):
+                aSet = self.trigrams.get(trigram)
+                if aSet is None:
+                    self.trigrams[trigram] = {word}
+                else:
+                    aSet.add(word)
+
+    def remove(self, word: str) -> None:
+        """Remove a word that is in the table."""
+        if word in self.added:
+            self.added.discard(word)
+        else:
+            self.removed.add(word)
+        if self.trigrams is not None:
+            for trigram in self.trigrams_of(word):
+                aSet = self.trigrams.get(trigram)
+                if aSet is not None:
+                    aSet.discard(word)
+                    if not aSet:
+                        del self.trigrams[trigram]
+    #@+node:ekr.20240424122014.4: *3* table.flush
+    def flush(self) -> None:
+        """Apply all pending changes to the sorted lists."""
+        added, removed = self.added, self.removed
+        if not added and not removed:
+            return
+        if len(added) + len(removed) > len(self.words) // 8:
+            # Sorting is faster than many insertions.
+            self.words = sorted(added.union(self.words).difference(removed))
+            self.reversed_words = sorted(z[::-1] for z in self.words)
+        else:
+            for words, reverse in ((self.words, False), (self.reversed_words, True)):
+                for word in removed:
+                    word = word[::-1] if reverse else word
+                    del words[bisect_left(words, word)]
+                for word in added:
+                    insort(words, word[::-1] if reverse else word)
+        added.clear()
+        removed.clear()
+    #@+node:ekr.20240424122014.5: *3* table.prefixed, suffixed & containing
+    def prefixed(self, prefix: str) -> list[str]:
+        """Return all words that start with prefix."""
+        self.flush()
+        return self.starting_with(self.words, prefix)
+
+    def suffixed(self, suffix: str) -> list[str]:
+        """Return all words that end with suffix."""
+        self.flush()
+        return [z[::-1] for z in self.starting_with(self.reversed_words, suffix[::-1])]
+
+    def containing(self, s: str) -> list[str]:
+        """Return all words that contain s."""
+        self.flush()
+        if len(s) < 3:
+            return [z for z in self.words if s in z]
+        if self.trigrams is None:
+            self.trigrams = {}
+            for word in self.words:
+                for trigram in self.trigrams_of(word):
+                    aSet = self.trigrams.get(trigram)
+                    if aSet is None:
+                        self.trigrams[trigram] = {word}
+                    else:
+                        aSet.add(word)
+        sets = []
+        for trigram in self.trigrams_of(s):
+            aSet = self.trigrams.get(trigram)
+            if not aSet:
+                return []
+            sets.append(aSet)
+        sets.sort(key=len)
+        candidates = sets[0].intersection(*sets[1:])
+        return [z for z in candidates if s in z]
+    #@+node:ekr.20240424122014.6: *3* table.starting_with & trigrams_of
+    def starting_with(self, words: list[str], prefix: str) -> list[str]:
+        """Return the words of the sorted list that start with prefix."""
+        result = []
+        for i in range(bisect_left(words, prefix), len(words)):
+            word = words[i]
+            if not word.startswith(prefix):
+                break
+            result.append(word)
+        return result
+
+    def trigrams_of(self, word: str) -> set[str]:
+        """Return the set of all trigrams in word."""
+        return {word[i : i + 3] for i in range(len(word) - 2)}
+    #@-others
+#@-others
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+#@-leo
@@ -46,7 +46,10 @@
 #@+node:ekr.20220821074023.1: ** << leoUndo imports & annotations >>
 from __future__ import annotations
 from collections.abc import Callable
-from typing import TYPE_CHECKING
+import difflib
+import itertools
+import sys
+from typing import Any, TYPE_CHECKING
 from leo.core import leoGlobals as g
 from leo.core.leoFileCommands import FastRead
 from leo.core.leoNodes import Position, VNode
@@ -73,6 +76,7 @@ class Undoer:
         self.p: Position = None  # The position/node being operated upon for undo and redo.
         self.granularity = None  # Set in reloadSettings.
         self.max_undo_stack_size = c.config.getInt('max-undo-stack-size') or 0
+        self.max_undo_stack_bytes = c.config.getInt('max-undo-stack-bytes') or 0
         # State ivars...
         self.beads = []  # List of undo nodes.
         self.bead = -1  # Index of the present bead: -1:len(beads)
@@ -91,8 +95,12 @@ class Undoer:
         # Set the following ivars to keep pylint happy.
         # mypy doesn't care about these.
         self.afterTree = None
+        self.linkOps: tuple = None
         self.beforeTree = None
+        self.bodyDelta = None
+        self.byteSize: int = None
         self.children = None
+        self.contents: tuple = None
         self.deleteMarkedNodesData: g.Bunch = None
         self.followingSibs: list[VNode] = None
         self.headlines: dict[str, tuple[str, str]]
@@ -107,7 +115,6 @@ class Undoer:
         self.newN = None
         self.newP = None
         self.newParent = None
-        self.newPastedTree = None
         self.newParent_v = None
         self.newRecentFiles = None
         self.newSel = None
@@ -123,7 +130,6 @@ class Undoer:
         self.oldN = None
         self.oldParent = None
         self.oldParent_v = None
-        self.oldPastedTree = None
         self.oldRecentFiles = None
         self.oldSel = None
         self.oldSiblings = None
@@ -145,6 +151,159 @@ class Undoer:
         if self.granularity not in ('node', 'line', 'word', 'char'):
             self.granularity = 'line'
     #@+node:ekr.20050416092908.1: *3* u.Internal helpers
+    #@+node:ekr.20240424082907.1: *4* u.beadSize & memoryUse
+    def beadSize(self, bunch: g.Bunch, recompute: bool = False) -> int:
+        """
+        Return an estimate of the number of bytes used by the bead.
+
+        The estimate includes strings and containers, but not positions,
+        vnodes or helpers, which belong to the outline or to the Undoer.
+        """
+        if not recompute and bunch.get('byteSize') is not None:
+            return bunch.byteSize
+        seen: set[int] = set()
+
+        def size(obj: Any) -> int:
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            if isinstance(obj, (str, bytes)):
+                return sys.getsizeof(obj)
+            if isinstance(obj, (list, tuple, set, frozenset)):
+                return sys.getsizeof(obj) + sum(size(z) for z in obj)
+            if isinstance(obj, dict):
+                return sys.getsizeof(obj) + sum(size(key) + size(val) for key, val in obj.items())
+            if isinstance(obj, g.Bunch):
+                d = obj.__dict__
+                return sys.getsizeof(d) + sum(size(val) for key, val in d.items() if key != 'byteSize')
+            return 0
+
+        bunch.byteSize = n = size(bunch)
+        return n
+
+    def memoryUse(self) -> int:
+        """Return an estimate of the number of bytes used by the undo stack."""
+        u = self
+        # The present bead may still change, so always recompute its size.
+        return sum(u.beadSize(bunch, recompute=i == u.bead) for i, bunch in enumerate(u.beads))
+    #@+node:ekr.20240424083224.1: *4* u.computeBodyDelta & expandBodyDelta
+    def computeBodyDelta(self, old: str, new: str) -> tuple:
+        """
+        Return a compact, reversible delta between two versions of a body.
+
+        The delta is a tuple (hash(old), hash(new), blocks). Each block is a
+        tuple (old_i, old_j, new_i, new_j, old_s, new_s): old[old_i:old_j] is
+        old_s and new[new_i:new_j] is new_s. All other text is common.
+
+        u.expandBodyDelta recreates *both* versions from *either* version.
+        """
+        # Find the common prefix and suffix with a binary search.
+        lo, hi = 0, min(len(old), len(new))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[:mid] == new[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        i = lo
+        lo, hi = 0, min(len(old), len(new)) - i
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[len(old) - mid :] == new[len(new) - mid :]:
+                lo = mid
+            else:
+                hi = mid - 1
+        old_j, new_j = len(old) - lo, len(new) - lo
+        blocks: list[tuple] = []
+        if i < old_j or i < new_j:
+            blocks = [(i, old_j, i, new_j, old[i:old_j], new[i:new_j])]
+            # Use line-oriented opcodes when they are smaller than the middle text.
+            old_lines = g.splitLines(old[i:old_j])
+            new_lines = g.splitLines(new[i:new_j])
+            if len(old_lines) > 2 and len(new_lines) > 2:
+                old_offsets = list(itertools.accumulate((len(z) for z in old_lines), initial=i))
+                new_offsets = list(itertools.accumulate((len(z) for z in new_lines), initial=i))
+                matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+                line_blocks = [
+                    (
+                        old_offsets[i1], old_offsets[i2], new_offsets[j1], new_offsets[j2],
+                        ''.join(old_lines[i1:i2]), ''.join(new_lines[j1:j2]),
+                    )
+                    for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal'
+                ]
+                if sum(len(z[4]) + len(z[5]) for z in line_blocks) < len(blocks[0][4]) + len(blocks[0][5]):
+                    blocks = line_blocks
+        return hash(old), hash(new), tuple(blocks)
+
+    def expandBodyDelta(self, s: str, delta: tuple) -> tuple[str, str]:
+        """
+        Return (old, new), the two versions of a body described by the delta.
+        s must be one of those two versions.
+
+        Return None if s is neither version, that is, if some other code
+        has changed the body without using the undoer.
+        """
+        old_hash, new_hash, blocks = delta
+        h = hash(s)
+        if h not in (old_hash, new_hash):
+            return None
+        to_old = h == new_hash
+        result: list[str] = []
+        pos = 0
+        for old_i, old_j, new_i, new_j, old_s, new_s in blocks:
+            if to_old:
+                result.append(s[pos:new_i])
+                result.append(old_s)
+                pos = new_j
+            else:
+                result.append(s[pos:old_i])
+                result.append(new_s)
+                pos = old_j
+        result.append(s[pos:])
+        other = ''.join(result)
+        return (other, s) if to_old else (s, other)
+    #@+node:ekr.20240424084532.1: *4* u.computeLinkOps & replayTreeChanges
+    def computeLinkOps(self, parent_v: VNode, old: list[VNode], new: list[VNode]) -> list[tuple]:
+        """
+        Return a list of link operations that change parent_v's children
+        from the old list to the new list.
+
+        Each operation is a tuple (kind, parent_v, childIndex, v), where kind
+        is 'add' or 'cut', corresponding to v._addLink and v._cutLink.
+        """
+        result: list[tuple] = []
+        opcodes = difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+        # Work from right to left so that the indices of old are valid.
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag == 'equal':
+                continue
+            for i in range(i2 - 1, i1 - 1, -1):
+                result.append(('cut', parent_v, i, old[i]))
+            for j in range(j1, j2):
+                result.append(('add', parent_v, i1 + j - j1, new[j]))
+        return result
+
+    def replayTreeChanges(self, undo: bool) -> None:
+        """
+        Undo or redo the link operations and content changes in u.linkOps and
+        u.contents, in time proportional to the number of changes.
+        """
+        u = self
+        ops = reversed(u.linkOps) if undo else u.linkOps
+        for kind, parent_v, i, v in ops:
+            if (kind == 'add') == undo:
+                v._cutLink(i, parent_v)
+            else:
+                v._addLink(i, parent_v)
+            parent_v.setDirty()
+        for v, oldHead, newHead, delta in u.contents:
+            bodies = u.expandBodyDelta(v._bodyString, delta)
+            if bodies is None:
+                g.es_print(f"can not undo or redo body changes to {v.h}")
+            else:
+                v.setBodyString(bodies[0] if undo else bodies[1])
+            v.initHeadString(oldHead if undo else newHead)
+            v.setDirty()
     #@+node:ekr.20031218072017.3607: *4* u.clearOptionalIvars
     def clearOptionalIvars(self) -> None:
         u = self
@@ -153,9 +312,14 @@ class Undoer:
             setattr(u, ivar, None)
     #@+node:ekr.20060127052111.1: *4* u.cutStack
     def cutStack(self) -> None:
+        """
+        Enforce the max-undo-stack-size and max-undo-stack-bytes settings by
+        removing the oldest beads.
+        """
         u = self
         n = u.max_undo_stack_size
-        if u.bead >= n > 0 and not g.unitTesting:
+        max_bytes = u.max_undo_stack_bytes
+        if (u.bead >= n > 0 and not g.unitTesting) or max_bytes > 0:
             # Do nothing if we are in the middle of creating a group.
             i = len(u.beads) - 1
             while i >= 0:
@@ -163,10 +327,21 @@ class Undoer:
                 if hasattr(bunch, 'kind') and bunch.kind == 'beforeGroup':
                     return
                 i -= 1
+        if u.bead >= n > 0 and not g.unitTesting:
             # This work regardless of how many items appear after bead n.
                 # g.trace('Cutting undo stack to %d entries' % (n))
             u.beads = u.beads[-n:]
             u.bead = n - 1
+        if max_bytes > 0 and u.bead > 0:
+            # Remove the oldest beads, but always keep the present bead.
+            total = u.memoryUse()
+            i = 0
+            while i < u.bead and total > max_bytes:
+                total -= u.beadSize(u.beads[i])
+                i += 1
+            if i > 0:
+                u.beads = u.beads[i:]
+                u.bead -= i
         if 'undo' in g.app.debug and 'verbose' in g.app.debug:  # pragma: no cover
             print(f"u.cutStack: {len(u.beads):3}")
     #@+node:ekr.20080623083646.10: *4* u.dumpBead
@@ -247,6 +422,18 @@ class Undoer:
             setattr(u, key, val)
             if key not in u.optionalIvars:
                 u.optionalIvars.append(key)
+        # Recreate the old and new bodies from the present body.
+        delta = bunch.get('bodyDelta')
+        if delta:
+            s = bunch.p.b
+            bodies = u.expandBodyDelta(s, delta)
+            if bodies is None:
+                g.es_print(f"can not undo or redo body changes to {bunch.p.h}")
+                bodies = s, s
+            u.oldBody, u.newBody = bodies
+            for key in ('oldBody', 'newBody'):
+                if key not in u.optionalIvars:
+                    u.optionalIvars.append(key)
     #@+node:ekr.20031218072017.3614: *4* u.setRedoType
     # These routines update both the ivar and the menu label.
 
@@ -359,7 +546,9 @@ class Undoer:
         bunch.undoType = command
         bunch.undoHelper = u.undoChangeBody
         bunch.redoHelper = u.redoChangeBody
-        bunch.newBody = p.b
+        # Replace the old body by a delta. u.setIvarsFromBunch recreates both bodies.
+        bunch.bodyDelta = u.computeBodyDelta(bunch.oldBody, p.b)
+        del bunch.oldBody
         bunch.newHead = p.h
         bunch.newIns = w.getInsertPoint()
         bunch.newMarked = p.isMarked()
@@ -434,7 +623,9 @@ class Undoer:
         bunch.undoHelper = u.undoNodeContents
         bunch.redoHelper = u.redoNodeContents
         bunch.inHead = False  # 2013/08/26
-        bunch.newBody = p.b
+        # Replace the old body by a delta. u.setIvarsFromBunch recreates both bodies.
+        bunch.bodyDelta = u.computeBodyDelta(bunch.oldBody, p.b)
+        del bunch.oldBody
         bunch.newHead = p.h
         bunch.newMarked = p.isMarked()
         # Bug fix 2017/11/12: don't use ternary operator.
@@ -472,37 +663,51 @@ class Undoer:
         bunch.undoType = command
         bunch.undoHelper = u.undoChangeMultiHeadline
         bunch.redoHelper = u.redoChangeMultiHeadline
+        # Keys are vnodes, values are the old headlines.
         oldHeadlines = bunch.headlines
         newHeadlines = {}
-        for p in c.all_unique_positions():
-            if p.h != oldHeadlines[p.gnx][0]:
-                newHeadlines[p.gnx] = (oldHeadlines[p.gnx][0], p.h)
+        for v in c.all_unique_nodes():
+            old = oldHeadlines.get(v)
+            if old is not None and v.h != old:
+                newHeadlines[v.gnx] = (old, v.h)
         # Filtered down dict containing only the changed ones.
         bunch.headlines = newHeadlines
         u.pushBead(bunch)
 
     afterChangeMultiHead = afterChangeMultiHeadline
     #@+node:ekr.20230721130238.1: *5* u.afterChangeTree
-    def afterChangeTree(self, command: str, bunch: g.Bunch) -> None:
+    def afterChangeTree(self, p: Position, command: str, bunch: g.Bunch) -> None:
+        """
+        Create an undo node using the data created by beforeChangeTree.
 
-        c = self.c
-        p = self.p
-        u = self
+        The bead contains only the link operations and content changes
+        needed to undo and redo the command, not copies of the tree.
+        """
+        c, u = self.c, self
         w = c.frame.body.wrapper
+        if u.redoing or u.undoing:
+            return  # pragma: no cover
         # Set types.
-        bunch.kind = command
+        bunch.kind = 'tree'
         bunch.undoType = command
         bunch.undoHelper = u.undoChangeTree
         bunch.redoHelper = u.redoChangeTree
-        bunch.newPastedTree = c.fileCommands.outline_to_clipboard_string(c.p)
+        # Replace the snapshot by a list of link operations and content changes.
+        linkOps: list[tuple] = []
+        contents: list[tuple] = []
+        for v, (children, h, b) in bunch.oldTree.items():
+            if children != v.children:
+                linkOps.extend(u.computeLinkOps(v, children, v.children))
+            if h != v._headString or b != v._bodyString:
+                contents.append((v, h, v._headString, u.computeBodyDelta(b, v._bodyString)))
+        del bunch.oldTree
+        bunch.linkOps = tuple(linkOps)
+        bunch.contents = tuple(contents)
+        bunch.newP = p.copy()
         bunch.newIns = w.getInsertPoint()
         bunch.newSel = w.getSelectionRange()
         bunch.newMarked = p.isMarked()
-        # Push the bunch.
-        u.bead += 1
-        u.beads[u.bead:] = [bunch]
-        # Recalculate the menu labels.
-        u.setUndoTypes()
+        u.pushBead(bunch)
     #@+node:ekr.20231225132413.1: *5* u.afterChangeUA
     def afterChangeUA(self, p: Position, command: str, bunch: g.Bunch) -> None:
         u = self
@@ -772,11 +977,10 @@ class Undoer:
         """
         c, u = self.c, self
         bunch = u.createCommonBunch(p)
-        headlines = {}
-        for p in c.all_unique_positions():
-            headlines[p.gnx] = (p.h, None)
-        # contains all, but will get reduced by afterChangeMultiHeadline
-        bunch.headlines = headlines
+        # Contains all vnodes, but afterChangeMultiHeadline reduces it to
+        # a dict containing only the changed headlines. The values are
+        # references to the existing strings, not copies.
+        bunch.headlines = {v: v.h for v in c.all_unique_nodes()}
         return bunch
 
     beforeChangeMultiHead = beforeChangeMultiHeadline
@@ -792,16 +996,19 @@ class Undoer:
         bunch.oldYScroll = w.getYScrollPosition() if w else 0
         return bunch
     #@+node:ekr.20230721130319.1: *5* u.beforeChangeTree
-    def beforeChangeTree(self, p: Position) -> None:
+    def beforeChangeTree(self, p: Position) -> g.Bunch:
+        """
+        Return data that gets passed to afterChangeTree.
 
-        c = self.c
+        Commands may change the links, headlines and bodies of p's parent
+        and of all nodes in p's subtree. The data contains references to
+        the existing children lists and strings. Nothing is serialized.
+        """
         w = self.c.frame.body.wrapper
         bunch = self.createCommonBunch(p)  # Sets u.oldMarked, u.oldSel, u.p
-
-        ###
-        bunch.oldPastedTree = c.fileCommands.outline_to_clipboard_string(c.p)
-        bunch.oldBody = p.b
-        bunch.oldHead = p.h
+        vnodes = [p._parentVnode()] + [z.v for z in p.self_and_subtree(copy=False)]
+        # Keys are vnodes, values are tuples (children, headline, body).
+        bunch.oldTree = {v: (v.children[:], v._headString, v._bodyString) for v in vnodes}
         bunch.oldIns = w.getInsertPoint()
         bunch.oldYScroll = w.getYScrollPosition()
         return bunch
@@ -1370,6 +1577,8 @@ class Undoer:
         # Init status.
         u.redoing = True
         u.groupCount = 0
+        # Redo helpers may change v.children directly.
+        c.frame.tree.generation += 1
         if u.redoHelper:
             u.redoHelper()
         else:
@@ -1436,33 +1645,23 @@ class Undoer:
         # selectPosition causes recoloring, so don't do this unless needed.
         if c.p != u.p:  # #1333.
             c.selectPosition(u.p)
-    #@+node:ekr.20230721131611.1: *4* u.redoChangeTree (to do)
+    #@+node:ekr.20230721131611.1: *4* u.redoChangeTree
     def redoChangeTree(self) -> None:
-        c, u, w = self.c, self, self.c.frame.body.wrapper
-        # selectPosition causes recoloring, so don't do this unless needed.
-        if c.p != u.p:
-            c.selectPosition(u.p)
-        ### s = u.newPastedTree
-
-
-
-        u.p.setDirty()
-        u.p.b = u.newBody
-        u.p.h = u.newHead
-        # This is required so. Otherwise redraw will revert the change!
-        c.frame.tree.setHeadline(u.p, u.newHead)
-        if u.newMarked:
-            u.p.setMarked()
-        else:
-            u.p.clearMarked()
+        """
+        Redo all changes to the node and its subtree.
+        """
+        c, u = self.c, self
+        w = c.frame.body.wrapper
+        u.replayTreeChanges(undo=False)
+        p = u.newP
+        p.setAllAncestorAtFileNodesDirty()
+        c.selectPosition(p)
         if u.groupCount == 0:
-            w.setAllText(u.newBody)
+            w.setAllText(p.b)
             i, j = u.newSel
             w.setSelectionRange(i, j, insert=u.newIns)
-            w.setYScrollPosition(u.newYScroll)
-            c.frame.body.recolor(u.p)
+            c.frame.body.recolor(p)
         u.updateMarks('new')
-        u.p.setDirty()
     #@+node:ekr.20231225134021.1: *4* u.redoChangeUA
     def redoChangeUA(self) -> None:
         u = self
@@ -1746,6 +1945,8 @@ class Undoer:
         u.groupCount = 0
         #
         # Dispatch.
+        # Undo helpers may change v.children directly.
+        c.frame.tree.generation += 1
         if u.undoHelper:
             u.undoHelper()
         else:
@@ -2027,33 +2228,18 @@ class Undoer:
         """
         Undo all changes to the node and its subtree.
         """
-        c = self.c
-        u = self
+        c, u = self.c, self
         w = c.frame.body.wrapper
-        # selectPosition causes recoloring, so don't do this unless needed.
-        if c.p != u.p:
-            c.selectPosition(u.p)
-        assert c.p == u.p
+        u.replayTreeChanges(undo=True)
         p = u.p
-        # u.p.setDirty()
-
-        # Paste the outline and select it.
-        s = u.oldPastedTree
-        pasted = c.fileCommands.getLeoOutlineFromClipboardRetainingClones(s)
-        assert c.p == pasted
-
-        # Delete the old tree. Its position should still exist.
-        c.p.back.doDelete(pasted)
-
-        # Finish
-        w.setAllText(u.oldBody)
-        c.frame.body.recolor(p)
-        p.h = u.oldHead
-        # This is required.  Otherwise c.redraw will revert the change!
-        c.frame.tree.setHeadline(p, u.oldHead)
-        i, j = u.oldSel
-        w.setSelectionRange(i, j)
-        w.setYScrollPosition(u.oldYScroll)
+        p.setAllAncestorAtFileNodesDirty()
+        c.selectPosition(p)
+        if u.groupCount == 0:
+            w.setAllText(p.b)
+            i, j = u.oldSel
+            w.setSelectionRange(i, j, insert=u.oldIns)
+            w.setYScrollPosition(u.oldYScroll)
+            c.frame.body.recolor(p)
         u.updateMarks('old')
     #@+node:ekr.20230713150109.1: *4* u.undoParseBody
     def undoParseBody(self) -> None:
@@ -0,0 +1,349 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20240424103710.1: * @file leobenchmark.py
+"""
+Benchmarks for leoserver.py: throughput, latency percentiles and memory.
+
+The benchmarks send typical requests to a server whose outline is a
+synthetic outline of the given size and depth:
+
+    python -m leo.core.leobenchmark --nodes 10000 --depth 8
+    python -m leo.core.leobenchmark --websocket --concurrency 4
+    python -m leo.core.leobenchmark --requests get_body,set_body --json
+
+By default, the benchmarks call LeoServer._do_message in-process. With
+--websocket, the benchmarks start leoserver.py in a subprocess and send
+the same requests to it over localhost.
+"""
+#@+<< leobenchmark imports & annotations >>
+#@+node:ekr.20240424104027.1: ** << leobenchmark imports & annotations >>
+from __future__ import annotations
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Optional, TYPE_CHECKING
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+from leo.core import leoserver
+
+if TYPE_CHECKING:  # pragma: no cover
+    from leo.core.leoCommands import Commands as Cmdr
+    from leo.core.leoNodes import Position
+
+Request = tuple[str, dict[str, Any]]  # (action, param)
+Stats = dict[str, Any]
+#@-<< leobenchmark imports & annotations >>
+
+words = (
+    'def', 'class', 'return', 'node', 'outline', 'self', 'import', 'position',
+    'headline', 'body', 'leo', 'server', 'spam', 'eggs', 'value', 'result',
+)
+
+#@+others
+#@+node:ekr.20240424104344.1: ** function: make_outline
+def make_outline(c: Cmdr, nodes: int, depth: int, body_lines: int = 10, seed: int = 1) -> None:
+    """
+    Replace c's outline with a random outline containing the given number
+    of nodes, at most depth levels deep. The same seed yields the same outline.
+    """
+    rng = random.Random(seed)
+
+    def make_body() -> str:
+        lines = []
+        for _i in range(rng.randint(0, 2 * body_lines)):
+            indent = ' ' * 4 * rng.randint(0, 3)
+            lines.append(indent + ' '.join(rng.choice(words) for _j in range(rng.randint(1, 8))))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    root = c.rootPosition()
+    while root.hasNext():
+        root.next().doDelete()
+    while root.hasChildren():
+        root.firstChild().doDelete()
+    # A list of tuples (p, level) for the nodes that may have children.
+    parents: list[tuple[Position, int]] = []
+    last_top = root
+    for i in range(nodes):
+        if i == 0:
+            p, level = root, 0
+        elif not parents or rng.random() < 0.05:
+            p, level = last_top.insertAfter(), 0
+            last_top = p
+        else:
+            # Prefer recent parents, so the outline has both deep and wide parts.
+            parent, parent_level = parents[max(0, len(parents) - 1 - int(rng.expovariate(0.1)))]
+            p, level = parent.insertAsLastChild(), parent_level + 1
+        p.v._headString = f"node {i}: {rng.choice(words)} {rng.choice(words)}"
+        p.v._bodyString = make_body()
+        if rng.random() < 0.5:
+            p.expand()
+        if level + 1 < depth:
+            parents.append((p.copy(), level))
+    c.recreateGnxDict()
+    c.selectPosition(c.rootPosition())
+#@+node:ekr.20240424104701.1: ** function: make_requests
+def make_requests(server: leoserver.LeoServer, kind: str, n: int, seed: int = 1) -> list[Request]:
+    """Return a list of n requests of the given kind for server.c."""
+    c = server.c
+    rng = random.Random(seed)
+    positions = list(c.all_positions())
+    parents = [p for p in positions if p.hasChildren()] or positions
+
+    def ap(p: Position) -> dict[str, Any]:
+        return server._p_to_ap(p)
+
+    def body(i: int) -> str:
+        return f"body {i}\n" + ' '.join(rng.choice(words) for _j in range(20)) + '\n'
+
+    table: dict[str, Callable[[int], dict[str, Any]]] = {
+        'do_nothing': lambda i: {},
+        'find_next': lambda i: {"fromOutline": False},
+        'get_body': lambda i: {"gnx": rng.choice(positions).gnx},
+        'get_children': lambda i: {"ap": ap(rng.choice(parents))},
+        'get_structure': lambda i: {},
+        'get_ui_states': lambda i: {},
+        'get_visible_rows': lambda i: {"start": rng.randrange(len(positions)), "count": 100},
+        'set_body': lambda i: {"gnx": rng.choice(positions).gnx, "body": body(i)},
+        'set_headline': lambda i: {"ap": ap(rng.choice(positions)), "name": f"headline {i}"},
+    }
+    if kind not in table:
+        raise ValueError(f"unknown request: {kind!r}. Valid requests: {', '.join(sorted(table))}")
+    return [('!' + kind, table[kind](i)) for i in range(n)]
+#@+node:ekr.20240424105018.1: ** function: search_settings
+def search_settings(find_text: str) -> dict[str, Any]:
+    """Return the param for the !set_search_settings request."""
+    return {"searchSettings": {
+        "nav_text": "", "show_parents": False, "is_tag": False, "search_options": 0,
+        "find_text": find_text, "change_text": "",
+        "ignore_case": False, "mark_changes": False, "mark_finds": False,
+        "pattern_match": False, "search_body": True, "search_headline": True, "whole_word": True,
+        "entire_outline": True,
+    }}
+#@+node:ekr.20240424105335.1: ** function: percentile & summarize
+def percentile(values: list[float], pct: float) -> float:
+    """Return the pct percentile of the *sorted* list of values, by the nearest-rank method."""
+    if not values:
+        return 0.0
+    rank = max(1, min(len(values), math.ceil(pct / 100.0 * len(values))))
+    return values[rank - 1]
+
+def summarize(kind: str, latencies: list[float], sizes: list[int], elapsed: float) -> Stats:
+    """Return the statistics for one kind of request. Latencies are in seconds."""
+    latencies = sorted(latencies)
+    ms = [1000 * z for z in latencies]
+    n = len(latencies)
+    return {
+        "request": kind,
+        "count": n,
+        "rps": n / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": sum(ms) / n if n else 0.0,
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": ms[-1] if ms else 0.0,
+        "bytes": sum(sizes) // n if n else 0,
+    }
+#@+node:ekr.20240424105652.1: ** function: max_rss
+def max_rss(children: bool = False) -> Optional[int]:
+    """
+    Return the peak resident set size in bytes, if known, of this process or,
+    if children is True, of the largest child process that has been waited for.
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024 * rss
+#@+node:ekr.20240424110009.1: ** function: run_in_process
+def run_in_process(args: argparse.Namespace) -> list[Stats]:
+    """Run the benchmarks by calling LeoServer._do_message."""
+    server = leoserver.LeoServer(testing=True)
+    ids = iter(range(1, sys.maxsize))
+
+    def request(action: str, param: dict[str, Any]) -> str:
+        return server._do_message({"id": next(ids), "action": action, "param": param})
+
+    request('!open_file', {})
+    t1 = time.perf_counter()
+    make_outline(server.c, args.nodes, args.depth, args.body_lines, args.seed)
+    print(f"outline: {args.nodes} nodes, depth {args.depth}: {time.perf_counter() - t1:.2f} sec", file=sys.stderr, flush=True)
+    request('!set_search_settings', search_settings(args.find))
+    if args.tracemalloc:
+        tracemalloc.start()
+    results = []
+    for kind in args.requests:
+        requests = make_requests(server, kind, args.count, args.seed)
+        for action, param in requests[: args.warmup]:
+            request(action, param)
+        latencies, sizes = [], []
+        gc.collect()
+        t1 = time.perf_counter()
+        for action, param in requests:
+            t2 = time.perf_counter()
+            response = request(action, param)
+            latencies.append(time.perf_counter() - t2)
+            sizes.append(len(response))
+        results.append(summarize(kind, latencies, sizes, time.perf_counter() - t1))
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({"request": "memory", "traced_bytes": current, "traced_peak_bytes": peak})
+    results.append({"request": "memory", "max_rss_bytes": max_rss()})
+    return results
+#@+node:ekr.20240424110326.1: ** function: run_websocket & helpers
+def run_websocket(args: argparse.Namespace) -> list[Stats]:
+    """
+    Run the benchmarks against leoserver.py, running in a subprocess,
+    over a websocket on localhost.
+    """
+    import websockets  # Required only for this benchmark.
+
+    # Create the outline and the requests in-process, then save the outline.
+    server = leoserver.LeoServer(testing=True)
+    server._do_message({"id": 1, "action": "!open_file", "param": {}})
+    c = server.c
+    make_outline(c, args.nodes, args.depth, args.body_lines, args.seed)
+    requests = {kind: make_requests(server, kind, args.count, args.seed) for kind in args.requests}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.leo')
+        c.saveTo(fileName=path, silent=True)
+        proc = start_server(path, args.port, args.compress)
+        try:
+            uri = f"ws://localhost:{args.port}"
+            results = asyncio.run(drive_websocket(websockets, uri, requests, args))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    # The server is the only child process.
+    results.append({"request": "memory", "server_max_rss_bytes": max_rss(children=True)})
+    return results
+#@+node:ekr.20240424110643.1: *3* function: start_server
+def start_server(path: str, port: int, compress: int) -> subprocess.Popen:
+    """Start leoserver.py in a subprocess and wait until it is ready."""
+    command = [
+        sys.executable, '-m', 'leo.core.leoserver',
+        '--port', str(port), '--file', path, '--compress', str(compress), '--dirty',
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert proc.stdout
+    for line in proc.stdout:
+        if line.startswith(leoserver.SERVER_STARTED_TOKEN):
+            break
+    else:
+        raise RuntimeError(f"leoserver.py did not start. Exit code: {proc.wait()}")
+
+    def drain() -> None:
+        """Don't let the server block writing to a full pipe."""
+        for _line in proc.stdout:
+            pass
+
+    threading.Thread(target=drain, daemon=True).start()
+    return proc
+#@+node:ekr.20240424111000.1: *3* function: drive_websocket
+async def drive_websocket(
+    websockets: Any,
+    uri: str,
+    requests: dict[str, list[Request]],
+    args: argparse.Namespace,
+) -> list[Stats]:
+    """Send the requests, keeping up to args.concurrency requests in flight."""
+    results = []
+    ids = iter(range(1, sys.maxsize))
+    async with websockets.connect(uri, max_size=None) as websocket:
+        pending: dict[int, float] = {}  # Keys are ids. Values are send times.
+        latencies: list[float] = []
+        sizes: list[int] = []
+
+        async def receive() -> None:
+            """Receive one response, ignoring async packages."""
+            while True:
+                message = await websocket.recv()
+                d = json.loads(message)
+                id_ = d.get("id")
+                if "async" not in d and id_ in pending:
+                    latencies.append(time.perf_counter() - pending.pop(id_))
+                    sizes.append(len(message))
+                    return
+
+        async def send(action: str, param: dict[str, Any]) -> None:
+            while len(pending) >= args.concurrency:
+                await receive()
+            id_ = next(ids)
+            pending[id_] = time.perf_counter()
+            await websocket.send(json.dumps({"id": id_, "action": action, "param": param}))
+
+        async def run(kind_requests: list[Request]) -> None:
+            for action, param in kind_requests:
+                await send(action, param)
+            while pending:
+                await receive()
+
+        await run([('!set_search_settings', search_settings(args.find))])
+        for kind, kind_requests in requests.items():
+            await run(kind_requests[: args.warmup])
+            latencies.clear()
+            sizes.clear()
+            t1 = time.perf_counter()
+            await run(kind_requests)
+            results.append(summarize(kind, latencies, sizes, time.perf_counter() - t1))
+    return results
+#@+node:ekr.20240424111317.1: ** function: print_results
+def print_results(results: list[Stats]) -> None:
+    """Print a table of the results."""
+    columns = ("count", "rps", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms", "bytes")
+    print(f"{'request':<18}" + ''.join(f"{z:>10}" for z in columns))
+    for d in results:
+        if d["request"] == "memory":
+            print(', '.join(f"{key}: {value}" for key, value in d.items() if key != "request"))
+            continue
+        cells = [f"{d[z]:>10}" if isinstance(d[z], int) else f"{d[z]:>10.2f}" for z in columns]
+        print(f"{d['request']:<18}" + ''.join(cells))
+#@+node:ekr.20240424111634.1: ** function: main
+def main() -> None:  # pragma: no cover
+    """Run the benchmarks given by the command-line arguments."""
+    default_requests = 'get_children,get_body,get_ui_states,get_visible_rows,set_body,set_headline,find_next'
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    add = parser.add_argument
+    add('--nodes', type=int, default=2000, metavar='N', help='number of nodes in the outline. Default: 2000')
+    add('--depth', type=int, default=6, metavar='N', help='maximum depth of the outline. Default: 6')
+    add('--body-lines', dest='body_lines', type=int, default=10, metavar='N',
+        help='average number of lines in bodies. Default: 10')
+    add('--count', type=int, default=500, metavar='N', help='requests of each kind. Default: 500')
+    add('--warmup', type=int, default=20, metavar='N', help='untimed requests of each kind. Default: 20')
+    add('--requests', type=str, default=default_requests, metavar='STRINGS',
+        help=f"comma-separated list of requests. Default: {default_requests}")
+    add('--find', type=str, default='spam', metavar='STR', help='find text for find_next. Default: spam')
+    add('--seed', type=int, default=1, metavar='N', help='random seed. Default: 1')
+    add('--tracemalloc', action='store_true', help='trace memory allocations (slow)')
+    add('--websocket', action='store_true', help='benchmark leoserver.py over a websocket')
+    add('--port', type=int, default=32126, metavar='N', help='port for --websocket. Default: 32126')
+    add('--compress', type=int, default=6, metavar='N', help='compression level for --websocket. Default: 6')
+    add('--concurrency', type=int, default=1, metavar='N',
+        help='requests in flight for --websocket. Default: 1')
+    add('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+    args.requests = [z.strip() for z in args.requests.split(',') if z.strip()]
+    args.concurrency = max(1, args.concurrency)
+    results = run_websocket(args) if args.websocket else run_in_process(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+#@-others
+
+if __name__ == '__main__':
+    main()
+#@@language python
+#@@tabwidth -4
+#@-leo
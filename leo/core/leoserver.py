@@ -13,6 +13,7 @@ Written by Félix Malboeuf and Edward K. Ream.
 import argparse
 import asyncio
 from collections.abc import Callable
+import concurrent.futures
 import fnmatch
 import inspect
 import itertools
@@ -22,6 +23,7 @@ import re
 import sys
 import socket
 import textwrap
+import threading
 import time
 from typing import Any, Generator, Iterable, Iterator, Optional, Union
 import warnings
@@ -36,6 +38,10 @@ try:
     import websockets
 except Exception:
     websockets = None
+try:
+    import orjson
+except Exception:
+    orjson = None
 # Make sure the parent of the leo directory is on sys.path.
 core_dir = os.path.dirname(__file__)
 leo_path = os.path.normpath(os.path.join(core_dir, '..', '..'))
@@ -48,6 +54,7 @@ from leo.core.leoCommands import Commands as Cmdr  # noqa
 from leo.core.leoNodes import Position, VNode  # noqa
 from leo.core.leoGui import StringFindTabManager  # noqa
 from leo.core.leoExternalFiles import ExternalFilesController  # noqa
+from leo.core.leoFind import BackgroundSearch  # noqa
 #@-<< leoserver imports >>
 #@+<< leoserver annotations >>
 #@+node:ekr.20220820155747.1: ** << leoserver annotations >>
@@ -95,6 +102,7 @@ wsPersist = False
 wsSkipDirty = False
 wsHost = "localhost"
 wsPort = 32125
+wsCompress = 6  # The zlib level for permessage-deflate. 0: no compression.
 #@-<< leoserver globals >>
 #@+others
 #@+node:felix.20210712224107.1: ** class SetEncoder
@@ -117,6 +125,22 @@ class SetEncoder(json.JSONEncoder):
         if isinstance(obj, VNode):
             return {'gnx': obj.gnx}
         return json.JSONEncoder.default(self, obj)  # otherwise, return default
+#@+node:ekr.20240424085523.1: ** function: to_json
+set_encoder = SetEncoder()
+
+def to_json(obj: Any) -> str:
+    """
+    Return the compact json string for obj, converting objects as SetEncoder does.
+
+    Use orjson, if installed. Fall back to json.dumps if orjson can't encode obj.
+    Like json.dumps, raise TypeError or ValueError if obj is not serializable.
+    """
+    if orjson:
+        try:
+            return orjson.dumps(obj, default=set_encoder.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:  # orjson.JSONEncodeError is a subclass of TypeError.
+            pass
+    return json.dumps(obj, separators=(',', ':'), cls=SetEncoder)
 #@+node:felix.20210621233316.3: ** Exception classes
 class InternalServerError(Exception):  # pragma: no cover
     """The server violated its own coding conventions."""
@@ -455,8 +479,8 @@ class QuickSearchController:
         bNodes: Iterable[Position]
         hNodes: Iterable[Position]
         if combo == "All":
-            hNodes = c.all_positions()
-            bNodes = c.all_positions()
+            hNodes = self.candidate_positions(pat, head=True)
+            bNodes = self.candidate_positions(pat, head=False)
         elif combo == "Subtree":
             hNodes = c.p.self_and_subtree()
             bNodes = c.p.self_and_subtree()
@@ -603,7 +627,7 @@ class QuickSearchController:
         combo = self.searchOptionsStrings[self.searchOptions]
         hNodes: Iterable[Position]
         if combo == "All":
-            hNodes = self.c.all_positions()
+            hNodes = self.candidate_positions(pat, head=True)
         elif combo == "Subtree":
             hNodes = self.c.p.self_and_subtree()
         else:
@@ -617,7 +641,7 @@ class QuickSearchController:
     def qsc_find_changed(self) -> None:
         c = self.c
         changed: list[tuple[Position, Match_Iter]] = [
-            (p.copy(), None) for p in c.all_unique_positions() if p.isDirty()
+            (p, None) for p in c.flatOutline().positions(VNode.isDirty, unique=True)
         ]
         self.clear()
         self.addHeadlineMatches(changed)
@@ -716,7 +740,7 @@ class QuickSearchController:
         self.clear()
         c = self.c
         self.addHeadlineMatches([
-            (z.copy(), None) for z in c.all_positions() if z.isMarked()
+            (z, None) for z in c.flatOutline().positions(VNode.isMarked)
         ])
     #@+node:ekr.20220818083228.1: *3* QSC: helpers
     #@+node:felix.20220225003906.8: *4* QSC.addHeadlineMatches
@@ -765,6 +789,20 @@ class QuickSearchController:
         self.its = {}
         self.lw.clear()
 
+    #@+node:ekr.20240424072010.1: *4* QSC.candidate_positions
+    def candidate_positions(self, pat: str, head: bool) -> Iterable[Position]:
+        """
+        Return all positions whose headlines (or bodies) might match pat.
+
+        c.searchIndex skips nodes that can not contain the literal parts of a glob pattern.
+        """
+        c = self.c
+        candidates = None
+        if not pat.startswith('r:') and '[' not in pat:
+            candidates = c.searchIndex.find_candidates(re.split(r'[*?]', pat), head=head, body=not head)
+        if candidates is None:
+            return c.all_positions()
+        return c.flatOutline().positions(candidates.__contains__)
     #@+node:felix.20220225003906.17: *4* QSC.find_b
     def find_b(self,
         regex: str,
@@ -850,9 +888,309 @@ class QuickSearchController:
         except Exception:
             raise ServerError("QuickSearchController onSelectItem error")
     #@-others
+#@+node:ekr.20240424090831.1: ** class ChangeFeed
+class ChangeFeed:
+    """
+    A versioned feed of the changes to an outline.
+
+    The feed compares the outline with a snapshot of references to the
+    headlines, bodies, children and flags of all vnodes. Each sync that
+    finds changes creates a new version.
+
+    Syncs are cheap. The setters of headlines, bodies and status bits add
+    vnodes to self.changed (see v.recordChange), and a sync compares only
+    those vnodes unless c.frame.tree.generation shows that the structure of
+    the outline may have changed. Syncs never load lazy bodies.
+
+    Deltas use gnxs, so clients can apply them without fetching the tree.
+    """
+
+    max_history = 100  # The number of deltas to remember.
+    flag_bits = VNode.dirtyBit | VNode.expandedBit | VNode.markedBit  # The bits that clients show.
+
+    #@+others
+    #@+node:ekr.20240424091148.1: *3* feed.__init__
+    def __init__(self, c: Cmdr) -> None:
+        self.c = c
+        self.version = 0
+        # A list of tuples (version, delta), the delta from version - 1 to version.
+        self.history: list[tuple[int, dict[str, Any]]] = []
+        # The vnodes whose setters have been called since the last sync.
+        self.changed: set[VNode] = set()
+        c.vnodeChangeSets.append(self.changed)
+        self.generation = c.frame.tree.generation
+        self.snapshot = self.take_snapshot()
+    #@+node:ekr.20240424091505.1: *3* feed.changes_since
+    def changes_since(self, version: int) -> dict[str, Any]:
+        """
+        Return a dict describing the changes since the given version.
+
+        The dict has a "reset" key if the feed no longer remembers (or never
+        knew) the version. The client must then fetch the entire outline.
+        """
+        current = self.sync()
+        oldest = self.history[0][0] - 1 if self.history else current
+        if not isinstance(version, int) or not oldest <= version <= current:
+            return {"version": current, "reset": True}
+        inserted: dict[str, None] = {}  # Dicts preserve order.
+        deleted: dict[str, None] = {}
+        moved: dict[str, None] = {}
+        headlines: dict[str, str] = {}
+        bodies: dict[str, None] = {}
+        children: dict[str, list[str]] = {}
+        flags: dict[str, dict[str, bool]] = {}
+        for n, delta in self.history:
+            if n <= version:
+                continue
+            for gnx in delta["deleted"]:
+                if gnx in inserted:
+                    del inserted[gnx]  # The client never saw the node.
+                else:
+                    deleted[gnx] = None
+            for gnx in delta["inserted"]:
+                if gnx in deleted:
+                    del deleted[gnx]
+                    moved[gnx] = None  # The client still has the node.
+                else:
+                    inserted[gnx] = None
+            moved.update(dict.fromkeys(delta["moved"]))
+            headlines.update(delta["headlines"])
+            bodies.update(dict.fromkeys(delta["bodies"]))
+            children.update(delta["children"])
+            flags.update(delta["flags"])
+        for gnx in deleted:
+            for d in (moved, headlines, bodies, children, flags):
+                d.pop(gnx, None)
+        return {
+            "version": current,
+            "inserted": list(inserted),
+            "deleted": list(deleted),
+            "moved": [z for z in moved if z not in inserted],
+            "headlines": headlines,
+            "bodies": list(bodies),
+            "children": children,
+            "flags": flags,
+        }
+    #@+node:ekr.20240424091822.1: *3* feed.sync & helpers
+    def sync(self) -> int:
+        """
+        Compare the outline with the snapshot, creating a new version if
+        anything has changed. Return the current version.
+        """
+        c, snapshot = self.c, self.snapshot
+        hidden_root = c.hiddenRootNode
+        # Getters may run while a long action (in another thread) adds to self.changed.
+        changed = self.changed.copy()
+        self.changed.difference_update(changed)
+        inserted: list[str] = []
+        deleted: list[str] = []
+        if (
+            self.generation != c.frame.tree.generation
+            # Some readers replace the top-level vnodes without changing the generation.
+            or tuple(hidden_root.children) != snapshot[hidden_root][2]
+        ):
+            # The structure may have changed: compare all vnodes.
+            self.generation = c.frame.tree.generation
+            old, new = snapshot, self.take_snapshot()
+            self.snapshot = new
+            inserted = [v.gnx for v in new if v not in old]
+            deleted = [v.gnx for v in old if v not in new]
+        elif changed:
+            # Compare only the changed vnodes.
+            old = {v: snapshot[v] for v in changed if v in snapshot}
+            new = {v: self.data(v) for v in old}
+            snapshot.update(new)
+        else:
+            return self.version
+        lazy_bodies = c.fileCommands.db_lazy_bodies
+        moved: list[str] = []
+        headlines: dict[str, str] = {}
+        bodies: list[str] = []
+        children: dict[str, list[str]] = {}
+        flags: dict[str, dict[str, bool]] = {}
+        for v, (h, b, v_children, bits) in new.items():
+            old_data = old.get(v)
+            if old_data is None:
+                headlines[v.gnx] = h
+                if b is None or b:
+                    bodies.append(v.gnx)
+                if v_children:
+                    children[v.gnx] = [z.gnx for z in v_children]
+                flags[v.gnx] = self.flags(v)
+                continue
+            old_h, old_b, old_children, old_bits = old_data
+            if h != old_h:
+                headlines[v.gnx] = h
+            # Loading or unloading a lazy body does not change it.
+            if b is not None and b != old_b and not (old_b is None and lazy_bodies.get(v.gnx) is b):
+                bodies.append(v.gnx)
+            if v_children != old_children:
+                children[v.gnx] = [z.gnx for z in v_children]
+                old_set = set(old_children)
+                moved.extend(z.gnx for z in v_children if z not in old_set and z in old)
+            if bits != old_bits:
+                flags[v.gnx] = self.flags(v)
+        if inserted or deleted or moved or headlines or bodies or children or flags:
+            self.version += 1
+            self.history.append((self.version, {
+                "inserted": inserted,
+                "deleted": deleted,
+                "moved": moved,
+                "headlines": headlines,
+                "bodies": bodies,
+                "children": children,
+                "flags": flags,
+            }))
+            del self.history[: -self.max_history]
+        return self.version
+
+    def data(self, v: VNode) -> tuple[str, Optional[str], tuple[VNode, ...], int]:
+        """
+        Return a tuple (headline, body, children, flag bits) for v.
+        The body is None if v's body is a lazy body that has not been loaded.
+        """
+        b = v._bodyString if v.isBodyLoaded() else None
+        return (v._headString, b, tuple(v.children), v.statusBits & self.flag_bits)
+
+    def flags(self, v: VNode) -> dict[str, bool]:
+        """Return the flags of v that clients show."""
+        return {"dirty": v.isDirty(), "expanded": v.isExpanded(), "marked": v.isMarked()}
+
+    def take_snapshot(self) -> dict[VNode, tuple[str, Optional[str], tuple[VNode, ...], int]]:
+        """Return a dict whose keys are all vnodes, including the hidden root. See feed.data."""
+        c = self.c
+        data = self.data
+        return {v: data(v) for v in (c.hiddenRootNode, *c.all_unique_nodes())}
+    #@-others
+#@+node:ekr.20240424101054.1: ** class PositionHandles
+class PositionHandles:
+    """
+    Opaque handles for the positions of an outline.
+
+    Handles are small ints. Resolving a handle is a dict lookup: it does not
+    rebuild the position's stack from gnxs. The first resolution of each
+    handle calls c.positionExists, which checks every link of the stack.
+    After that, the handle is trusted until the structure changes, and the
+    server does not check the position again. See server._position_exists.
+
+    The server issues handles only for positions that clients are likely to
+    address: the position in each response's "node" and, if the client asks,
+    the positions returned by get_children. Only the newest max_handles
+    handles are remembered.
+
+    Changing the outline's structure increments c.frame.tree.generation,
+    which invalidates all handles. Handles are never reused. Code that
+    changes v.children directly must increment the generation too.
+    """
+
+    max_handles = 10000
+    next_handle = 1  # Shared by all instances, so handles are unique.
+
+    #@+others
+    #@+node:ekr.20240424101411.1: *3* handles.__init__ & check_generation
+    def __init__(self, c: Cmdr) -> None:
+        self.c = c
+        self.generation = c.frame.tree.generation
+        self.positions: dict[int, Position] = {}  # Keys are handles, oldest first.
+        self.handles: dict[str, int] = {}  # Keys are p.key().
+        self.verified: set[int] = set()  # Handles whose positions are known to exist.
+
+    def check_generation(self) -> None:
+        """Forget all handles if the outline's structure has changed."""
+        generation = self.c.frame.tree.generation
+        if generation != self.generation:
+            self.generation = generation
+            self.positions.clear()
+            self.handles.clear()
+            self.verified.clear()
+    #@+node:ekr.20240424101728.1: *3* handles.get_handle & get_position
+    def get_handle(self, p: Position) -> int:
+        """Return the handle for p, which must exist."""
+        self.check_generation()
+        key = p.key()
+        handle = self.handles.get(key)
+        if handle is None:
+            handle = self.handles[key] = PositionHandles.next_handle
+            PositionHandles.next_handle += 1
+            self.positions[handle] = p.copy()
+            while len(self.positions) > self.max_handles:
+                # Forget the oldest handle.
+                old_handle = next(iter(self.positions))
+                old_p = self.positions.pop(old_handle)
+                del self.handles[old_p.key()]
+                self.verified.discard(old_handle)
+        return handle
+
+    def get_position(self, handle: int) -> Optional[Position]:
+        """Return a copy of the position with the given handle, or None."""
+        self.check_generation()
+        p = self.positions.get(handle)
+        if p is None:
+            return None
+        if handle not in self.verified:
+            if not self.c.positionExists(p):
+                return None
+            self.verified.add(handle)
+        return p.copy()
+    #@-others
+#@+node:ekr.20240424093130.1: ** class RequestState & RequestAttribute
+class RequestState(threading.local):
+    """
+    The state of the request being handled in the current thread.
+
+    Long actions run in the server's executor while the event loop keeps
+    serving getters, so each thread needs its own copy of this state.
+    """
+    action: Optional[str] = None
+    current_id = 0  # Id of action being processed.
+    encode_time = 0.0  # Time spent encoding responses to the current action.
+    in_batch = False  # True while server.batch runs its actions.
+    log_flag = False  # set by "log" key
+    trusted_position: Optional[tuple[Cmdr, int, Position]] = None  # Set by _ap_to_p. See _position_exists.
+
+
+class RequestAttribute:
+    """A LeoServer attribute that lives in server.request_state."""
+
+    def __set_name__(self, owner: Any, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj: Any, owner: Any = None) -> Any:
+        if obj is None:
+            return self
+        return getattr(obj.request_state, self.name)
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        setattr(obj.request_state, self.name, value)
 #@+node:felix.20210621233316.4: ** class LeoServer
 class LeoServer:
     """Leo Server Controller"""
+
+    # Per-request state. See RequestState.
+    action = RequestAttribute()
+    current_id = RequestAttribute()
+    encode_time = RequestAttribute()
+    in_batch = RequestAttribute()
+    log_flag = RequestAttribute()
+    trusted_position = RequestAttribute()
+
+    # Actions, besides getters, that never wait for other actions.
+    immediate_actions = {'!cancel_search', '!do_nothing'}
+    # Actions that run in the executor. See _do_message_async.
+    long_actions = {
+        '!import_any_file',
+        '!open_file',
+        '!open_files',
+        '!replace_all',
+        '!save_file',
+    }
+    # Long actions that don't change the outline. Getters run while they run.
+    read_only_long_actions = {'!save_file'}
+    progress_interval = 1.0  # Seconds between "progress" packages sent during long actions.
+
+    # Paged getters. See _get_page_bounds.
+    default_page_size = 200
+    max_page_size = 1000
     #@+others
     #@+node:felix.20210621233316.5: *3* server.__init__
     def __init__(self, testing: bool = False) -> None:
@@ -866,12 +1204,18 @@ class LeoServer:
         # Init ivars first.
         self.c: Cmdr = None  # Currently Selected Commander.
         self.dummy_c: Cmdr = None  # Set below, after we set g.
-        self.action: str = None
         self.bad_commands_list: list[str] = []  # Set below.
         #
         # Debug utilities
-        self.current_id = 0  # Id of action being processed.
-        self.log_flag = False  # set by "log" key
+        self.request_state = RequestState()  # current_id, action, log_flag and encode_time.
+        #
+        # Concurrent requests. See _do_message_async.
+        self.command_lock: Optional[asyncio.Lock] = None  # Created in the loop, when first needed.
+        self.getters_allowed: Optional[asyncio.Event] = None  # Cleared while a long action changes the outline.
+        self.pending_writes: dict[Any, int] = {}  # Keys are clients, values are counts of unfinished actions.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='leoserver')
+        self.change_feeds: dict[Cmdr, ChangeFeed] = {}  # Keys are commanders.
+        self.position_handles: dict[Cmdr, PositionHandles] = {}  # Keys are commanders.
         #
         # Start the bridge.
         self.bridge = leoBridge.controller(
@@ -1088,7 +1432,10 @@ class LeoServer:
 
         warnings.simplefilter("ignore")
 
-        asyncio.get_event_loop().create_task(self._asyncIdleLoop(delay / 1000, fn))
+        if self.loop:
+            self._schedule(self._asyncIdleLoop(delay / 1000, fn))
+        else:
+            asyncio.get_event_loop().create_task(self._asyncIdleLoop(delay / 1000, fn))
     #@+node:felix.20210626003327.1: *4* LeoServer._show_find_success
     def _show_find_success(self,
         c: Cmdr,
@@ -1359,6 +1706,10 @@ class LeoServer:
         # New 'c': Select the first open outline, if any.
         commanders = g.app.commanders()
         self.c = commanders and commanders[0] or None
+        for d in (self.change_feeds, self.position_handles):
+            for c in list(d):
+                if c not in commanders:
+                    del d[c]
         if self.c:
             result = {"total": len(g.app.commanders()), "filename": self.c.fileName()}
         else:
@@ -1935,12 +2286,20 @@ class LeoServer:
         return self._make_response(result)
     #@+node:felix.20210621233316.22: *5* server.find_all
     def find_all(self, param: Param) -> Response:
-        """Run Leo's find all command and return results."""
+        """
+        Run Leo's find all command and return results.
+
+        If param["background"] is True, search in the background.
+        See _start_background_search.
+        """
         tag = 'find_all'
         c = self._check_c(param)
         fc = c.findCommands
         try:
             settings = fc.ftm.get_settings()
+            if param.get("background"):
+                return self._start_background_search(c, fc.start_find_all(
+                    settings, on_progress=self._send_search_progress, on_done=self._send_search_done, run=False))
             result = fc.do_find_all(settings)
         except Exception as e:
             raise ServerError(f"{tag}: exception running 'find all': {e}")
@@ -2101,12 +2460,20 @@ class LeoServer:
         return self._make_response({"found": result, "focus": focus})
     #@+node:felix.20210621233316.28: *5* server.clone_find_all
     def clone_find_all(self, param: Param) -> Response:
-        """Run Leo's clone-find-all command and return results."""
+        """
+        Run Leo's clone-find-all command and return results.
+
+        If param["background"] is True, search in the background.
+        See _start_background_search.
+        """
         tag = 'clone_find_all'
         c = self._check_c(param)
         fc = c.findCommands
         try:
             settings = fc.ftm.get_settings()
+            if param.get("background"):
+                return self._start_background_search(c, fc.start_clone_find_all(settings, flatten=False,
+                    on_progress=self._send_search_progress, on_done=self._send_search_done, run=False))
             result = fc.do_clone_find_all(settings)
         except Exception as e:
             raise ServerError(f"{tag}: Running clone find operation gave exception: {e}")
@@ -2114,17 +2481,62 @@ class LeoServer:
         return self._make_response({"found": result, "focus": focus})
     #@+node:felix.20210621233316.29: *5* server.clone_find_all_flattened
     def clone_find_all_flattened(self, param: Param) -> Response:
-        """Run Leo's clone-find-all-flattened command and return results."""
+        """
+        Run Leo's clone-find-all-flattened command and return results.
+
+        If param["background"] is True, search in the background.
+        See _start_background_search.
+        """
         tag = 'clone_find_all_flattened'
         c = self._check_c(param)
         fc = c.findCommands
         try:
             settings = fc.ftm.get_settings()
+            if param.get("background"):
+                return self._start_background_search(c, fc.start_clone_find_all(settings, flatten=True,
+                    on_progress=self._send_search_progress, on_done=self._send_search_done, run=False))
             result = fc.do_clone_find_all_flattened(settings)
         except Exception as e:
             raise ServerError(f"{tag}: Running clone find operation gave exception: {e}")
         focus = self._get_focus()
         return self._make_response({"found": result, "focus": focus})
+    #@+node:ekr.20240424075934.1: *5* server.cancel_search
+    def cancel_search(self, param: Param) -> Response:
+        """Cancel the background find-all or clone-find-all command, if any."""
+        c = self._check_c(param)
+        cancelled = c.findCommands.cancel_background_search()
+        return self._make_response({"cancelled": cancelled})
+    #@+node:ekr.20240424080251.1: *5* server._start_background_search & helpers
+    def _start_background_search(self, c: Cmdr, search: Optional[BackgroundSearch]) -> Response:
+        """
+        Run the search in time slices on the event loop, so the server can
+        handle other requests while it runs.
+
+        The server sends "search" async packages containing partial results
+        as the search finds them, then a final package with "done": true.
+        The cancel_search command cancels the search.
+        """
+        if search:
+            if self.loop:
+                self._schedule(self._run_background_search(search))
+            else:
+                while search.step():
+                    pass
+        focus = self._get_focus()
+        return self._make_response({"background": True, "started": bool(search), "focus": focus})
+
+    async def _run_background_search(self, search: BackgroundSearch) -> None:  # pragma: no cover (tested in client)
+        while search.step():
+            await asyncio.sleep(0)  # Let the server handle other requests.
+
+    def _send_search_progress(self, search: BackgroundSearch, results: list) -> None:
+        """Send partial results: match dicts for find-all, positions for clone-find-all."""
+        package = {"async": "search", "kind": search.kind, "done": False, "results": results}
+        self._send_async_output(package)
+
+    def _send_search_done(self, search: BackgroundSearch) -> None:
+        package = {"async": "search", "kind": search.kind, "done": True, "found": search.result}
+        self._send_async_output(package)
     #@+node:felix.20210621233316.30: *5* server.find_var
     def find_var(self, param: Param) -> Response:
         """Run Leo's find-var command and return results."""
@@ -2318,8 +2730,10 @@ class LeoServer:
         while p:
             result.append(self._get_position_d(p, c, includeChildren=True))
             p.moveToNodeAfterTree()
+        # Clients may pass the version to get_changes_since.
+        version = self._get_change_feed(c).sync()
         # return selected node either ways
-        return self._make_minimal_response({"structure": result})
+        return self._make_minimal_response({"structure": result, "version": version})
 
     #@+node:felix.20210621233316.38: *5* server.get_all_gnx
     def get_all_gnx(self, param: Param) -> Response:
@@ -2457,33 +2871,68 @@ class LeoServer:
         if cc:
             chapters = cc.setAllChapterNames()
         return self._make_minimal_response({"chapters": chapters})
+    #@+node:ekr.20240424092139.1: *5* server.get_changes_since
+    def get_changes_since(self, param: Param) -> Response:
+        """
+        Return the changes to the outline since param["version"], a version
+        returned by get_structure or by a previous get_changes_since.
+
+        The response contains:
+
+        "version":   The present version.
+        "reset":     Present only if the server can't compute the changes.
+                     The client must re-fetch the outline with get_structure.
+        "inserted":  The gnxs of new nodes.
+        "deleted":   The gnxs of nodes no longer in the outline.
+        "moved":     The gnxs of existing nodes with new parents.
+        "headlines": A dict of new headlines. Keys are gnxs.
+        "bodies":    The gnxs of nodes whose bodies have changed.
+        "children":  A dict of new lists of child gnxs. Keys are gnxs of parents.
+                     The gnx of the hidden root node is 'hidden-root-vnode-gnx'.
+        "flags":     A dict of new flags. Keys are gnxs.
+        """
+        c = self._check_c(param)
+        if c not in self.change_feeds:
+            version = self._get_change_feed(c).version
+            return self._make_minimal_response({"version": version, "reset": True})
+        changes = self.change_feeds[c].changes_since(param.get("version"))
+        return self._make_minimal_response(changes)
     #@+node:felix.20210621233316.42: *5* server.get_children
     def get_children(self, param: Param) -> Response:
         """
         Return the node data for children of p,
         where p is root if param.ap is missing
+
+        Clients may request a page of the children with the "start", "count"
+        and "after" keys. See _get_page_bounds. The response then also
+        contains "start", the index of the first child, and "total".
+
+        If param["handles"] is true, each child contains a "handle" key.
+        See PositionHandles.
         """
         c = self._check_c(param)
-        children = []  # default empty array
+        handle = bool(param.get("handles"))
+        positions: list[Position] = []  # default empty array
         if param.get("ap"):
             # Maybe empty param, for tree-root children(s).
             # Call _get_optional_p:
             # we don't want c.p. after switch to another document while refreshing.
             p = self._get_optional_p(param)
             if p and p.hasChildren():
-                children = [self._get_position_d(child, c) for child in p.children()]
+                positions = list(p.children())
         else:
-            if c.hoistStack:
-                topHoistPos = c.hoistStack[-1].p
-                if g.match_word(topHoistPos.h, 0, '@chapter'):
-                    children = [self._get_position_d(child, c) for child in topHoistPos.children()]
-                else:
-                    # start hoisted tree with single hoisted root node
-                    children = [self._get_position_d(topHoistPos, c)]
-            else:
-                # this outputs all Root Children
-                children = [self._get_position_d(child, c) for child in self._yieldAllRootChildren(c)]
-        return self._make_minimal_response({"children": children})
+            positions = self._get_top_positions(c)
+        if not any(key in param for key in ("start", "count", "after")):
+            children = [self._get_position_d(child, c, handle=handle) for child in positions]
+            return self._make_minimal_response({"children": children})
+        start, count, cursor = self._get_page_bounds(param)
+        if cursor:
+            for i, child in enumerate(positions):
+                if self._p_matches_gnxs(child, cursor):
+                    start = i + 1
+                    break
+        children = [self._get_position_d(child, c, handle=handle) for child in positions[start : start + count]]
+        return self._make_minimal_response({"children": children, "start": start, "total": len(positions)})
     #@+node:felix.20210621233316.43: *5* server.get_focus
     def get_focus(self, param: Param) -> Response:
         """
@@ -2534,14 +2983,11 @@ class LeoServer:
         """Return p.v.u, making sure it can be serialized."""
         self._check_c(param)
         p = self._get_p(param)
-        try:
-            ua = {"ua": p.v.u}
-            json.dumps(ua, separators=(',', ':'), cls=SetEncoder)
-            response = {"ua": p.v.u}
-        except Exception:  # pragma: no cover
-            response = {"ua": repr(p.v.u)}
-        # _make_response adds all the cheap redraw data.
-        return self._make_minimal_response(response)
+        # Like _make_minimal_response, but fall back to repr(p.v.u).
+        return self._encode_response(
+            {"ua": p.v.u, "id": self.current_id},
+            {"ua": repr(p.v.u), "id": self.current_id},
+        )
     #@+node:felix.20210621233316.48: *5* server.get_ui_states
     def get_ui_states(self, param: Param) -> Response:
         """
@@ -2641,6 +3087,34 @@ class LeoServer:
         response = {"unl": unl}
         return self._make_minimal_response(response)
 
+    #@+node:ekr.20240424095112.1: *5* server.get_visible_rows
+    def get_visible_rows(self, param: Param) -> Response:
+        """
+        Return a window of the rows of the expanded outline, as clients show them.
+
+        The "start", "count" and "after" keys select the window. See
+        _get_page_bounds. Rows are position data with an added "level".
+
+        The response also contains "start", the index of the first row,
+        and "total", the number of rows, so clients can use virtual scrolling.
+        """
+        c = self._check_c(param)
+        start, count, cursor = self._get_page_bounds(param)
+        rows = []
+        total = 0
+        for i, (p, level) in enumerate(self._yield_rows(c)):
+            total = i + 1
+            if cursor:
+                if self._p_matches_gnxs(p, cursor):
+                    start, cursor = i + 1, None
+            elif start <= i < start + count:
+                d = self._get_position_d(p, c)
+                d['level'] = level
+                rows.append(d)
+        if cursor:
+            # The cursor's row no longer exists. Use param["start"].
+            return self.get_visible_rows({**param, "after": None})
+        return self._make_minimal_response({"rows": rows, "start": start, "total": total})
     #@+node:felix.20210621233316.49: *4* server.node commands
     #@+node:felix.20210621233316.50: *5* server.clone_node
     def clone_node(self, param: Param) -> Response:
@@ -3297,6 +3771,100 @@ class LeoServer:
     def do_nothing(self, param: Param) -> Response:
         """Simply return states from _make_response"""
         return self._make_response()
+    #@+node:ekr.20240424102719.1: *5* server.batch & helper
+    def batch(self, param: Param) -> Response:
+        """
+        Run a list of actions and return one response for all of them.
+
+        param["actions"]: a list of dicts, each with an "action" key and an
+        optional "param" key, like the messages handled by _do_message.
+
+        param["on_error"]: what to do when an action raises ServerError:
+        - "stop" (default): skip the remaining actions.
+        - "continue": run the remaining actions.
+        - "rollback": skip the remaining actions and undo the batch.
+
+        All changes made by the actions form a single undo group, so one
+        undo reverts the whole batch.
+
+        The response contains "results", the responses of the actions that
+        ran, in order, and "errors", a list of dicts with "index", "action"
+        and "error" keys. Only the batch's response contains the
+        "commander" and "node" keys.
+        """
+        tag = 'batch'
+        c = self._check_c(param)
+        actions = param.get("actions")
+        on_error = param.get("on_error", "stop")
+        if not isinstance(actions, list):
+            raise ServerError(f"{tag}: actions must be a list: {actions!r}")
+        if on_error not in ("continue", "rollback", "stop"):
+            raise ServerError(f"{tag}: bad on_error: {on_error!r}")
+        if self.in_batch:
+            raise ServerError(f"{tag}: nested batch")
+        id_, action = self.current_id, self.action
+        u = c.undoer
+        u.beforeChangeGroup(c.p, 'Batch')
+        group_bead = u.bead
+        errors: list[dict[str, Any]] = []
+        results: list[str] = []
+        self.in_batch = True
+        try:
+            for i, d in enumerate(actions):
+                try:
+                    if not isinstance(d, dict):
+                        raise ServerError(f"{tag}: action must be a dict: {d!r}")
+                    if d.get("action") == "!batch":
+                        raise ServerError(f"{tag}: nested batch")
+                    results.append(self._do_message({**d, "id": id_}))
+                except ServerError as e:
+                    sub_action = d.get("action") if isinstance(d, dict) else None
+                    errors.append({"index": i, "action": sub_action, "error": str(e)})
+                    if on_error != "continue":
+                        break
+        finally:
+            self.in_batch = False
+            self.current_id, self.action = id_, action
+            self._end_batch_undo_group(c, group_bead, rollback=bool(errors) and on_error == "rollback")
+        response = self._make_response({"errors": errors})
+        # Insert the already-encoded results, so they are encoded only once.
+        return f'{response[:-1]},"results":[{",".join(results)}]}}'
+
+    def _end_batch_undo_group(self, c: Cmdr, group_bead: int, rollback: bool) -> None:
+        """
+        Finish the batch's undo group. Undo the batch if rollback is True.
+
+        Leo's undo groups don't nest: actions that create their own undo
+        groups push beads *after* the batch's group. Move those beads into
+        the group. u.undoGroup undoes only the group at u.bead, so splice
+        the items of an action's group into the batch's group.
+        """
+        u = c.undoer
+        if u.bead < group_bead or group_bead >= len(u.beads) or u.beads[group_bead].kind != 'beforeGroup':
+            return  # An action cleared the undo stack or undid the group.
+        group = u.beads[group_bead]
+
+        def add_items(beads: list[Any]) -> None:
+            for bead in beads:
+                if bead.kind in ('afterGroup', 'beforeGroup'):
+                    add_items(getattr(bead, 'items', []))
+                else:
+                    group.items.append(bead)
+
+        add_items(u.beads[group_bead + 1 : u.bead + 1])
+        del u.beads[group_bead + 1 :]
+        u.bead = group_bead
+        if not group.items:
+            # Nothing to undo.
+            del u.beads[group_bead:]
+            u.bead = group_bead - 1
+            u.setUndoTypes()
+            return
+        u.afterChangeGroup(c.p, 'Batch')
+        if rollback:
+            u.undo()
+            del u.beads[u.bead + 1 :]  # Don't allow redo.
+            u.setUndoTypes()
     #@+node:felix.20210621233316.69: *5* server.set_ask_result
     def set_ask_result(self, param: Param) -> Response:
         """Got the result to an asked question/warning from client"""
@@ -4549,6 +5117,10 @@ class LeoServer:
     def _init_connection(self, web_socket: Socket) -> None:  # pragma: no cover (tested in client).
         """Begin the connection."""
         global connectionsTotal
+        # websockets negotiated the transport during the handshake. See get_transport_args.
+        extensions = [z.name for z in getattr(web_socket, 'extensions', None) or []]
+        compressed = 'permessage-deflate' in extensions
+        print(f"server: transport: JSON{' with permessage-deflate' if compressed else ''}", flush=True)
         if connectionsTotal == 1:
             # First connection, so "Master client" setup
             self.web_socket = web_socket
@@ -4574,10 +5146,20 @@ class LeoServer:
         after a document has been closed of switched and interface interaction
         in the client generated incoming calls to 'getters' already sent. (for the
         now inaccessible leo document commander.)
+
+        If ap contains a valid handle, return the position with that handle.
+        Clients may send aps containing only a handle. See PositionHandles.
         """
         tag = '_ap_to_p'
         gnx_d = c.fileCommands.gnxDict
         try:
+            handle = ap.get('handle')
+            if isinstance(handle, int):
+                p = self._get_position_handles(c).get_position(handle)
+                if p:
+                    # Don't check p again. See _position_exists.
+                    self.trusted_position = (c, c.frame.tree.generation, p.copy())
+                    return p
             outer_stack = ap.get('stack')
             if outer_stack is None:  # pragma: no cover.
                 raise ServerError(f"{tag}: no stack in ap: {ap!r}")
@@ -4703,10 +5285,9 @@ class LeoServer:
             print(f"_do_leo_command Recovered from Error {e!s}", flush=True)
             return self._make_response()  # Return empty on error
         #
-        # Tag along a possible return value with info sent back by _make_response
-        if self._is_jsonable(value):
-            return self._make_response({"return-value": value})
-        return self._make_response()
+        # Tag along a possible return value with info sent back by _make_response.
+        # _make_response omits the value if it is not serializable.
+        return self._make_response({"return-value": value})
     #@+node:ekr.20210722184932.1: *4* server._do_leo_function_by_name
     def _do_leo_function_by_name(self, function_name: str, param: Param) -> Response:
         """
@@ -4747,10 +5328,9 @@ class LeoServer:
             print(f"_do_leo_command Recovered from Error {e!s}", flush=True)
             return self._make_response()  # Return empty on error
         #
-        # Tag along a possible return value with info sent back by _make_response
-        if self._is_jsonable(value):
-            return self._make_response({"return-value": value})
-        return self._make_response()
+        # Tag along a possible return value with info sent back by _make_response.
+        # _make_response omits the value if it is not serializable.
+        return self._make_response({"return-value": value})
     #@+node:felix.20210621233316.85: *4* server._do_message
     def _do_message(self, d: dict[str, Any]) -> Response:
         """
@@ -4774,6 +5354,7 @@ class LeoServer:
         global traces
         tag = '_do_message'
         trace, verbose = 'request' in traces, 'verbose' in traces
+        timing = 'timing' in traces
         func: Callable
         action: Optional[str]
 
@@ -4809,6 +5390,7 @@ class LeoServer:
         # Set the current_id and action ivars for _make_response.
         self.current_id = id_
         self.action = action
+        self.trusted_position = None
 
         # Execute the requested action.
         if action[0] == "!":
@@ -4819,10 +5401,83 @@ class LeoServer:
             func = self._do_leo_command_by_name  # It's a command name.
         else:
             func = self._do_leo_function_by_name  # It's the name of a method in some commander.
+        self.encode_time = 0.0
+        t1 = time.perf_counter()
         result = func(action, param)
         if result is None:  # pragma: no cover
             raise ServerError(f"{tag}: no response: {action!r}")
+        if timing:  # pragma: no cover
+            total = time.perf_counter() - t1
+            print(
+                f"  timing {id_:<4} {self.action:<30} "
+                f"handle: {1000 * (total - self.encode_time):7.2f} ms "
+                f"encode: {1000 * self.encode_time:7.2f} ms "
+                f"size: {len(result)}", flush=True)
         return result
+    #@+node:ekr.20240424093804.1: *4* server._do_message_async & helpers
+    async def _do_message_async(self, d: dict[str, Any], client: Any = None) -> Response:
+        """
+        Handle d, like _do_message, without blocking the event loop.
+        client identifies the connection that sent d.
+
+        - self.immediate_actions run at once.
+        - Getters wait for all unfinished actions from the same client,
+          so clients always see their own changes. Otherwise, getters
+          run at once, except while a long action changes the outline.
+        - All other actions wait for the previous non-getter to finish,
+          so they run in the order in which they arrived.
+        - self.long_actions run in self.executor. The event loop keeps
+          serving requests while they run. The server sends "progress"
+          async packages until they finish.
+        """
+        action = d.get('action') or ''
+        if action in self.immediate_actions:
+            return self._do_message(d)
+        if self.command_lock is None:
+            self.command_lock = asyncio.Lock()
+            self.getters_allowed = asyncio.Event()
+            self.getters_allowed.set()
+        if action.startswith('!get_'):
+            if self.pending_writes.get(client):
+                # The lock is fair, so the getter runs after the client's actions.
+                async with self.command_lock:
+                    return self._do_message(d)
+            while not self.getters_allowed.is_set():
+                await self.getters_allowed.wait()
+            return self._do_message(d)
+        self.pending_writes[client] = self.pending_writes.get(client, 0) + 1
+        try:
+            async with self.command_lock:
+                if action not in self.long_actions:
+                    return self._do_message(d)
+                return await self._run_long_action(d)
+        finally:
+            self.pending_writes[client] -= 1
+            if not self.pending_writes[client]:
+                del self.pending_writes[client]
+
+    async def _run_long_action(self, d: dict[str, Any]) -> Response:
+        """Run _do_message(d) in the executor, sending progress packages."""
+        loop = asyncio.get_running_loop()
+        package = {"async": "progress", "action": d.get('action'), "id": d.get('id')}
+        t1 = time.perf_counter()
+        self._send_async_output({**package, "state": "started", "elapsed": 0.0})
+        read_only = d.get('action') in self.read_only_long_actions
+        if not read_only:
+            self.getters_allowed.clear()
+        future = loop.run_in_executor(self.executor, self._do_message, d)
+        try:
+            while True:
+                done, _pending = await asyncio.wait({future}, timeout=self.progress_interval)
+                if done:
+                    return future.result()  # May raise ServerError, etc.
+                elapsed = round(time.perf_counter() - t1, 3)
+                self._send_async_output({**package, "state": "running", "elapsed": elapsed})
+        finally:
+            if not read_only:
+                self.getters_allowed.set()
+            elapsed = round(time.perf_counter() - t1, 3)
+            self._send_async_output({**package, "state": "finished", "elapsed": elapsed})
     #@+node:felix.20210621233316.86: *4* server._do_server_command
     def _do_server_command(self, action: str, param: Param) -> Response:
         tag = '_do_server_command'
@@ -4861,6 +5516,30 @@ class LeoServer:
             g.es("\n".join(signon))
         else:
             raise ServerError(f"{tag}: no loop ready for emit_signon")
+    #@+node:ekr.20240424092456.1: *4* server._get_change_feed
+    def _get_change_feed(self, c: Cmdr) -> ChangeFeed:
+        """Return the ChangeFeed for c, creating it if necessary."""
+        feed = self.change_feeds.get(c)
+        if not feed:
+            feed = self.change_feeds[c] = ChangeFeed(c)
+        return feed
+    #@+node:ekr.20240424102045.1: *4* server._get_position_handles & _position_exists
+    def _get_position_handles(self, c: Cmdr) -> PositionHandles:
+        """Return the PositionHandles for c, creating it if necessary."""
+        handles = self.position_handles.get(c)
+        if not handles:
+            handles = self.position_handles[c] = PositionHandles(c)
+        return handles
+
+    def _position_exists(self, p: Position, c: Cmdr) -> bool:
+        """
+        Like c.positionExists(p), but trust the position that _ap_to_p resolved
+        from a handle in this request, unless the structure has since changed.
+        """
+        trusted = self.trusted_position
+        if trusted and trusted[0] is c and trusted[1] == c.frame.tree.generation and trusted[2] == p:
+            return True
+        return c.positionExists(p)
     #@+node:felix.20210625230236.1: *4* server._get_commander_method
     def _get_commander_method(self, command: str, c: Cmdr) -> Callable:
         """ Return the given method (p_command) in the Commands class or subcommanders."""
@@ -4922,7 +5601,7 @@ class LeoServer:
         if ap:
             p = self._ap_to_p(ap, c)  # Conversion
             if p:
-                if not c.positionExists(p):  # pragma: no cover
+                if not self._position_exists(p, c):  # pragma: no cover
                     raise ServerError(f"{tag}: position does not exist. ap: {ap!r}")
                 return p  # Return the position
         return None
@@ -4940,7 +5619,7 @@ class LeoServer:
         if ap:
             p = self._ap_to_p(ap, c)  # Conversion
             if p:
-                if not c.positionExists(p):  # pragma: no cover
+                if not self._position_exists(p, c):  # pragma: no cover
                     raise ServerError(f"{tag}: position does not exist. ap: {ap!r}")
                 return p  # Return the position
         # Fallback to c.p
@@ -4948,14 +5627,18 @@ class LeoServer:
             raise ServerError(f"{tag}: no c.p")
         return c.p
     #@+node:felix.20210621233316.92: *4* server._get_position_d
-    def _get_position_d(self, p: Position, c: Cmdr, includeChildren: bool = False) -> dict:
+    def _get_position_d(self, p: Position, c: Cmdr, includeChildren: bool = False, handle: bool = False) -> dict:
         """
         Return a python dict that is adding
         graphical representation data and flags
         to the base 'ap' dict from _p_to_ap.
         (To be used by the connected client GUI.)
+
+        Add p's handle if handle is True. See PositionHandles.
         """
         d = self._p_to_ap(p)
+        if handle:
+            d['handle'] = self._get_position_handles(c).get_handle(p)
         d['headline'] = p.h
         if p.v.u:
             # tags quantity first if any ua's present
@@ -5002,6 +5685,69 @@ class LeoServer:
         if p == c.p:
             d['selected'] = True
         return d
+    #@+node:ekr.20240424095429.1: *4* server._get_page_bounds & helpers
+    def _get_page_bounds(self, param: Param) -> tuple[int, int, Optional[list[str]]]:
+        """
+        Return (start, count, cursor) for paged getters.
+
+        param["start"]: the index of the first item. Default: 0.
+        param["count"]: the number of items. Default: self.default_page_size.
+        param["after"]: an optional cursor: the ap of the item before the page.
+            Cursors match items by gnxs alone, so they stay valid when items
+            before them are inserted or deleted. When no item matches, the
+            page starts at param["start"].
+        """
+        tag = '_get_page_bounds'
+        try:
+            start = max(0, int(param.get("start") or 0))
+            count = param.get("count")
+            count = self.default_page_size if count is None else int(count)
+        except(TypeError, ValueError):
+            raise ServerError(f"{tag}: bad start or count: {param!r}")
+        count = max(0, min(count, self.max_page_size))
+        return start, count, self._ap_to_gnxs(param.get("after"))
+
+    def _ap_to_gnxs(self, ap: Optional[dict[str, Any]]) -> Optional[list[str]]:
+        """Return the list of the gnxs of ap's ancestors and ap itself."""
+        if not ap or not isinstance(ap, dict) or not ap.get('gnx'):
+            return None
+        return [d.get('gnx') for d in ap.get('stack') or []] + [ap['gnx']]
+
+    def _p_matches_gnxs(self, p: Position, gnxs: list[str]) -> bool:
+        """Return True if the gnxs of p's ancestors and p match the given list."""
+        if p.v.gnx != gnxs[-1] or len(p.stack) + 1 != len(gnxs):
+            return False
+        return all(v.gnx == gnx for (v, _childIndex), gnx in zip(p.stack, gnxs))
+    #@+node:ekr.20240424095746.1: *4* server._get_top_positions & _yield_rows
+    def _get_top_positions(self, c: Cmdr) -> list[Position]:
+        """Return copies of the positions of the top-level rows shown by clients."""
+        if c.hoistStack:
+            topHoistPos = c.hoistStack[-1].p
+            if g.match_word(topHoistPos.h, 0, '@chapter'):
+                return list(topHoistPos.children())
+            # start hoisted tree with single hoisted root node
+            return [topHoistPos.copy()]
+        # All Root Children
+        return [p.copy() for p in self._yieldAllRootChildren(c)]
+
+    def _yield_rows(self, c: Cmdr) -> Generator[tuple[Position, int], None, None]:
+        """
+        Yield (p, level) for all rows of the expanded outline, in outline order.
+
+        p is *not* a copy: it moves to the next row after each yield.
+        """
+        for top in self._get_top_positions(c):
+            p, top_level = top, len(top.stack)
+            while True:
+                yield p, len(p.stack) - top_level
+                if p.hasChildren() and p.isExpanded():
+                    p.moveToFirstChild()
+                    continue
+                while len(p.stack) > top_level and not p.hasNext():
+                    p.moveToParent()
+                if len(p.stack) == top_level:
+                    break
+                p.moveToNext()
     #@+node:felix.20230202225736.1: *4* server._get_sel_range
     def _get_sel_range(self) -> tuple[int, int]:
         """
@@ -5028,9 +5774,9 @@ class LeoServer:
         Returns true if it is. False otherwise.
         """
         try:
-            json.dumps(x, cls=SetEncoder)
+            to_json(x)
             return True
-        except(TypeError, OverflowError):
+        except(TypeError, ValueError, OverflowError):
             return False
     #@+node:felix.20210621233316.94: *4* server._make_minimal_response
     def _make_minimal_response(self, package: Package = None) -> str:
@@ -5053,13 +5799,10 @@ class LeoServer:
         if package is None:
             package = {}
 
-        if not self._is_jsonable(package):
-            package = {}
-
         # Always add id.
         package["id"] = self.current_id
 
-        return json.dumps(package, separators=(',', ':'), cls=SetEncoder)
+        return self._encode_response(package, {"id": self.current_id})
     #@+node:felix.20210621233316.93: *4* server._make_response
     def _make_response(self, package: Package = None) -> str:
         """
@@ -5091,11 +5834,7 @@ class LeoServer:
         if p:
             del package["p"]
         # if not serializable, include 'p' if present at best.
-        if not self._is_jsonable(package):
-            if p:
-                package = {'p': p}
-            else:
-                package = {}
+        fallback: Package = {'p': p} if p else {}
 
         # Raise an *internal* error if checks fail.
         if isinstance(package, str):  # pragma: no cover
@@ -5104,19 +5843,20 @@ class LeoServer:
             raise InternalServerError(f"{tag}: bad p kwarg: {p!r}")
         if p and not c:  # pragma: no cover
             raise InternalServerError(f"{tag}: p but not c")
-        if p and not c.positionExists(p):  # pragma: no cover
+        if p and not self._position_exists(p, c):  # pragma: no cover
             raise InternalServerError(f"{tag}: p does not exist: {p!r}")
         if c and not c.p:  # pragma: no cover
             raise InternalServerError(f"{tag}: empty c.p")
 
         # Always add id
-        package["id"] = self.current_id
+        common: Package = {"id": self.current_id}
 
         # The following keys are relevant only if there is an open commander.
-        if c:
+        # The response to a batch contains them once, for all its actions.
+        if c and not self.in_batch:
             # Allow commands, especially _get_redraw_d, to specify p!
             p = p or c.p
-            package["commander"] = {
+            common["commander"] = {
                 "changed": c.isChanged(),
                 "fileName": c.fileName(),  # Can be None for new files.
                 "id": id(c),
@@ -5124,8 +5864,10 @@ class LeoServer:
             # Add all the node data, including:
             # - "node": self._p_to_ap(p) # Contains p.gnx, p.childIndex and p.stack.
             # - All the *cheap* redraw data for p.
-            redraw_d = self._get_position_d(p, c)
-            package["node"] = redraw_d
+            redraw_d = self._get_position_d(p, c, handle=True)
+            common["node"] = redraw_d
+        package.update(common)
+        fallback.update(common)
 
         # Handle traces.
         if trace and verbose:  # pragma: no cover
@@ -5136,7 +5878,22 @@ class LeoServer:
             keys_s = ', '.join(keys)
             print(f"response {self.current_id:<4} {keys_s}", flush=True)
 
-        return json.dumps(package, separators=(',', ':'), cls=SetEncoder)
+        return self._encode_response(package, fallback)
+    #@+node:ekr.20240424085840.1: *4* server._encode_response
+    def _encode_response(self, package: Package, fallback: Package) -> str:
+        """
+        Return the json string for package, or for the fallback package if
+        package is not serializable.
+
+        Encode package only once. Don't check it with _is_jsonable first.
+        """
+        t1 = time.perf_counter()
+        try:
+            return to_json(package)
+        except(TypeError, ValueError, OverflowError):
+            return to_json(fallback)
+        finally:
+            self.encode_time += time.perf_counter() - t1
     #@+node:felix.20210621233316.95: *4* server._p_to_ap
     def _p_to_ap(self, p: Position) -> dict:
         """
@@ -5157,23 +5914,36 @@ class LeoServer:
     #@+node:felix.20210621233316.96: *4* server._positionFromGnx
     def _positionFromGnx(self, gnx: str, c: Cmdr) -> Optional[Position]:
         """Return first p node with this gnx or false"""
-        for p in c.all_unique_positions():
-            if p.v.gnx == gnx:
-                return p
-        return None
+        return c.positionForGnx(gnx)
     #@+node:felix.20210622232409.1: *4* server._send_async_output & helper
     def _send_async_output(self, package: Package, toAll: bool = False) -> None:
         """
         Send data asynchronously to the client
         """
         tag = "send async output"
-        jsonPackage = json.dumps(package, separators=(',', ':'), cls=SetEncoder)
+        jsonPackage = to_json(package)
         if "async" not in package:
             raise InternalServerError(f"\n{tag}: async member missing in package {jsonPackage} \n")
         if self.loop:
-            self.loop.create_task(self._async_output(jsonPackage, toAll))
+            self._schedule(self._async_output(jsonPackage, toAll))
         elif not g.unitTesting:
             raise InternalServerError(f"\n{tag}: loop not ready {jsonPackage} \n")
+    #@+node:ekr.20240424093447.1: *5* server._schedule
+    def _schedule(self, coro: Any) -> None:
+        """
+        Run the coroutine as a task in self.loop.
+
+        Long actions run in other threads, so use run_coroutine_threadsafe
+        unless this thread is running self.loop.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.loop.create_task(coro)
+        else:
+            asyncio.run_coroutine_threadsafe(coro, self.loop)
     #@+node:felix.20210621233316.89: *5* server._async_output
     async def _async_output(self,
         json: str,
@@ -5408,7 +6178,7 @@ def main() -> None:  # pragma: no cover (tested in client)
         """
         Get arguments from the command line and sets them globally.
         """
-        global wsHost, wsPort, wsLimit, wsPersist, wsSkipDirty, argFile, traces
+        global wsHost, wsPort, wsLimit, wsPersist, wsSkipDirty, wsCompress, argFile, traces
 
         def leo_file(s: str) -> str:
             if os.path.exists(s):
@@ -5428,9 +6198,9 @@ def main() -> None:  # pragma: no cover (tested in client)
             "  - leoInteg (https://github.com/boltex/leointeg) is written in typescript.\n"
         ])
         # Usage:
-        # leoserver.py [-a <address>] [-p <port>] [-l <limit>] [-f <file>] [--dirty] [--persist]
+        # leoserver.py [-a <address>] [-p <port>] [-l <limit>] [-f <file>] [-z <level>] [--dirty] [--persist]
         usage = 'python leo.core.leoserver [options...]'
-        trace_s = 'request,response,verbose'
+        trace_s = 'request,response,timing,verbose'
         valid_traces = [z.strip() for z in trace_s.split(',')]
         parser = argparse.ArgumentParser(description=description, usage=usage,
             formatter_class=argparse.RawTextHelpFormatter)
@@ -5447,6 +6217,8 @@ def main() -> None:  # pragma: no cover (tested in client)
             help='do not quit when last client disconnects')
         add('-d', '--dirty', dest='wsSkipDirty', action='store_true',
             help='do not warn about dirty files when quitting')
+        add('-z', '--compress', dest='wsCompress', type=int, default=wsCompress, metavar='N',
+            help='permessage-deflate compression level, 0 to 9. 0: no compression. Defaults to ' + str(wsCompress))
         add('--trace', dest='traces', type=str, metavar='STRINGS',
             help=f"comma-separated list of {trace_s}")
         add('-v', '--version', dest='v', action='store_true',
@@ -5459,6 +6231,7 @@ def main() -> None:  # pragma: no cover (tested in client)
         wsLimit = args.wsLimit
         wsPersist = bool(args.wsPersist)
         wsSkipDirty = bool(args.wsSkipDirty)
+        wsCompress = max(0, min(9, args.wsCompress))
         argFile = args.argFile
         if args.traces:
             ok = True
@@ -5477,16 +6250,33 @@ def main() -> None:  # pragma: no cover (tested in client)
         # Sanitize limit.
         if wsLimit < 1:
             wsLimit = 1
+    #@+node:ekr.20240424103036.1: *3* function: get_transport_args
+    def get_transport_args() -> dict[str, Any]:
+        """
+        Return the keyword arguments for websockets.serve that set up compression.
+
+        Clients and the server negotiate permessage-deflate during the
+        handshake. Clients that don't offer it get uncompressed JSON.
+        """
+        if not wsCompress:
+            return {"compression": None}
+        from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+        # Leo's clients are few, so use the largest window for the best compression.
+        factory = ServerPerMessageDeflateFactory(
+            server_max_window_bits=15,
+            compress_settings={"level": wsCompress, "memLevel": 8},
+        )
+        return {"compression": "deflate", "extensions": [factory]}
     #@+node:felix.20210803174312.1: *3* function: notify_clients
     async def notify_clients(action: str, excludedConn: Any = None) -> None:
         global connectionsTotal
         if connectionsPool:  # asyncio.wait doesn't accept an empty list
             opened = bool(controller.c)  # c can be none if no files opened
-            m = json.dumps({
+            m = to_json({
                 "async": "refresh",
                 "action": action,
                 "opened": opened,
-            }, separators=(',', ':'), cls=SetEncoder)
+            })
             clientSetCopy = connectionsPool.copy()
             if excludedConn:
                 clientSetCopy.discard(excludedConn)
@@ -5517,6 +6307,59 @@ def main() -> None:  # pragma: no cover (tested in client)
         global connectionsTotal
         connectionsPool.remove(websocket)
         await notify_clients("unregister")
+    #@+node:ekr.20240424094121.1: *3* function: handle_message
+    async def handle_message(websocket: Socket, json_message: str) -> None:
+        """
+        Handle one message from the websocket and send the answer.
+
+        controller._do_message_async decides whether the message must wait
+        for other actions.
+        """
+        tag = 'server'
+        trace = False
+        verbose = False
+        d: dict[str, Any] = {}
+        try:
+            d = json.loads(json_message)
+            if trace and verbose:
+                print(f"{tag}: got: {d}", flush=True)
+            elif trace:
+                print(f"{tag}: got: {d}", flush=True)
+            answer = await controller._do_message_async(d, websocket)
+        except TerminateServer as e:
+            await websocket.close(reason=e.__str__())
+            return
+        except ServerError as e:
+            data = f"{d}" if d else f"json syntax error: {json_message!r}"
+            error = f"{tag}:  ServerError: {e}...\n{tag}:  {data}"
+            print("", flush=True)
+            print(error, flush=True)
+            print("", flush=True)
+            package = {
+                "id": d.get("id", controller.current_id),
+                "action": d.get("action", controller.action),
+                "request": data,
+                "ServerError": f"{e}",
+            }
+            answer = to_json(package)
+        except InternalServerError as e:  # pragma: no cover
+            print(f"{tag}: InternalServerError {e}", flush=True)
+            await websocket.close()
+            return
+        except Exception as e:  # pragma: no cover
+            print(f"{tag}: Unexpected Exception! {e}", flush=True)
+            g.print_exception()
+            print('', flush=True)
+            await websocket.close()
+            return
+        try:
+            await websocket.send(answer)
+        except websockets.exceptions.ConnectionClosed:
+            return
+        # If not a 'getter' send refresh signal to other clients
+        action = d.get("action") or ''
+        if action[0:5] != "!get_" and action != "!do_nothing":
+            await notify_clients(action, websocket)
     #@+node:felix.20210621233316.106: *3* function: ws_handler (server)
     async def ws_handler(websocket: Socket, path: str) -> None:
         """
@@ -5526,9 +6369,8 @@ def main() -> None:  # pragma: no cover (tested in client)
         """
         global connectionsTotal, wsLimit
         tag = 'server'
-        trace = False
-        verbose = False
         connected = False
+        tasks: set[asyncio.Task] = set()  # Keep references to running tasks.
 
         try:
             # Websocket connection startup
@@ -5547,46 +6389,13 @@ def main() -> None:  # pragma: no cover (tested in client)
             await websocket.send(controller._make_response({"leoID": g.app.leoID}))
             controller._emit_signon()
 
-            # Websocket connection message handling loop
+            # Websocket connection message handling loop.
+            # Handle each message in its own task, so getters need not wait for long actions.
             async for json_message in websocket:
-                try:
-                    n += 1
-                    d = None
-                    d = json.loads(json_message)
-                    if trace and verbose:
-                        print(f"{tag}: got: {d}", flush=True)
-                    elif trace:
-                        print(f"{tag}: got: {d}", flush=True)
-                    answer = controller._do_message(d)
-                except TerminateServer as e:
-                    rcvd = websockets.frames.Close(websockets.frames.CloseCode.NORMAL_CLOSURE, e.__str__())
-                    raise websockets.exceptions.ConnectionClosed(rcvd, None, None)
-                except ServerError as e:
-                    data = f"{d}" if d else f"json syntax error: {json_message!r}"
-                    error = f"{tag}:  ServerError: {e}...\n{tag}:  {data}"
-                    print("", flush=True)
-                    print(error, flush=True)
-                    print("", flush=True)
-                    package = {
-                        "id": controller.current_id,
-                        "action": controller.action,
-                        "request": data,
-                        "ServerError": f"{e}",
-                    }
-                    answer = json.dumps(package, separators=(',', ':'), cls=SetEncoder)
-                except InternalServerError as e:  # pragma: no cover
-                    print(f"{tag}: InternalServerError {e}", flush=True)
-                    break
-                except Exception as e:  # pragma: no cover
-                    print(f"{tag}: Unexpected Exception! {e}", flush=True)
-                    g.print_exception()
-                    print('', flush=True)
-                    break
-                await websocket.send(answer)
-
-                # If not a 'getter' send refresh signal to other clients
-                if controller.action[0:5] != "!get_" and controller.action != "!do_nothing":
-                    await notify_clients(controller.action, websocket)
+                n += 1
+                task = asyncio.create_task(handle_message(websocket, json_message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
         except websockets.exceptions.ConnectionClosedError as e:  # pragma: no cover
             print(f"{tag}: connection closed error: {e}")
@@ -5628,14 +6437,14 @@ def main() -> None:  # pragma: no cover (tested in client)
 
     try:
         try:
-            server = websockets.serve(ws_handler, wsHost, wsPort, max_size=None)
+            server = websockets.serve(ws_handler, wsHost, wsPort, max_size=None, **get_transport_args())
             realtime_server = loop.run_until_complete(server)
         except OSError as e:
             print(e)
             print("Trying with IPv4 Family", flush=True)
             server = websockets.serve(
                 ws_handler, wsHost, wsPort,
-                family=socket.AF_INET, max_size=None)
+                family=socket.AF_INET, max_size=None, **get_transport_args())
             realtime_server = loop.run_until_complete(server)
 
         signon = SERVER_STARTED_TOKEN + f" at {wsHost} on port: {wsPort}.\n"
@@ -5645,6 +6454,8 @@ def main() -> None:  # pragma: no cover (tested in client)
             signon = signon + "No prompt about dirty file(s) when closing server\n"
         if wsLimit > 1:
             signon = signon + f"Total client limit is {wsLimit}.\n"
+        if wsCompress:
+            signon = signon + f"permessage-deflate compression level {wsCompress}\n"
         signon = signon + "Ctrl+c to break"
         print(signon, flush=True)
         loop.run_forever()
@@ -5658,6 +6469,7 @@ def main() -> None:  # pragma: no cover (tested in client)
         if not wsSkipDirty:
             print("Checking for changed commanders...", flush=True)
             save_dirty()
+        controller.executor.shutdown()  # Wait for any long action.
         cancel_tasks(asyncio.all_tasks(loop), loop)
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
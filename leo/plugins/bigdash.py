@@ -526,13 +526,13 @@ class GnxCache:
         r = self.get(gnx)
         if r:
             c, v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c, p.copy()
-        g.es_print("Not in gnx cache, slow!")
-        for c, p in self.all_positions_global():
-            if p.gnx == gnx:
-                return c, p.copy()
+            p = c.positionForGnx(v.gnx)
+            if p:
+                return c, p
+        for c in g.app.commanders():
+            p = c.positionForGnx(gnx)
+            if p:
+                return c, p
         return None, None
 
     #@+node:ekr.20140920041848.17935: *3* update_new_cs
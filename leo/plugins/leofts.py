@@ -67,16 +67,14 @@ class GnxCache:
         r = self.get(gnx)
         if r:
             c, v = r
-            for p in c.all_unique_positions():
-                if p.v is v:
-                    return c, p.copy()
+            p = c.positionForGnx(v.gnx)
+            if p:
+                return c, p
 
-        print("Not in gnx cache, slow!")
-
-        for c, p in all_positions_global():
-
-            if p.gnx == gnx:
-                return c, p.copy()
+        for c in g.app.commanders():
+            p = c.positionForGnx(gnx)
+            if p:
+                return c, p
         return None
 
     #@+node:ekr.20220823205610.5: *3* clear
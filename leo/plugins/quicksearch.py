@@ -525,7 +525,7 @@ class QuickSearchController:
 
         c = self.c
         changed: Match_List = [
-            (p.copy(), None) for p in c.all_unique_positions() if p.isDirty()
+            (p, None) for p in c.flatOutline().positions(lambda v: v.isDirty(), unique=True)
         ]
         self.clear()
         self.addHeadlineMatches(changed)
@@ -548,8 +548,8 @@ class QuickSearchController:
         bNodes: Iterable[Position]
         hNodes: Iterable[Position]
         if combo == "All":
-            hNodes = self.c.all_positions()
-            bNodes = self.c.all_positions()
+            hNodes = self.candidate_positions(pat, head=True)
+            bNodes = self.candidate_positions(pat, head=False)
         elif combo == "Subtree":
             hNodes = self.c.p.self_and_subtree()
             bNodes = self.c.p.self_and_subtree()
@@ -648,6 +648,20 @@ class QuickSearchController:
         # self.addBodyMatches(bm)
         return hm, []
         # self.lw.insertItem(0, "%d hits"%self.lw.count())
+    #@+node:ekr.20240424072327.1: *3* candidate_positions
+    def candidate_positions(self, pat: str, head: bool) -> Iterable[Position]:
+        """
+        Return all positions whose headlines (or bodies) might match pat.
+
+        c.searchIndex skips nodes that can not contain the literal parts of a glob pattern.
+        """
+        c = self.c
+        candidates = None
+        if not pat.startswith('r:') and '[' not in pat:
+            candidates = c.searchIndex.find_candidates(re.split(r'[*?]', pat), head=head, body=not head)
+        if candidates is None:
+            return c.all_positions()
+        return c.flatOutline().positions(candidates.__contains__)
     #@+node:jlunz.20150826091415.1: *3* find_h
     def find_h(self,
         regex: str,
@@ -694,7 +708,7 @@ class QuickSearchController:
         self.clear()
         c = self.c
         self.addHeadlineMatches([
-            (p.copy(), None) for p in c.all_positions() if p.isMarked()
+            (p, None) for p in c.flatOutline().positions(lambda v: v.isMarked())
         ])
     #@+node:ekr.20111015194452.15700: *3* Event handlers
     #@+node:ekr.20111015194452.15686: *4* onSelectItem (quicksearch.py)
@@ -18,6 +18,52 @@ class TestSpellCommands(LeoUnitTest):
     """
 
     #@+others
+    #@+node:ekr.20240424081916.1: *3* TestSpellCommands.test_DefaultDict_suggest
+    def test_DefaultDict_suggest(self):
+
+        from leo.commands.spellCommands import DefaultDict
+
+        main_words = [
+            'colorize', 'colorizer', 'identifier', 'identifiers', 'indentation',
+            'Leo', 'outline', 'outliner', 'python', 'pythonic', 'shell', 'smell',
+            'spell', 'speller', 'spelling', 'spells', 'wall', 'well',
+        ]
+        user_words = ['leoserver', 'unittest']
+        misspellings = [
+            'colorizr', 'idnetifier', 'identifer', 'identifierss', 'indentaiton',
+            'leoservr', 'outlne', 'pyhton', 'sepll', 'spel', 'spelll', 'unitest',
+            'wel', 'xyzzy',
+        ]
+        old_db = g.app.db
+        try:
+            g.app.db = {'test': True}  # Any non-empty dict.
+            d = DefaultDict()
+            d.add_words_from_dict('user', 'user.txt', user_words)
+            d.add_words_from_dict('main', 'main.txt', main_words)
+
+            def brute_force(word):
+                """The original suggestion algorithm."""
+                known = lambda words: sorted({z for z in words if z in d.words})
+                return known(d.edits1(word)) or known(d.edits2(word))
+
+            for word in misspellings:
+                self.assertEqual(d.suggest(word), brute_force(word), msg=word)
+            self.assertEqual(d.suggest('xyzzy'), [])
+            # Added words.
+            d.add('xyzzy2')
+            self.assertEqual(d.suggest('xyzzy'), ['xyzzy2'])
+            # A new DefaultDict uses the cached index of the main dictionary.
+            cached_index = g.app.db[DefaultDict.cache_key]['index']
+            d2 = DefaultDict()
+            d2.add_words_from_dict('main', 'main.txt', main_words)
+            self.assertEqual(d2.suggest('spel'), d.suggest('spel'))
+            self.assertTrue(d2.main_index is cached_index)
+            # Changing the main dictionary invalidates the cache.
+            d2.add_words_from_dict('main', 'main.txt', ['spelt'])
+            self.assertEqual(d2.suggest('spel'), ['spell', 'spelt'])
+            self.assertFalse(d2.main_index is cached_index)
+        finally:
+            g.app.db = old_db
     #@+node:ekr.20230916141635.3: *3* TestSpellCommands.test_SpellTabHandler_find
     def test_SpellTabHandler_find(self):
 
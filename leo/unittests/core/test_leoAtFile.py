@@ -459,6 +459,35 @@ class TestAtFile(LeoUnitTest):
         at.putRefLine(s, 0, n1, n2, name, p)
 
 
+    #@+node:ekr.20240424061012.1: *3* TestAtFile.test_readFilesAtPositions
+    def test_readFilesAtPositions(self):
+
+        at, c = self.at, self.c
+        directory = tempfile.mkdtemp()
+        files, paths = [], []
+        try:
+            for i in range(3):
+                path = os.path.join(directory, f"test{i}.py")
+                paths.append(path)
+                with open(path, 'w') as f:
+                    f.write(f"a = {i}\nb = {i}\n")
+                p = c.rootPosition().insertAfter()
+                p.h = f"@clean {path}"
+                files.append(p)
+            for parallel in (True, False):
+                at.readFilesInParallel = parallel
+                for p in files:
+                    p.b = ''
+                at.readFilesAtPositions(files)
+                for i, p in enumerate(files):
+                    self.assertEqual(p.b, f"a = {i}\nb = {i}\n", msg=parallel)
+                self.assertEqual([z[1] for z in at.readTimings], [p.h for p in files])
+                self.assertEqual(at.prefetchedFiles, {})
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            os.rmdir(directory)
     #@+node:ekr.20210905052021.24: *3* TestAtFile.test_remove
     def test_remove(self):
 
@@ -516,6 +545,42 @@ class TestAtFile(LeoUnitTest):
         finally:
             f.close()
             os.unlink(f.name)
+    #@+node:ekr.20240424062738.1: *3* TestAtFile.test_replaceFile_hashes
+    def test_replaceFile_hashes(self):
+
+        at, c = self.at, self.c
+        # Duplicate init logic...
+        at.initCommonIvars()
+        at.scanAllDirectives(c.p)
+        encoding = 'utf-8'
+        directory = tempfile.mkdtemp()
+        fn = os.path.join(directory, 'test.py')
+        try:
+            # Creating the file remembers its hash.
+            val = at.replaceFile('a = 1\n', encoding, fn, at.root)
+            assert not val, val
+            self.assertTrue(at.hasSameHash(fn, b'a = 1\n'))
+            self.assertFalse(at.hasSameHash(fn, b'a = 2\n'))
+            # Unchanged files are not read again.
+            read_file_bytes = at.readFileBytes
+            at.readFileBytes = None
+            try:
+                val = at.replaceFile('a = 1\n', encoding, fn, at.root)
+                assert not val, val
+            finally:
+                at.readFileBytes = read_file_bytes
+            # Changing the file invalidates the hash.
+            with open(fn, 'w') as f:
+                f.write('a = 22\n')
+            self.assertFalse(at.hasSameHash(fn, b'a = 1\n'))
+            val = at.replaceFile('a = 1\n', encoding, fn, at.root)
+            assert val, val
+            with open(fn, 'r') as f:
+                self.assertEqual(f.read(), 'a = 1\n')
+        finally:
+            if os.path.exists(fn):
+                os.remove(fn)
+            os.rmdir(directory)
     #@+node:ekr.20210905052021.27: *3* TestAtFile.test_replaceFile_same_contents
     def test_replaceFile_same_contents(self):
 
@@ -536,6 +601,37 @@ class TestAtFile(LeoUnitTest):
         finally:
             f.close()
             os.unlink(f.name)
+    #@+node:ekr.20240424063055.1: *3* TestAtFile.test_writeAll_in_parallel
+    def test_writeAll_in_parallel(self):
+
+        at, c = self.at, self.c
+        directory = tempfile.mkdtemp()
+        files, paths = [], []
+        try:
+            for i in range(3):
+                path = os.path.join(directory, f"test{i}.py")
+                paths.append(path)
+                p = c.rootPosition().insertAfter()
+                p.h = f"@clean {path}"
+                files.append(p)
+            for parallel in (True, False):
+                at.writeFilesInParallel = parallel
+                for s in ('a', 'b'):
+                    for i, p in enumerate(files):
+                        p.b = f"{s} = {i}\n"
+                        p.setDirty()
+                    at.writeAll(all=False, dirty=True)
+                    self.assertEqual(at.pendingWrites, {})
+                    self.assertIsNone(at.writeExecutor)
+                    for i, p in enumerate(files):
+                        self.assertFalse(p.isDirty())
+                        with open(paths[i], 'r') as f:
+                            self.assertEqual(f.read(), f"{s} = {i}\n", msg=parallel)
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            os.rmdir(directory)
     #@+node:ekr.20210905052021.21: *3* TestAtFile.test_setPathUa
     def test_setPathUa(self):
 
@@ -2,6 +2,7 @@
 #@+node:ekr.20210905151702.1: * @file ../unittests/core/test_leoColorizer.py
 """Tests of leoColorizer.py"""
 
+import re
 from leo.core import leoGlobals as g
 from leo.core import leoColorizer
 from leo.core.leoQt import Qt
@@ -1549,6 +1550,111 @@ class TestColorizer(LeoUnitTest):
                     assert n == len(s), (n, len(s), s)
                 else:
                     assert n == len(s) + 1, (n, len(s), s)
+    #@+node:ekr.20240424113259.1: *3* TestColorizer.test_leadins
+    def test_leadins(self):
+        c = self.c
+        table = (
+            ('python', 'def spam(a, b):\n    """Doc."""\n    return a + b  # Comment.\n'),
+            ('c', 'int main() {\n    /* A\n       comment */\n    return 0;\n}\n'),
+            ('html', '<html>\n  <script>var x = "a";</script>\n  <b>text</b>\n</html>\n'),
+        )
+        for language, text in table:
+            c.p.b = f"@language {language}\n{text}"
+            results = []
+            for use_leadins in (True, False):
+                tags = []
+                x = leoColorizer.JEditColorizer(c, None)
+                x.setTag = lambda tag, s, i, j, tags=tags: tags.append((tag, s[i:j]))
+                x.language = language
+                x.enabled = True
+                x.init()
+                x.init_all_state(c.p.v)
+                if not use_leadins:
+                    # Call the rules at every character.
+                    x.get_leadins = lambda: ({}, re.compile('.', re.DOTALL))
+                n = x.initBlock0()
+                for s in g.splitLines(text):
+                    x.mainLoop(n, s)
+                results.append(tags)
+            self.assertTrue(results[0], msg=language)
+            self.assertEqual(results[0], results[1], msg=language)
+        # Leading and embedded whitespace can never start a match.
+        x = leoColorizer.JEditColorizer(c, None)
+        x.init_mode('python')
+        leadins_d, pattern = x.get_leadins()
+        self.assertTrue('#' in leadins_d)
+        self.assertFalse(' ' in leadins_d)
+        self.assertTrue(pattern.match('#'))
+        self.assertFalse(pattern.match(' \t x'))
+        self.assertFalse(pattern.match('\t x'))
+    #@+node:ekr.20240424115815.1: *3* TestColorizer.test_shared_modes
+    def test_shared_modes(self):
+        from leo.modes import html
+        c = self.c
+        x1 = leoColorizer.JEditColorizer(c, None)
+        x2 = leoColorizer.JEditColorizer(c, None)
+        for x in (x1, x2):
+            self.assertTrue(x.init_mode('html'))
+        # Both colorizers use the same completed mode.
+        bunch = x1.modes['html_main']
+        self.assertTrue(bunch is x2.modes['html_main'])
+        self.assertTrue(x2.rulesDict is bunch.rulesDict)
+        # Completing the mode does not change the tables of leo/modes/html.py.
+        self.assertFalse(bunch.rulesDict is html.rulesDictDict['html_main'])
+        self.assertFalse('@language' in html.keywordsDictDict['html_main'])
+        self.assertEqual(bunch.keywordsDict['@language'], 'leokeyword')
+    #@+node:ekr.20240424120107.2: *3* TestColorizer.test_state_keys
+    def test_state_keys(self):
+        c = self.c
+        x = leoColorizer.JEditColorizer(c, None)
+        x.init_mode('python')
+        x.init_all_state(c.p.v)
+
+        def span(s):
+            return 0
+
+        def make_span():
+            # Each call to match_span creates a new restart function.
+            def span(s):
+                return 0
+            return span
+
+        keys = {'delegate': '', 'end': '"""', 'kind': 'literal2', 'no_escape': False}
+        n = x.computeState(span, keys)
+        self.assertEqual(x.computeState(make_span(), dict(keys)), n)
+        self.assertNotEqual(x.computeState(span, dict(keys, end="'''")), n)
+        self.assertEqual(x.showState(n), f'{n:2}:py;span;end=""";lit2')
+        self.assertEqual(x.showState(999), '999:no-state')
+        # Directives are colored in all states, as they were when states had names.
+        text = 'a = 1\n@nocolor\nb = 2\n@color\nx = "str" # c3\n@nocolor-node\ny = 3\n'
+        c.p.b = f"@language python\n{text}"
+        tags = []
+
+        class Highlighter:
+            """Keep the state of each line, like QSyntaxHighlighter."""
+            current, previous = -1, -1
+
+            def currentBlockState(self):
+                return self.current
+
+            def previousBlockState(self):
+                return self.previous
+
+            def setCurrentBlockState(self, n):
+                self.current = n
+
+        x = leoColorizer.JEditColorizer(c, None)
+        x.highlighter = h = Highlighter()
+        x.setTag = lambda tag, s, i, j: tags.append((tag, s[i:j]))
+        x.language = 'python'
+        x.enabled = True
+        x.init()
+        x.init_all_state(c.p.v)
+        n = x.initBlock0()
+        for s in g.splitLines(text):
+            x.mainLoop(x.setState(n), s)
+            h.previous = n = h.current
+        self.assertTrue(('leokeyword', '@nocolor-node') in tags, msg=tags)
     #@+node:ekr.20210905170507.39: *3* TestColorizer.test_scanColorDirectives
     def test_scanColorDirectives(self):
         c = self.c
@@ -265,6 +265,34 @@ class TestCommands(LeoUnitTest):
         child2 = c.rootPosition().insertAsLastChild()
         assert child1 and child2
         c.markSubheads()
+    #@+node:ekr.20240424055805.1: *3* TestCommands.test_c_positionForGnx
+    def test_c_positionForGnx(self):
+        c = self.c
+        self.create_test_outline()
+
+        def check():
+            first: dict = {}
+            last: dict = {}
+            for p in c.all_positions():
+                first.setdefault(p.gnx, p.copy())
+                last[p.gnx] = p.copy()
+            for gnx, p in first.items():
+                self.assertEqual(c.positionForGnx(gnx), p, msg=p.h)
+                self.assertEqual(c.positionForGnx(gnx, last=True), last[gnx], msg=p.h)
+
+        check()
+        # Cached positions must follow structure changes.
+        p = c.rootPosition().firstChild()
+        p.moveToLastChildOf(c.rootPosition())
+        check()
+        # Deleted nodes have no position.
+        p = c.rootPosition().insertAsLastChild()
+        v = p.v
+        self.assertEqual(c.positionForGnx(v.gnx), p)
+        p.doDelete()
+        self.assertIsNone(c.positionForGnx(v.gnx))
+        check()
+        self.assertIsNone(c.positionForGnx('no-such-gnx'))
     #@+node:ekr.20210906075242.16: *3* TestCommands.test_c_pasteOutline_does_not_clone_top_node
     def test_c_pasteOutline_does_not_clone_top_node(self):
         c = self.c
@@ -2,6 +2,10 @@
 #@+node:ekr.20210910065135.1: * @file ../unittests/core/test_leoFileCommands.py
 """Tests of leoFileCommands.py."""
 
+import os
+import sqlite3
+import tempfile
+from leo.core import leoGlobals as g
 import leo.core.leoFileCommands as leoFileCommands
 from leo.core.leoTest2 import LeoUnitTest
 
@@ -9,6 +13,104 @@ from leo.core.leoTest2 import LeoUnitTest
 #@+node:ekr.20210910065135.2: ** class TestFileCommands (LeoUnitTest)
 class TestFileCommands(LeoUnitTest):
     #@+others
+    #@+node:ekr.20240424052515.1: *3* TestFileCommands.test_fc_exportDeltaToSqlite
+    def test_fc_exportDeltaToSqlite(self):
+        c, root = self.c, self.root_p
+        fc = c.fileCommands
+        for i in range(5):
+            child = root.insertAsLastChild()
+            child.h = f"child {i}"
+            child.b = f"body {i}\n"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+
+            def read_rows():
+                conn = sqlite3.connect(path)
+                try:
+                    return {gnx: (h, b) for gnx, h, b in conn.execute('select gnx, head, body from vnodes')}
+                finally:
+                    conn.close()
+
+            def expected_rows():
+                return {v.gnx: (v.h, v.b) for v in c.all_unique_nodes()}
+
+            # The first save writes all rows.
+            self.assertTrue(fc.exportToSqlite(path))
+            self.assertEqual(read_rows(), expected_rows())
+            # Change one body, insert one node and delete one node.
+            child1 = root.firstChild().next()
+            child1.b = 'changed'
+            last = root.lastChild()
+            deleted_gnx = last.gnx
+            last.doDelete()
+            new_child = root.insertAsLastChild()
+            new_child.h = 'new child'
+            # The second save writes only the changed rows.
+            self.assertTrue(fc.exportToSqlite(path))
+            rows = read_rows()
+            self.assertEqual(rows, expected_rows())
+            self.assertFalse(deleted_gnx in rows)
+            # Changed: child1, new_child and root, whose children changed.
+            self.assertEqual(fc.db_delta_counts, (3, 1))
+            # Saving an unchanged outline writes no vnodes.
+            self.assertTrue(fc.exportToSqlite(path))
+            self.assertEqual(fc.db_delta_counts, (0, 0))
+            # retrieveVnodesFromDb can read the result.
+            fc.gnxDict = {}  # As in fc.getLeoFile.
+            conn = sqlite3.connect(path)
+            try:
+                v = fc.retrieveVnodesFromDb(conn)
+            finally:
+                conn.close()
+            self.assertEqual(v.h, 'root')
+            self.assertEqual([z.h for z in v.children[-2:]], ['child 3', 'new child'])
+            self.assertEqual(v.children[1].b, 'changed')
+    #@+node:ekr.20240424054457.1: *3* TestFileCommands.test_fc_lazy_db_bodies
+    def test_fc_lazy_db_bodies(self):
+        c, root = self.c, self.root_p
+        fc = c.fileCommands
+        root.b = '@language python\n'
+        for i in range(3):
+            child = root.insertAsLastChild()
+            child.h = f"child {i}"
+            child.b = f"body {i}\n"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.db')
+            self.assertTrue(fc.exportToSqlite(path))
+            # Read the file as fc._getLeoDBFileByName does.
+            fc.gnxDict = {}
+            conn = sqlite3.connect(path)
+            try:
+                root_v = fc.retrieveVnodesFromDb(conn, lazy=True)
+                fc.setDbSnapshot(path, fc.db_rows)
+                fc.db_body_conn = conn
+                child0, child1, child2 = root_v.children
+                # Only bodies that may contain directives are read.
+                self.assertTrue(root_v.isBodyLoaded())
+                self.assertFalse(child0.isBodyLoaded())
+                # Scanning directives does not read lazy bodies.
+                p = c.rootPosition().firstChild()
+                self.assertEqual(p.v, child0)
+                self.assertEqual(g.get_directives_dict_list(p), [{}, {'language': 'python'}])
+                self.assertFalse(child0.isBodyLoaded())
+                # Accessing a body reads it.
+                self.assertEqual(child0.b, 'body 0\n')
+                self.assertTrue(child0.isBodyLoaded())
+                # Unchanged bodies may be evicted.
+                self.assertEqual(fc.evictLazyBodies(), 1)
+                self.assertFalse(child0.isBodyLoaded())
+                # Delta saves don't read or overwrite unchanged lazy bodies.
+                child1.h = 'changed child 1'
+                child2.b = 'changed body 2\n'
+                self.assertTrue(fc.exportToSqlite(path))
+                self.assertFalse(child0.isBodyLoaded())
+                self.assertFalse(child1.isBodyLoaded())
+                rows = {gnx: (h, b) for gnx, h, b in conn.execute('select gnx, head, body from vnodes')}
+                self.assertEqual(rows[child0.gnx], ('child 0', 'body 0\n'))
+                self.assertEqual(rows[child1.gnx], ('changed child 1', 'body 1\n'))
+                self.assertEqual(rows[child2.gnx], ('child 2', 'changed body 2\n'))
+            finally:
+                fc.closeDbBodyConnection()
     #@+node:ekr.20210909194336.24: *3* TestFileCommands.test_fc_resolveArchivedPosition
     def test_fc_resolveArchivedPosition(self):
         c, root = self.c, self.root_p
@@ -297,6 +297,56 @@ class TestFind(LeoUnitTest):
         settings.find_text = 'not-found-xyzzy'
         x.do_find_all(settings)
 
+    #@+node:ekr.20240425054201.1: *4* TestFind.test_background_searches
+    def test_background_searches(self):
+        c, settings, x = self.c, self.settings, self.x
+        settings.find_text = 'def'
+        # A background find-all finds the same matches as find-all, one node per step.
+        expected = x.do_find_all(settings)
+        progress = []
+        search = x.start_find_all(settings, on_progress=lambda search, items: progress.extend(items), run=False)
+        search.time_slice = 0
+        steps = 0
+        while search.step():
+            steps += 1
+        self.assertTrue(steps > 1)
+        self.assertEqual(progress, search.results)
+        self.assertEqual(search.result['total_matches'], expected['total_matches'])
+        self.assertEqual(
+            [z['v'] for z in search.result['match_dict']],
+            [z['v'] for z in expected['match_dict']],
+        )
+        # Without an idle-time timer, background searches run to completion immediately.
+        for flatten in (False, True):
+            count = x.do_clone_find_all_flattened(settings) if flatten else x.do_clone_find_all(settings)
+            search = x.start_clone_find_all(settings, flatten=flatten)
+            self.assertTrue(search.done)
+            self.assertEqual(search.result, count)
+        # Cancel a search.
+        search = x.start_find_all(settings, run=False)
+        search.time_slice = 0
+        self.assertTrue(search.step())
+        self.assertTrue(x.cancel_background_search())
+        self.assertFalse(x.cancel_background_search())
+        self.assertFalse(search.step())
+        self.assertIsNone(search.result)
+        # A new search cancels a running search, but keeps the new search's limiters.
+        search = x.start_find_all(settings, run=False)
+        search.time_slice = 0
+        self.assertTrue(search.step())
+        settings.suboutline_only = True
+        x.init_ivars_from_settings(settings)
+        self.assertTrue(search.cancelled)
+        self.assertTrue(x.suboutline_only)
+        settings.suboutline_only = False
+        # Changing the outline cancels a search.
+        search = x.start_clone_find_all(settings, flatten=True, run=False)
+        search.time_slice = 0
+        self.assertTrue(search.step())
+        c.rootPosition().insertAfter()
+        self.assertFalse(search.step())
+        self.assertTrue(search.cancelled)
+        self.assertIsNone(x.background_search)
     #@+node:ekr.20210110073117.65: *4* TestFind.test_find-def
     def test_find_def(self):
         x = self.x
@@ -456,6 +456,56 @@ class TestGlobals(LeoUnitTest):
         self.assertEqual(d.get('encoding'), 'utf-8')
         self.assertEqual(d.get('comment'), 'a b c')
         assert not d.get('path'), d.get('path')
+    #@+node:ekr.20240424054814.1: *4* TestGlobals.test_g_get_directives_dict_cache
+    def test_g_get_directives_dict_cache(self):
+        c = self.c
+        p = c.p
+        p.b = '@language python\n'
+        d = g.get_directives_dict(p)
+        self.assertEqual(d, {'language': 'python'})
+        self.assertTrue(p.v in c.directivesCache)
+        # Changing the result does not change the cache.
+        d['language'] = 'rust'
+        self.assertEqual(g.get_directives_dict(p), {'language': 'python'})
+        # Setting the body invalidates the entry.
+        p.b = '@language rust\n'
+        self.assertFalse(p.v in c.directivesCache)
+        self.assertEqual(g.get_directives_dict(p), {'language': 'rust'})
+        # Entries are checked even if code sets v._bodyString directly.
+        p.v._bodyString = '@tabwidth -2\n'
+        self.assertEqual(g.get_directives_dict(p), {'tabwidth': '-2'})
+        # Deleting a node removes its entry.
+        child = p.insertAsLastChild()
+        child.h = '@path abc'
+        self.assertEqual(g.get_directives_dict(child), {'path': 'abc'})
+        child_v = child.v
+        child.doDelete()
+        self.assertFalse(child_v in c.directivesCache)
+        # Lists extend the cached lists of parents.
+        child = p.insertAsLastChild()
+        child.h = '@path abc'
+        grandchildren = [child.insertAsLastChild() for i in range(2)]
+        grandchildren[0].b = '@nocolor\n'
+        old_get_directives_dict = g.get_directives_dict
+        calls = []
+        g.get_directives_dict = lambda p: calls.append(p.copy()) or old_get_directives_dict(p)
+        try:
+            aList = g.get_directives_dict_list(grandchildren[0])
+            self.assertEqual(aList[:3], [{'nocolor': ''}, {'path': 'abc'}, {'tabwidth': '-2'}])
+            self.assertEqual(len(calls), len(aList))
+            calls.clear()
+            self.assertEqual(g.get_directives_dict_list(grandchildren[1])[:2], [{}, {'path': 'abc'}])
+            self.assertEqual(calls, [grandchildren[1]])
+            # Changing the result does not change the cache.
+            aList[1]['path'] = 'xyz'
+            self.assertEqual(g.get_directives_dict_list(grandchildren[0])[1], {'path': 'abc'})
+            # Changing an ancestor invalidates the lists.
+            child.h = '@path xyz'
+            self.assertEqual(g.get_directives_dict_list(grandchildren[0])[1], {'path': 'xyz'})
+            child.moveToRoot()
+            self.assertEqual(g.get_directives_dict_list(child.firstChild())[1:], [{'path': 'xyz'}])
+        finally:
+            g.get_directives_dict = old_get_directives_dict
     #@+node:ekr.20210905203541.17: *4* TestGlobals.test_g_getDocString
     def test_g_getDocString(self):
         s1 = 'no docstring'
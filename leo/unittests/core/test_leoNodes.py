@@ -3,6 +3,7 @@
 """Tests of leoNodes.py"""
 
 from leo.core import leoGlobals as g
+from leo.core import leoNodes
 from leo.core.leoTest2 import LeoUnitTest
 
 #@+others
@@ -104,6 +105,53 @@ class TestNodes(LeoUnitTest):
         self.assertTrue(child > p)
         self.assertTrue(grandChild > child)
     #@+node:ekr.20220306073015.1: *3* TestNodes: Commander methods
+    #@+node:ekr.20240424064403.1: *4* TestNodes.test_c_flatOutline
+    def test_c_flatOutline(self):
+        c = self.c
+        # Create clones.
+        c.rootPosition().firstChild().clone().moveToLastChildOf(c.rootPosition())
+
+        def check():
+            flat = c.flatOutline()
+            self.assertTrue(flat.isValid())
+            self.assertTrue(c.flatOutline() is flat)
+            positions = list(c.all_positions())
+            self.assertEqual(len(flat), len(positions))
+            self.assertEqual(list(flat.vnodes), [z.v for z in positions])
+            self.assertEqual(list(flat.levels), [z.level() for z in positions])
+            self.assertEqual(list(flat.childIndices), [z.childIndex() for z in positions])
+            for i, p in enumerate(positions):
+                self.assertEqual(flat.position(i), p)
+                after = p.nodeAfterTree()
+                end = flat.subtreeEnds[i]
+                self.assertEqual(flat.position(end) if end < len(flat) else None, after or None)
+                parent = flat.parents[i]
+                self.assertEqual(flat.position(parent) if parent > -1 else None, p.parent() or None)
+            self.assertEqual(flat.positions(), positions)
+            self.assertEqual(flat.positions(unique=True), list(c.all_unique_positions()))
+            self.assertEqual(flat.unique_nodes(), list(c.all_unique_nodes()))
+            self.assertEqual(
+                flat.positions(lambda v: v.h.startswith('child')),
+                [z for z in positions if z.h.startswith('child')])
+
+        check()
+        # Structure changes invalidate the snapshot.
+        flat = c.flatOutline()
+        p = c.rootPosition().insertAsLastChild()
+        self.assertFalse(flat.isValid())
+        check()
+        p.moveToFirstChildOf(c.rootPosition().next())
+        check()
+        # So does replacing the outline without changing the generation.
+        flat = c.flatOutline()
+        hidden_root = c.hiddenRootNode
+        generation = c.frame.tree.generation
+        children = hidden_root.children
+        hidden_root.children = [leoNodes.VNode(context=c)]
+        self.assertEqual(c.frame.tree.generation, generation)
+        self.assertFalse(flat.isValid())
+        self.assertEqual(len(c.flatOutline()), 1)
+        hidden_root.children = children
     #@+node:ekr.20210830095545.6: *4* TestNodes.test_c_positionExists
     def test_c_positionExists(self):
         c, p = self.c, self.c.p
@@ -0,0 +1,126 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20240424072644.1: * @file ../unittests/core/test_leoSearchIndex.py
+"""Tests of leoSearchIndex.py"""
+
+import re
+from leo.core.leoSearchIndex import SearchIndex, WordTable
+from leo.core.leoTest2 import LeoUnitTest
+
+#@+others
+#@+node:ekr.20240424073001.1: ** class TestSearchIndex(LeoUnitTest)
+class TestSearchIndex(LeoUnitTest):
+    """Unit tests for leoSearchIndex.py"""
+
+    def setUp(self):
+        super().setUp()
+        c = self.c
+        self.create_test_outline()
+        bodies = (
+            'def spam(eggs):\n    return eggs.upper()\n',
+            'Spam and eggs.\n',
+            'import os\nos.path.join(a, b)\n',
+            'x = 42\n',
+        )
+        for i, p in enumerate(c.all_unique_positions()):
+            p.b = bodies[i % len(bodies)]
+
+    #@+others
+    #@+node:ekr.20240424073318.1: *3* TestSearchIndex.test_find_candidates
+    def test_find_candidates(self):
+        c = self.c
+        index = SearchIndex(c)
+
+        def check():
+            vnodes = list(c.all_unique_nodes())
+            table = (
+                'spam', 'SPAM', 'eggs.up', 'pam', 'spa', 'ggs', 'os.path',
+                'h.jo', 'clone', 'e 1', 'child c', '42', 'x = 4', '(a, b)',
+            )
+            for s in table:
+                for head, body in ((True, False), (False, True), (True, True)):
+                    for whole_word in (True, False):
+                        candidates = index.find_candidates([s], head=head, body=body, whole_word=whole_word)
+                        pattern = re.escape(s)
+                        if whole_word:
+                            pattern = fr'(?<!\w){pattern}(?!\w)'
+                        for v in vnodes:
+                            texts = ([v.h] if head else []) + ([v.b] if body else [])
+                            if any(re.search(pattern, z, re.IGNORECASE) for z in texts):
+                                self.assertTrue(v in candidates, msg=(s, v.h, head, body))
+                        # The index must actually narrow the search.
+                        if s in ('spam', 'os.path', 'child c'):
+                            self.assertTrue(len(candidates) < len(vnodes), msg=s)
+            self.assertIsNone(index.find_candidates(['.*'], head=True, body=True))
+
+        check()
+        # Change nodes in several ways.
+        p = c.rootPosition().firstChild()
+        p.b = 'completely different'
+        p.v._headString = 'a new headline'  # Like FastAtRead.
+        p.next().doDelete()
+        c.rootPosition().insertAsLastChild().b = 'spam, spam, spam'
+        check()
+        self.assertEqual(set(index.entries), set(c.all_unique_nodes()))
+    #@+node:ekr.20240424122331.1: *3* TestSearchIndex.test_word_table
+    def test_word_table(self):
+        table = WordTable()
+        words = set()
+
+        def check():
+            for s in ('s', 'sp', 'spa', 'spam', 'am', 'pam', 'eggs', 'gg', 'x', 'zzz', 'spamspam'):
+                self.assertEqual(sorted(table.prefixed(s)), sorted(z for z in words if z.startswith(s)), msg=s)
+                self.assertEqual(sorted(table.suffixed(s)), sorted(z for z in words if z.endswith(s)), msg=s)
+                self.assertEqual(sorted(table.containing(s)), sorted(z for z in words if s in z), msg=s)
+
+        for word in ('spam', 'spammer', 'aspa', 'eggs', 'legs', 'x', 'spamspam', 'pampas'):
+            table.add(word)
+            words.add(word)
+        check()
+        # Small changes update the sorted lists and the trigrams in place.
+        for word in ('spammer', 'x'):
+            table.remove(word)
+            words.discard(word)
+        for word in ('spa', 'eggspam', 'x'):
+            table.add(word)
+            words.add(word)
+        check()
+        # Many changes rebuild the sorted lists.
+        for word in list(words):
+            table.remove(word)
+            words.discard(word)
+        for i in range(20):
+            word = f"spam{i}"
+            table.add(word)
+            words.add(word)
+        check()
+    #@+node:ekr.20240424073635.1: *3* TestSearchIndex.test_load_and_save
+    def test_load_and_save(self):
+        c = self.c
+        old_db, old_fn = c.db, c.mFileName
+        try:
+            c.db = {}
+            c.mFileName = 'test.leo'
+            index = SearchIndex(c)
+            candidates = index.find_candidates(['spam'])
+            index.save()
+            self.assertFalse(index.changed)
+            self.assertTrue(SearchIndex.cache_key in c.db)
+            # A new index uses the cached words of unchanged nodes.
+            c.rootPosition().firstChild().b = 'spam'
+            index2 = SearchIndex(c)
+            words = index2.words
+            changed_vnodes = []
+
+            def words_wrapper(s):
+                changed_vnodes.append(s)
+                return words(s)
+
+            index2.words = words_wrapper  # type:ignore
+            candidates2 = index2.find_candidates(['spam'])
+            self.assertEqual(candidates2, candidates | {c.rootPosition().firstChild().v})
+            self.assertEqual(len(changed_vnodes), 2)  # The headline and body of the changed node.
+        finally:
+            c.db, c.mFileName = old_db, old_fn
+    #@-others
+#@-others
+#@-leo
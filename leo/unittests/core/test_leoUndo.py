@@ -69,6 +69,71 @@ class TestUndo(LeoUnitTest):
         j = before.find('b = 3')
         func = c.addComments
         self.runTest(before, after, i, j, func)
+    #@+node:ekr.20240424083858.1: *3* TestUndo.test_body_delta
+    def test_body_delta(self):
+        c, p = self.c, self.c.p
+        u, w = c.undoer, c.frame.body.wrapper
+        lines = [f"line {i}\n" for i in range(1000)]
+        before = ''.join(lines)
+        lines[10] = 'changed\n'
+        lines[900:910] = []
+        after = ''.join(lines)
+        for old, new in ((before, after), (after, before), (before, ''), ('', before), (before, before + 'x')):
+            delta = u.computeBodyDelta(old, new)
+            self.assertEqual(u.expandBodyDelta(old, delta), (old, new))
+            self.assertEqual(u.expandBodyDelta(new, delta), (old, new))
+            self.assertIsNone(u.expandBodyDelta('unrelated', delta))
+        # Beads contain deltas, not bodies.
+        u.clearUndoState()
+        p.b = before
+        w.setAllText(before)
+        bunch = u.beforeChangeBody(p)
+        p.v.b = after
+        w.setAllText(after)
+        u.afterChangeBody(p, 'Change Body', bunch)
+        self.assertFalse(hasattr(bunch, 'oldBody') or hasattr(bunch, 'newBody'))
+        self.assertTrue(u.beadSize(bunch) < len(before) // 4)
+        u.undo()
+        self.assertEqual(p.b, before)
+        u.redo()
+        self.assertEqual(p.b, after)
+    #@+node:ekr.20240424084849.1: *3* TestUndo.test_change_tree
+    def test_change_tree(self):
+        c, u = self.c, self.c.undoer
+        self.create_test_outline()
+        root = self.root_p
+        c.selectPosition(root)
+
+        def outline():
+            # The order of v.parents does not matter.
+            parents = [sorted(z.parents, key=id) for z in c.all_unique_nodes()]
+            return [(p.level(), p.v, p.h, p.b) for p in c.all_positions()], parents
+
+        before = outline()
+        u.clearUndoState()
+        bunch = u.beforeChangeTree(root)
+        # Change the tree in several ways.
+        root.firstChild().b = 'changed'
+        root.firstChild().next().doDelete()
+        new = root.insertAsNthChild(1)
+        new.h = 'new node'
+        new.insertAsLastChild().h = 'new child'
+        root.lastChild().moveToNthChildOf(new, 0)
+        root.firstChild().clone()
+        root.v.children.reverse()  # Like sort.
+        self.assertEqual(0, c.checkOutline())
+        after = outline()
+        u.afterChangeTree(root, 'change-tree', bunch)
+        self.assertFalse(hasattr(bunch, 'oldTree'))
+        self.assertTrue(bunch.linkOps)
+        self.assertEqual(len(bunch.contents), 1)
+        for i in range(2):
+            u.undo()
+            self.assertEqual(0, c.checkOutline())
+            self.assertEqual(outline(), before)
+            u.redo()
+            self.assertEqual(0, c.checkOutline())
+            self.assertEqual(outline(), after)
     #@+node:ekr.20210906172626.3: *3* TestUndo.test_convertAllBlanks
     def test_convertAllBlanks(self):
         c = self.c
@@ -321,6 +386,33 @@ class TestUndo(LeoUnitTest):
         i, j = 10, 10
         func = c.line_to_headline
         self.runTest(before, after, i, j, func)
+    #@+node:ekr.20240424084215.1: *3* TestUndo.test_memory_budget
+    def test_memory_budget(self):
+        c, p = self.c, self.c.p
+        u, w = c.undoer, c.frame.body.wrapper
+        u.clearUndoState()
+        self.assertEqual(u.memoryUse(), 0)
+        for i in range(10):
+            bunch = u.beforeChangeBody(p)
+            p.v.b = f"{i}\n" * 1000
+            w.setAllText(p.b)
+            u.afterChangeBody(p, 'Change Body', bunch)
+        self.assertEqual(len(u.beads), 10)
+        size = u.memoryUse()
+        self.assertTrue(size > 0)
+        old_max = u.max_undo_stack_bytes
+        try:
+            u.max_undo_stack_bytes = size // 2
+            u.cutStack()
+            self.assertTrue(0 < len(u.beads) < 10)
+            self.assertEqual(u.bead, len(u.beads) - 1)
+            self.assertTrue(u.memoryUse() <= size // 2)
+            # The remaining beads still work.
+            while u.canUndo():
+                u.undo()
+            self.assertEqual(p.b, f"{9 - len(u.beads)}\n" * 1000)
+        finally:
+            u.max_undo_stack_bytes = old_max
     #@+node:ekr.20210906172626.15: *3* TestUndo.test_restore_marked_bits
     def test_restore_marked_bits(self):
         c, p = self.c, self.c.p
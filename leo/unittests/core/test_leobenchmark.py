@@ -0,0 +1,38 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20240424111951.1: * @file ../unittests/core/test_leobenchmark.py
+"""Tests of leobenchmark.py"""
+
+from leo.core import leobenchmark
+from leo.core.leoTest2 import LeoUnitTest
+
+#@+others
+#@+node:ekr.20240424112308.1: ** class TestBenchmark(LeoUnitTest)
+class TestBenchmark(LeoUnitTest):
+    """Unit tests for leobenchmark.py"""
+    #@+others
+    #@+node:ekr.20240424112625.1: *3* TestBenchmark.test_make_outline
+    def test_make_outline(self):
+        c = self.c
+        leobenchmark.make_outline(c, nodes=500, depth=4, seed=2)
+        positions = list(c.all_positions())
+        self.assertEqual(len(positions), 500)
+        self.assertEqual(max(p.level() for p in positions), 3)
+        self.assertTrue(c.checkOutline() == 0)
+        headlines = [p.h for p in positions]
+        # The same seed yields the same outline.
+        leobenchmark.make_outline(c, nodes=500, depth=4, seed=2)
+        self.assertEqual([p.h for p in c.all_positions()], headlines)
+    #@+node:ekr.20240424112625.2: *3* TestBenchmark.test_summarize
+    def test_summarize(self):
+        latencies = [i / 1000 for i in range(100, 0, -1)]  # 1 to 100 ms.
+        d = leobenchmark.summarize('get_body', latencies, [10] * 100, elapsed=2.0)
+        self.assertEqual(d["count"], 100)
+        self.assertEqual(d["rps"], 50.0)
+        self.assertAlmostEqual(d["p50_ms"], 50.0)
+        self.assertAlmostEqual(d["p99_ms"], 99.0)
+        self.assertAlmostEqual(d["max_ms"], 100.0)
+        self.assertEqual(d["bytes"], 10)
+        self.assertEqual(leobenchmark.percentile([], 99), 0.0)
+    #@-others
+#@-others
+#@-leo
@@ -2,8 +2,11 @@
 #@+node:ekr.20210820203000.1: * @file ../unittests/core/test_leoserver.py
 """Tests of leoserver.py"""
 
+import asyncio
 import json
 import os
+import threading
+from leo.core import leoGlobals
 import leo.core.leoserver as leoserver
 from leo.core.leoTest2 import LeoUnitTest
 
@@ -23,6 +26,8 @@ class TestLeoServer(LeoUnitTest):
     def setUpClass(cls):
         global g, g_leoserver, g_server
         g_leoserver = leoserver
+        # LeoServer replaces g.getScript and g.IdleTime.
+        cls.saved_functions = (leoGlobals.getScript, leoGlobals.IdleTime)
         g_server = leoserver.LeoServer(testing=True)
         g = g_server.g
         assert g
@@ -37,6 +42,7 @@ class TestLeoServer(LeoUnitTest):
             pass
         except leoserver.ServerError:  # pragma:no cover
             pass
+        leoGlobals.getScript, leoGlobals.IdleTime = cls.saved_functions
 
     def setUp(self):
         global g_server
@@ -110,6 +116,7 @@ class TestLeoServer(LeoUnitTest):
             # "remove_tag": {"tag": "testTag"},
             # "tag_node": {"tag": "testTag"},
             # "apply_config": {"config": {"whatever": True}},
+            "batch": {"actions": []},
             "get_focus": {"log": False},
             "set_body": {"body": "new body\n", 'gnx': "ekr.20061008140603"},
             "set_headline": {"name": "new headline"},
@@ -186,12 +193,22 @@ class TestLeoServer(LeoUnitTest):
         log = False
         # Open the file & create the StringFindTabManager.
         self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        # The find commands use the settings in the StringFindTabManager.
+        ftm = self.server.c.findCommands.ftm
+        ftm.set_find_text('def')
+        ftm.check_box_search_body.setCheckState(True)
+        ftm.check_box_search_headline.setCheckState(True)
         #
         # Batch find commands: The answer is a count of found nodes.
         for method in ('!find_all', '!clone_find_all', '!clone_find_all_flattened'):
             answer = self._request(method, {"log": log, "find_text": "def"})
             if log:
                 g.printObj(answer, tag=f"{tag}:{method}: answer")  # pragma: no cover
+            # Search in the background.
+            answer = self._request(method, {"log": log, "find_text": "def", "background": True})
+            assert answer["background"] and answer["started"], (method, answer)
+        answer = self._request("!cancel_search", {"log": log})
+        assert answer["cancelled"] is False, answer
         #
         # Find commands that may select text: The answer is (p, pos, newpos).
         for method in ('!find_next', '!find_previous', '!find_def', '!find_var'):
@@ -210,7 +227,322 @@ class TestLeoServer(LeoUnitTest):
             answer = self._request(method, {"log": log, "tag": "my-tag"})
             if log:
                 g.printObj(answer, tag=f"{tag}:{method}: answer")  # pragma: no cover
+    #@+node:ekr.20240424092813.1: *3* TestLeoServer.test_change_feed
+    def test_change_feed(self):
+        test_dot_leo = g.finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        c = self.server.c
+        try:
+            v0 = self._request("!get_structure", {"log": False})["version"]
+            answer = self._request("!get_changes_since", {"log": False, "version": v0})
+            self.assertEqual(answer["version"], v0)
+            self.assertFalse(answer["inserted"] or answer["headlines"] or answer["children"])
+            # Insert a node and change another.
+            root = c.rootPosition()
+            self._request("!insert_node", {"log": False})
+            new_p = c.p.copy()
+            root.h = 'changed headline'
+            root.b = 'changed body'
+            answer = self._request("!get_changes_since", {"log": False, "version": v0})
+            v1 = answer["version"]
+            self.assertTrue(v1 > v0)
+            self.assertEqual(answer["inserted"], [new_p.gnx])
+            self.assertEqual(answer["headlines"][root.gnx], 'changed headline')
+            self.assertTrue(root.gnx in answer["bodies"])
+            parent_gnx = new_p._parentVnode().gnx
+            self.assertEqual(answer["children"][parent_gnx], [z.gnx for z in new_p._parentVnode().children])
+            # Move the new node.
+            new_p.moveToFirstChildOf(root)
+            answer = self._request("!get_changes_since", {"log": False, "version": v1})
+            self.assertEqual(answer["moved"], [new_p.gnx])
+            answer = self._request("!get_changes_since", {"log": False, "version": v0})
+            self.assertEqual(answer["inserted"], [new_p.gnx])
+            self.assertEqual(answer["moved"], [])
+            # Delete the new node.
+            new_p.doDelete()
+            answer = self._request("!get_changes_since", {"log": False, "version": v0})
+            self.assertFalse(answer["inserted"] or answer["deleted"])
+            answer = self._request("!get_changes_since", {"log": False, "version": v1})
+            self.assertEqual(answer["deleted"], [new_p.gnx])
+            # Setters record changes that don't change the structure.
+            v2 = self._request("!get_changes_since", {"log": False, "version": v1})["version"]
+            root.b = root.b
+            self.assertEqual(self._request("!get_changes_since", {"log": False, "version": v2})["version"], v2)
+            root.v.setMarked()
+            answer = self._request("!get_changes_since", {"log": False, "version": v2})
+            self.assertEqual(answer["flags"], {root.gnx: {"dirty": root.isDirty(), "expanded": root.isExpanded(), "marked": True}})
+            self.assertFalse(answer["bodies"] or answer["headlines"] or answer["children"])
+            # Syncs never load lazy bodies.
+            lazy_v = root.next().v
+            body = lazy_v.b
+            del lazy_v._bodyString  # As fc.retrieveVnodesFromDb does.
+            try:
+                lazy_v.h = 'lazy'
+                root.insertAsLastChild()
+                answer = self._request("!get_changes_since", {"log": False, "version": v2})
+                self.assertFalse(lazy_v.isBodyLoaded())
+                self.assertEqual(answer["headlines"][lazy_v.gnx], 'lazy')
+                self.assertFalse(lazy_v.gnx in answer["bodies"])
+            finally:
+                lazy_v._bodyString = body
+            # The client must re-fetch the outline.
+            answer = self._request("!get_changes_since", {"log": False, "version": -1})
+            self.assertTrue(answer["reset"])
+        finally:
+            self._request("!close_file", {"log": False, "forced": True})
+    #@+node:ekr.20240424101054.2: *3* TestLeoServer.test_position_handles
+    def test_position_handles(self):
+        server = self.server
+        test_dot_leo = g.finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        c = server.c
+        try:
+            # Handles are issued only on request.
+            children = self._request("!get_children", {"log": False})["children"]
+            self.assertFalse(any("handle" in z for z in children))
+            children = self._request("!get_children", {"log": False, "handles": True})["children"]
+            handles = [z["handle"] for z in children]
+            self.assertEqual(len(set(handles)), len(handles))
+            # Handles are stable while the structure doesn't change.
+            again = self._request("!get_children", {"log": False, "handles": True})["children"]
+            self.assertEqual([z["handle"] for z in again], handles)
+            # Resolve aps containing only a handle.
+            p = c.rootPosition().next()
+            self.assertEqual(server._ap_to_p({"handle": handles[1]}, c), p)
+            self.assertEqual(server._ap_to_p(children[1], c), p)
+            # Responses contain the handle of the current position.
+            node = self._request("!set_current_position", {"log": False, "ap": children[1]})["node"]
+            self.assertEqual(node["handle"], handles[1])
+            # Structure changes invalidate handles.
+            c.rootPosition().insertAfter()
+            p = c.rootPosition().next().next()
+            self.assertEqual(server._ap_to_p({"handle": handles[1]}, c), None)
+            self.assertEqual(server._ap_to_p(server._p_to_ap(p), c), p)
+            # The first resolution of a handle checks all links of the stack.
+            parent = next(z for z in c.rootPosition().self_and_siblings() if z.hasChildren())
+            ap = server._p_to_ap(parent)
+            child = self._request("!get_children", {"log": False, "handles": True, "ap": ap})["children"][0]
+            children_v = c.hiddenRootNode.children
+            i = parent._childIndex
+            j = 0 if i else 1
+            children_v[i], children_v[j] = children_v[j], children_v[i]
+            self.assertEqual(server._ap_to_p({"handle": child["handle"]}, c), None)
+            children_v[i], children_v[j] = children_v[j], children_v[i]
+            self.assertEqual(server._ap_to_p({"handle": child["handle"]}, c), parent.firstChild())
+            # Later resolutions trust the handle.
+            old_positionExists = c.positionExists
+            calls = []
+            c.positionExists = lambda p: calls.append(p) or old_positionExists(p)
+            try:
+                p = server._get_p({"ap": {"handle": child["handle"]}})
+                self.assertEqual(p, parent.firstChild())
+                self.assertEqual(calls, [])
+                # Until the structure changes.
+                c.frame.tree.generation += 1
+                self.assertEqual(server._position_exists(p, c), True)
+                self.assertEqual(len(calls), 1)
+                self.assertEqual(server._ap_to_p({"handle": child["handle"]}, c), None)
+            finally:
+                del c.positionExists
+            # Only the newest handles are remembered.
+            position_handles = server._get_position_handles(c)
+            position_handles.max_handles = 2
+            try:
+                children = self._request("!get_children", {"log": False, "handles": True})["children"]
+                self.assertEqual(len(position_handles.positions), 2)
+                self.assertEqual(server._ap_to_p({"handle": children[0]["handle"]}, c), None)
+                self.assertEqual(server._ap_to_p({"handle": children[-1]["handle"]}, c), list(c.rootPosition().self_and_siblings())[-1])
+            finally:
+                del position_handles.max_handles
+        finally:
+            self._request("!close_file", {"log": False, "forced": True})
+    #@+node:ekr.20240424100103.1: *3* TestLeoServer.test_paged_getters
+    def test_paged_getters(self):
+        test_dot_leo = g.finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        c = self.server.c
+        try:
+            for i, p in enumerate(c.all_positions()):
+                if i % 3 == 2:
+                    p.contract()
+                else:
+                    p.expand()
+            # Leo's own visible positions.
+            expected = []
+            p = c.rootPosition()
+            while p:
+                expected.append(p.gnx)
+                p.moveToVisNext(c)
+            # Get all rows, a page at a time.
+            rows = []
+            param = {"log": False, "count": 7}
+            while True:
+                answer = self._request("!get_visible_rows", param)
+                self.assertEqual(answer["start"], len(rows))
+                self.assertEqual(answer["total"], len(expected))
+                if not answer["rows"]:
+                    break
+                rows.extend(answer["rows"])
+                param["after"] = answer["rows"][-1]
+            self.assertEqual([z["gnx"] for z in rows], expected)
+            self.assertEqual(rows[0]["level"], 0)
+            self.assertTrue(len(expected) > 4)
+            # Cursors stay valid when rows are inserted before them.
+            n = len(expected) // 2
+            c.rootPosition().insertAfter()
+            answer = self._request("!get_visible_rows", {"log": False, "count": 2, "after": rows[n]})
+            self.assertEqual(answer["start"], n + 2)
+            self.assertEqual([z["gnx"] for z in answer["rows"]], expected[n + 1 : n + 3])
+            # A stale cursor falls back to "start".
+            answer = self._request("!get_visible_rows", {"log": False, "start": 3, "after": {"gnx": "xyzzy"}})
+            self.assertEqual(answer["start"], 3)
+            # Pages of children.
+            all_children = self._request("!get_children", {"log": False})["children"]
+            answer = self._request("!get_children", {"log": False, "start": 1, "count": 2})
+            self.assertEqual(answer["children"], all_children[1:3])
+            self.assertEqual(answer["total"], len(all_children))
+            answer = self._request("!get_children", {"log": False, "after": all_children[0]})
+            self.assertEqual(answer["children"], all_children[1:])
+            # An explicit count of zero returns only the total.
+            answer = self._request("!get_children", {"log": False, "count": 0})
+            self.assertEqual(answer["children"], [])
+            self.assertEqual(answer["total"], len(all_children))
+        finally:
+            self._request("!close_file", {"log": False, "forced": True})
+    #@+node:ekr.20240424103353.1: *3* TestLeoServer.test_batch
+    def test_batch(self):
+        test_dot_leo = g.finalize_join(g.app.loadDir, '..', 'test', 'test.leo')
+        self._request("!open_file", {"log": False, "filename": test_dot_leo})
+        c = self.server.c
+        u = c.undoer
+        try:
+            root = c.rootPosition()
+            c.selectPosition(root)
+            old_h, old_b, n = root.h, root.b, len(list(c.all_positions()))
+            actions = [
+                {"action": "!set_headline", "param": {"name": "batch headline"}},
+                {"action": "!set_body", "param": {"body": "batch body", "gnx": root.gnx}},
+                {"action": "!insert_node", "param": {}},
+                {"action": "!get_ui_states", "param": {}},
+            ]
+            answer = self._request("!batch", {"log": False, "actions": actions})
+            self.assertEqual(answer["errors"], [])
+            self.assertEqual(len(answer["results"]), 4)
+            self.assertTrue("node" in answer)
+            self.assertFalse(any("node" in z for z in answer["results"]))
+            self.assertEqual((root.h, root.b), ("batch headline", "batch body"))
+            self.assertEqual(len(list(c.all_positions())), n + 1)
+            # One undo reverts the whole batch.
+            self._request("!undo", {"log": False})
+            self.assertEqual((root.h, root.b), (old_h, old_b))
+            self.assertEqual(len(list(c.all_positions())), n)
+            # Actions that create their own undo groups.
+            grouped_actions = [
+                {"action": "!set_headline", "param": {"name": "batch headline"}},
+                {"action": "!set_body", "param": {"body": "        indented\n", "gnx": root.gnx}},
+                {"action": "-convert-all-blanks", "param": {}},
+            ]
+            for on_error, extra_actions in (("stop", []), ("rollback", [{"action": "!xyzzy"}])):
+                c.selectPosition(root)
+                answer = self._request("!batch", {
+                    "log": False, "actions": grouped_actions + extra_actions, "on_error": on_error,
+                })
+                self.assertEqual(len(answer["results"]), 3, msg=on_error)
+                if on_error == "stop":
+                    self.assertEqual(root.h, "batch headline")
+                    self.assertTrue(root.b.startswith("\t"), msg=repr(root.b))
+                    self._request("!undo", {"log": False})
+                self.assertEqual((root.h, root.b), (old_h, old_b), msg=on_error)
+            # Errors.
+            bad_actions = actions[:1] + [{"action": "!xyzzy"}] + actions[2:]
+            for on_error, n_results, headline in (
+                ("stop", 1, "batch headline"),
+                ("continue", 3, "batch headline"),
+                ("rollback", 1, old_h),
+            ):
+                c.selectPosition(root)
+                answer = self._request("!batch", {"log": False, "actions": bad_actions, "on_error": on_error})
+                self.assertEqual(len(answer["results"]), n_results, msg=on_error)
+                self.assertEqual(answer["errors"][0]["index"], 1)
+                self.assertEqual(root.h, headline, msg=on_error)
+                if u.canUndo() and on_error != "rollback":
+                    self._request("!undo", {"log": False})
+                self.assertEqual(root.h, old_h, msg=on_error)
+                self.assertFalse(u.canRedo() and on_error == "rollback")
+        finally:
+            self._request("!close_file", {"log": False, "forced": True})
+    #@+node:ekr.20240424094438.1: *3* TestLeoServer.test_concurrent_requests
+    def test_concurrent_requests(self):
+        server = self.server
+        event = threading.Event()
+        packages = []
 
+        def slow_action(param):
+            self.assertTrue(event.wait(10))  # Wait until the test has checked the getters.
+            return server._make_minimal_response({"slow": True})
+
+        async def run(read_only):
+            event.clear()
+            server.read_only_long_actions = {'!slow_action'} if read_only else set()
+            d = {"id": 1, "action": "!slow_action", "param": {}}
+            slow_task = asyncio.create_task(server._do_message_async(d, 'client1'))
+            await asyncio.sleep(0)  # Start the slow action.
+            # Other commands wait for the slow action.
+            d = {"id": 2, "action": "!set_ask_result"}
+            write_task = asyncio.create_task(server._do_message_async(d, 'client2'))
+            # Getters wait for their client's own actions.
+            d = {"id": 3, "action": "!get_version"}
+            getter1 = asyncio.create_task(server._do_message_async(d, 'client2'))
+            # Other getters wait only for long actions that change the outline.
+            d = {"id": 4, "action": "!get_version"}
+            getter2 = asyncio.create_task(server._do_message_async(d, 'client3'))
+            await asyncio.sleep(0.05)
+            self.assertEqual(getter2.done(), read_only)
+            self.assertFalse(slow_task.done() or write_task.done() or getter1.done())
+            event.set()
+            slow = await slow_task
+            with self.assertRaises(leoserver.ServerError):
+                await write_task  # set_ask_result requires a result param.
+            return [json.loads(await z) for z in (slow_task, getter1, getter2)]
+
+        server.slow_action = slow_action
+        server.long_actions = {'!slow_action'}
+        server._send_async_output = lambda package, toAll=False: packages.append(package)  # type:ignore
+        loop = asyncio.new_event_loop()  # Don't replace the loop containing the server's idle-time task.
+        try:
+            for read_only in (True, False):
+                slow, getter1, getter2 = loop.run_until_complete(run(read_only))
+                # Each thread has its own request state.
+                self.assertEqual(slow, {"id": 1, "slow": True})
+                self.assertEqual((getter1["id"], getter2["id"]), (3, 4))
+        finally:
+            loop.close()
+            del server.slow_action, server.long_actions, server.read_only_long_actions, server._send_async_output
+        self.assertEqual(server.pending_writes, {})
+        states = [z["state"] for z in packages if z["id"] == 1]
+        self.assertEqual((states[0], states[-1]), ("started", "finished"))
+        self.assertTrue(all(z["async"] == "progress" for z in packages))
+    #@+node:ekr.20240424090157.1: *3* TestLeoServer.test_json_encoding
+    def test_json_encoding(self):
+        server = self.server
+        c = server.dummy_c
+        p = c.rootPosition()
+        obj = {'set': {1}, 'p': p, 'v': p.v, 'tuple': (1, 'two'), 'unicode': 'Ω\ud800', 1: None}
+        expected = json.loads(json.dumps(obj, cls=leoserver.SetEncoder))
+        old_orjson = leoserver.orjson
+        try:
+            for orjson in (old_orjson, None):
+                leoserver.orjson = orjson
+                self.assertEqual(json.loads(leoserver.to_json(obj)), expected)
+                with self.assertRaises(TypeError):
+                    leoserver.to_json({'bad': object()})
+                # Responses omit values that can't be serialized.
+                server.current_id = 42
+                self.assertEqual(json.loads(server._make_minimal_response({'bad': object()})), {'id': 42})
+                answer = json.loads(server._make_minimal_response({'value': obj}))
+                self.assertEqual(answer, {'id': 42, 'value': expected})
+        finally:
+            leoserver.orjson = old_orjson
     #@-others
 #@-others
 
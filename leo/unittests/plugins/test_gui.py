@@ -83,6 +83,85 @@ class TestQtGui(LeoUnitTest):
 
         def test_do_nothing3(self):
             time.sleep(0.1)
+    #@+node:ekr.20240424114430.1: *3* TestQtGui.test_color_cache
+    def test_color_cache(self):
+        c, p = self.c, self.c.p
+        colorizer = c.frame.body.colorizer
+        colorizer.color_cache_lines = 1000
+        widget = c.frame.body.wrapper.widget
+        document = widget.document()
+        lines = []
+        mainLoop = colorizer.mainLoop
+
+        def mainLoop_wrapper(n, s):
+            lines.append(s)
+            mainLoop(n, s)
+
+        colorizer.mainLoop = mainLoop_wrapper
+
+        def get_colors():
+            result = []
+            for i in range(document.blockCount()):
+                block = document.findBlockByNumber(i)
+                ranges = [(z.start, z.length, z.format) for z in block.layout().formats()]
+                result.append((block.userState(), ranges))
+            return result
+
+        p.b = '@language python\n' + 'def spam(a):\n    """Doc\n    string."""\n    return a  # Comment.\n' * 10
+        widget.setPlainText(p.b)
+        expected = get_colors()
+        self.assertTrue(lines)
+        # Recoloring an unchanged body replays the cached colors.
+        lines.clear()
+        colorizer.colorize(p)
+        self.assertEqual(lines, [])
+        self.assertEqual(get_colors(), expected)
+        # Changing the body colors all changed lines.
+        widget.textCursor().insertText('# ')
+        self.assertEqual(lines[0], '# @language python')
+        # Changing a setting invalidates the cache.
+        lines.clear()
+        colorizer.clear_formats()
+        colorizer.colorize(p)
+        self.assertEqual(len(lines), document.blockCount() - 1)
+    #@+node:ekr.20240424115212.11: *3* TestQtGui.test_progressive_coloring
+    def test_progressive_coloring(self):
+        c, p = self.c, self.c.p
+        colorizer = c.frame.body.colorizer
+        colorizer.color_cache_lines = 0
+        widget = c.frame.body.wrapper.widget
+        document = widget.document()
+
+        def get_colors():
+            result = []
+            for i in range(document.blockCount()):
+                block = document.findBlockByNumber(i)
+                ranges = [(z.start, z.length, z.format) for z in block.layout().formats()]
+                result.append((block.userState(), ranges))
+            return result
+
+        p.b = '@language python\n' + 'def spam(a):\n    """Doc\n    string."""\n    return a  # Comment.\n' * 10
+        colorizer.progressive_lines = 0
+        widget.setPlainText(p.b)
+        expected = get_colors()
+        # Defer coloring all lines.
+        colorizer.progressive_lines = 10
+        colorizer.color_time_slice = 0
+        widget.setPlainText(p.b)
+        self.assertEqual(colorizer.progressive_v, p.v)
+        self.assertEqual(colorizer.progressive_limit, 0)
+        n_lines = document.blockCount()
+        self.assertEqual([state for state, ranges in get_colors()[1:]], [-1] * (n_lines - 1))
+        # Each step colors at least one line, in order.
+        n_steps = 0
+        while colorizer.progressive_step():
+            n_steps += 1
+        self.assertTrue(1 < n_steps < n_lines)
+        self.assertEqual(get_colors(), expected)
+        # Selecting another node abandons progressive coloring.
+        widget.setPlainText(p.b)
+        c.selectPosition(p.insertAfter())
+        self.assertFalse(colorizer.progressive_step())
     #@+node:ekr.20210912064439.2: *3* TestQtGui.test_qt_ctors_for_all_dialogs
     def test_qt_ctors_for_all_dialogs(self):
         # Make sure the dialogs don't crash.